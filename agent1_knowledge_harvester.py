@@ -5,7 +5,7 @@ Crawls and collects OneStream-related content from the web
 import json
 import logging
 import time
-from typing import List, Dict, Optional
+from typing import Dict, Iterator, List, Optional
 from dataclasses import dataclass, asdict
 from datetime import datetime
 import requests
@@ -206,6 +206,15 @@ class KnowledgeHarvester:
 
     def harvest(self, urls: List[str]) -> List[KnowledgeDocument]:
         """Main harvesting method"""
+        for _ in self.iter_harvest(urls):
+            pass
+        return self.documents
+
+    def iter_harvest(self, urls: List[str]) -> Iterator[KnowledgeDocument]:
+        """
+        Harvest lazily, yielding each document as soon as it is processed
+        (documents are also collected in self.documents for saving)
+        """
         logger.info("Starting knowledge harvesting...")
 
         all_urls = set(urls)
@@ -224,10 +233,10 @@ class KnowledgeHarvester:
             doc = self.process_url(url)
             if doc:
                 self.documents.append(doc)
+                yield doc
             time.sleep(config.CRAWL_DELAY)
 
         logger.info(f"Harvested {len(self.documents)} documents")
-        return self.documents
 
     def save_knowledge_base(self, output_path: str):
         """Save knowledge base to JSON"""
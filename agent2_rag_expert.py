@@ -3,7 +3,8 @@ Agent 2: OneStream RAG Expert Assistant
 Uses retrieval-augmented generation to answer OneStream questions
 """
 import logging
-from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Iterator
 from openai import OpenAI
 from vector_store import VectorStore
 import config
@@ -11,6 +12,8 @@ import config
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+NO_CONTEXT_ANSWER = "I couldn't find relevant information in the knowledge base to answer your question. This might mean:\n\n1. The information isn't in the uploaded documents\n2. The documents haven't been embedded yet - try running: `python reembed_all_documents.py`\n3. The question phrasing doesn't match the document content\n\nPlease try rephrasing your question or ensure the relevant documents are uploaded and embedded."
+
 
 class OneStreamExpert:
     """Agent 2: RAG-based expert assistant using Grok-4"""
@@ -57,6 +60,18 @@ Response guidelines:
 CRITICAL: Your primary goal is ACCURACY. If the answer is in the provided context, you MUST find it and present it completely.
 """
 
+    def warmup(self):
+        """
+        Pay one-time startup costs before the first real question: the first
+        embedding forward pass (tokenizer load, kernel setup) and the TLS
+        connection to the LLM API
+        """
+        self.vector_store.embedder.encode(["warmup"], batch_size=1)
+        try:
+            self.client.models.list()
+        except Exception as e:
+            logger.warning(f"LLM connection warmup failed: {e}")
+
     def retrieve_context(self, query: str, top_k: int = config.TOP_K_RESULTS) -> Dict:
         """
         Retrieve relevant context from vector database
@@ -66,7 +81,10 @@ CRITICAL: Your primary goal is ACCURACY. If the answer is in the provided contex
 
         # Search vector store
         results = self.vector_store.search(query, top_k=top_k)
+        return self._format_context(results)
 
+    def _format_context(self, results: List[Dict]) -> Dict:
+        """Filter search results by relevance and format them as context and citations"""
         logger.info(f"Retrieved {len(results)} chunks from vector store")
 
         if not results:
@@ -78,9 +96,10 @@ CRITICAL: Your primary goal is ACCURACY. If the answer is in the provided contex
             distances = [r.get('distance', 999) for r in results]
             logger.info(f"Chunk distances: min={min(distances):.3f}, max={max(distances):.3f}, avg={sum(distances)/len(distances):.3f}")
 
-        # Filter by relevance threshold - distance < 1.5 is generally acceptable
+        # Filter by relevance threshold - inner-product distance (1 - cosine
+        # similarity) < 0.75, the same cutoff as the old squared-L2 1.5 on unit vectors
         # Lower distance = more similar (relaxed threshold for better recall)
-        RELEVANCE_THRESHOLD = 1.5
+        RELEVANCE_THRESHOLD = 0.75
         relevant_results = [r for r in results if r.get('distance', 999) < RELEVANCE_THRESHOLD]
 
         logger.info(f"After relevance filtering: {len(relevant_results)} chunks passed threshold")
@@ -90,34 +109,43 @@ CRITICAL: Your primary goal is ACCURACY. If the answer is in the provided contex
             relevant_results = results[:max(3, len(results) // 2)]
             logger.info(f"No chunks passed threshold - using top {len(relevant_results)} results anyway")
 
-        # Format context
+        # Format context as self-contained blocks in a canonical (url, chunk) order,
+        # without per-query scores, so the same retrieved set always yields the
+        # same prompt bytes and the LLM server's prefix (KV) cache can be reused
+        canonical_results = sorted(
+            relevant_results,
+            key=lambda r: (r['metadata']['url'], r['metadata'].get('chunk_index', 0))
+        )
         context_parts = []
+        for result in canonical_results:
+            metadata = result['metadata']
+            doc_id = f"{metadata['url']}#{metadata.get('chunk_index', 0)}"
+            context_parts.append(
+                f"<<<DOC id={doc_id} title={metadata['document_title']}>>>\n"
+                f"{result['content'].strip()}\n"
+                f"<<<END>>>"
+            )
+
         citations = []
         seen_urls = set()
 
-        for idx, result in enumerate(relevant_results):
+        for result in relevant_results:
             metadata = result['metadata']
-            content = result['content']
             distance = result.get('distance', 0)
 
-            # Add to context with relevance info
-            context_parts.append(f"""
-[Source {idx + 1}: {metadata['document_title']} | Relevance: {1 / (1 + distance):.2f}]
-{content}
-""")
-
-            # Track citations (avoid duplicates)
+            # Track citations (avoid duplicates). Scored on the squared-L2 scale
+            # the confidence cutoffs were tuned on: 2 * (1 - cos) for unit vectors
             url = metadata['url']
             if url not in seen_urls:
                 citations.append({
                     "title": metadata['document_title'],
                     "url": url,
                     "source_type": metadata['source_type'],
-                    "relevance_score": 1 / (1 + distance)
+                    "relevance_score": 1 / (1 + 2 * distance)
                 })
                 seen_urls.add(url)
 
-        context = "\n---\n".join(context_parts)
+        context = "\n\n".join(context_parts)
 
         # Return all unique citations (dynamic based on relevant sources found)
         return {
@@ -155,46 +183,52 @@ CRITICAL: Your primary goal is ACCURACY. If the answer is in the provided contex
 
         return variations
 
-    def answer_question(self, question: str, model: str = "grok-4-0709") -> Dict:
+    def _select_context(self, question: str,
+                        search_results: Optional[Dict[str, List[Dict]]] = None) -> Optional[Dict]:
         """
-        Answer a question using RAG pipeline with query expansion
-        Returns: {answer, citations, confidence}
+        Run retrieval for every query variation and keep the best result
+        search_results optionally maps query text -> already fetched search hits
+        Returns None when no variation produced any context
         """
-        logger.info(f"Processing question: {question}")
-
         # Try multiple query variations for better retrieval
         query_variations = self.expand_query(question)
         logger.info(f"Query variations: {query_variations}")
 
+        # Search all variations with one encode pass and one vector DB query
+        if search_results is None and hasattr(self.vector_store, "search_batch"):
+            search_results = dict(zip(query_variations, self.vector_store.search_batch(query_variations)))
+
         all_results = []
         for query_var in query_variations:
-            retrieval_result = self.retrieve_context(query_var)
+            if search_results is not None and query_var in search_results:
+                retrieval_result = self._format_context(search_results[query_var])
+            else:
+                retrieval_result = self.retrieve_context(query_var)
             if retrieval_result['context']:
                 all_results.append(retrieval_result)
 
-        # Use the result with most citations, or first non-empty
         if not all_results:
             logger.warning(f"No context found for any query variation. Total chunks in DB may be insufficient.")
-            return {
-                "answer": "I couldn't find relevant information in the knowledge base to answer your question. This might mean:\n\n1. The information isn't in the uploaded documents\n2. The documents haven't been embedded yet - try running: `python reembed_all_documents.py`\n3. The question phrasing doesn't match the document content\n\nPlease try rephrasing your question or ensure the relevant documents are uploaded and embedded.",
-                "citations": [],
-                "confidence": "low"
-            }
+            return None
 
         # Pick the best result (most citations)
         retrieval_result = max(all_results, key=lambda x: len(x['citations']))
-        context = retrieval_result['context']
-        citations = retrieval_result['citations']
+        logger.info(f"Using result with {len(retrieval_result['citations'])} citations")
+        return retrieval_result
 
-        logger.info(f"Using result with {len(citations)} citations")
-
-        # Step 2: Build prompt with context
-        user_prompt = f"""You have been provided with relevant excerpts from the knowledge base below. Your task is to answer the question using ONLY the information in these excerpts.
+    def _build_user_prompt(self, question: str, context: str, conversation: str = "") -> str:
+        """
+        Build the user prompt with retrieved context
+        Stable parts come first (instructions, then canonically ordered context
+        blocks) and per-turn parts last, so consecutive prompts share a prefix.
+        Conversation history only goes to the LLM - retrieval uses the question alone
+        """
+        conversation_section = f"""Previous conversation (for resolving follow-up references only):
+{conversation}
 
-Question: {question}
+""" if conversation else ""
 
-Knowledge Base Context:
-{context}
+        return f"""You have been provided with relevant excerpts from the knowledge base below. Your task is to answer the question at the end using ONLY the information in these excerpts.
 
 Instructions:
 1. Read through ALL the context sources carefully
@@ -203,44 +237,84 @@ Instructions:
 4. Provide a complete, detailed answer with specific facts, examples, and explanations
 5. If you see the answer directly stated in the context, include it in your response
 6. Organize your answer clearly with proper structure
-7. Do NOT say information is missing if it's present in the context above
+7. Do NOT say information is missing if it's present in the context
+
+Knowledge Base Context (each source is delimited by <<<DOC ...>>> and <<<END>>>):
+{context}
+
+{conversation_section}Question: {question}
 
 Provide your comprehensive answer now:
 """
 
+    def _compute_confidence(self, citations: List[Dict]) -> str:
+        """Calculate confidence based on relevance scores"""
+        if not citations:
+            return "low"
+
+        avg_relevance = sum(c.get('relevance_score', 0) for c in citations) / len(citations)
+        if avg_relevance >= 0.7 and len(citations) >= 2:
+            return "high"
+        elif avg_relevance >= 0.5 or len(citations) >= 1:
+            return "medium"
+        return "low"
+
+    def _format_citations(self, citations: List[Dict]) -> str:
+        """Format citations as a markdown sources block"""
+        if not citations:
+            return ""
+
+        citations_text = "\n\n**Sources:**\n"
+        for idx, citation in enumerate(citations, 1):
+            citations_text += f"{idx}. [{citation['title']}]({citation['url']})\n"
+        return citations_text
+
+    def _chat_messages(self, user_prompt: str) -> List[Dict]:
+        """Chat completion messages for a built user prompt"""
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    def answer_question(self, question: str, model: str = "grok-4-0709",
+                        conversation: str = "",
+                        search_results: Optional[Dict[str, List[Dict]]] = None) -> Dict:
+        """
+        Answer a question using RAG pipeline with query expansion
+        Returns: {answer, citations, confidence}
+        """
+        logger.info(f"Processing question: {question}")
+
+        retrieval_result = self._select_context(question, search_results)
+        if retrieval_result is None:
+            return {
+                "answer": NO_CONTEXT_ANSWER,
+                "citations": [],
+                "confidence": "low"
+            }
+
+        context = retrieval_result['context']
+        citations = retrieval_result['citations']
+
+        # Step 2: Build prompt with context
+        user_prompt = self._build_user_prompt(question, context, conversation)
+
         # Step 3: Get response from Grok
         try:
             response = self.client.chat.completions.create(
                 model=model,
                 max_tokens=3000,
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
+                messages=self._chat_messages(user_prompt),
                 temperature=0.1  # Lower temperature for more factual, context-focused responses
             )
 
             answer = response.choices[0].message.content
 
             # Step 4: Calculate confidence based on relevance scores
-            if citations:
-                avg_relevance = sum(c.get('relevance_score', 0) for c in citations) / len(citations)
-                if avg_relevance >= 0.7 and len(citations) >= 2:
-                    confidence = "high"
-                elif avg_relevance >= 0.5 or len(citations) >= 1:
-                    confidence = "medium"
-                else:
-                    confidence = "low"
-            else:
-                confidence = "low"
+            confidence = self._compute_confidence(citations)
 
             # Step 5: Append citations
-            if citations:
-                citations_text = "\n\n**Sources:**\n"
-                for idx, citation in enumerate(citations, 1):
-                    citations_text += f"{idx}. [{citation['title']}]({citation['url']})\n"
-
-                answer += citations_text
+            answer += self._format_citations(citations)
 
             return {
                 "answer": answer,
@@ -256,6 +330,108 @@ Provide your comprehensive answer now:
                 "confidence": "error"
             }
 
+    def answer_questions(self, questions: List[str], model: str = "grok-4-0709",
+                         max_workers: int = 8) -> List[Dict]:
+        """
+        Answer several independent questions
+        Retrieval for every query variation of every question runs as one batched
+        search (when the vector store supports it); LLM calls run concurrently
+        Returns one {answer, citations, confidence} per question, in input order
+        """
+        if not questions:
+            return []
+
+        search_results = None
+        if hasattr(self.vector_store, "search_batch"):
+            variations = list(dict.fromkeys(
+                variation for question in questions for variation in self.expand_query(question)
+            ))
+            logger.info(f"Batched retrieval for {len(questions)} questions ({len(variations)} queries)")
+            search_results = dict(zip(variations, self.vector_store.search_batch(variations)))
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(questions))) as executor:
+            return list(executor.map(
+                lambda question: self.answer_question(question, model, search_results=search_results),
+                questions
+            ))
+
+    def answer_question_stream(self, question: str, model: str = "grok-4-0709",
+                               conversation: str = "") -> Iterator[Dict]:
+        """
+        Answer a question like answer_question, streaming the LLM output
+        Yields events in order:
+          {"type": "meta", "citations": [...], "confidence": str}
+          {"type": "token", "text": str} for each generated chunk
+          {"type": "done", "full_answer": str, "confidence": str}
+        The final confidence is "error" if generation failed
+        """
+        logger.info(f"Processing question (streaming): {question}")
+
+        retrieval_result = self._select_context(question)
+        if retrieval_result is None:
+            yield {"type": "meta", "citations": [], "confidence": "low"}
+            yield {"type": "token", "text": NO_CONTEXT_ANSWER}
+            yield {"type": "done", "full_answer": NO_CONTEXT_ANSWER, "confidence": "low"}
+            return
+
+        citations = retrieval_result['citations']
+        confidence = self._compute_confidence(citations)
+        user_prompt = self._build_user_prompt(question, retrieval_result['context'], conversation)
+
+        # Citation metadata is known before generation starts
+        yield {"type": "meta", "citations": citations, "confidence": confidence}
+
+        parts = []
+        try:
+            response = self.client.chat.completions.create(
+                model=model,
+                max_tokens=3000,
+                messages=self._chat_messages(user_prompt),
+                temperature=0.1,
+                stream=True
+            )
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    text = chunk.choices[0].delta.content
+                    parts.append(text)
+                    yield {"type": "token", "text": text}
+
+            citations_text = self._format_citations(citations)
+            if citations_text:
+                parts.append(citations_text)
+                yield {"type": "token", "text": citations_text}
+
+        except Exception as e:
+            logger.error(f"Error streaming answer: {e}")
+            confidence = "error"
+            error_text = f"\n\nError generating response: {str(e)}"
+            parts.append(error_text)
+            yield {"type": "token", "text": error_text}
+
+        yield {"type": "done", "full_answer": "".join(parts), "confidence": confidence}
+
+    def summarize(self, messages: List[Dict], model: str = "grok-4-0709") -> str:
+        """Summarize earlier chat turns into a short paragraph for conversation memory"""
+        transcript = "\n".join(
+            f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg.get('content', '')[:1000]}"
+            for msg in messages
+        )
+
+        try:
+            response = self.client.chat.completions.create(
+                model=model,
+                max_tokens=200,
+                messages=[{
+                    "role": "user",
+                    "content": f"Summarize this conversation in a few sentences, keeping the topics, entities and open questions:\n\n{transcript}"
+                }],
+                temperature=0.1
+            )
+            return response.choices[0].message.content.strip()
+        except Exception as e:
+            logger.error(f"Error summarizing conversation: {e}")
+            return ""
+
     def interactive_mode(self):
         """Run interactive Q&A session"""
         print("\n" + "="*60)
@@ -0,0 +1,153 @@
+"""
+Answer Cache
+Short-circuits the RAG pipeline for repeated or near-identical questions
+"""
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MAX_CACHED_ANSWERS = 512
+SEMANTIC_SIMILARITY_THRESHOLD = 0.93
+# Backstop for KB changes the version key cannot see
+ANSWER_TTL_SECONDS = 3600
+
+
+def quantize_int8(embedding: np.ndarray) -> Tuple[np.ndarray, float]:
+    """Symmetric per-vector int8 quantization; returns (codes, scale)"""
+    max_abs = float(np.abs(embedding).max())
+    scale = max_abs / 127 if max_abs else 1.0
+    return np.round(embedding / scale).astype(np.int8), scale
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, strip punctuation and collapse whitespace"""
+    return re.sub(r'\s+', ' ', re.sub(r'[^\w\s]', '', query.lower())).strip()
+
+
+class AnswerCache:
+    """
+    Two-tier (exact + semantic) cache of RAG answers
+    kb_version must identify the knowledge base state an answer was built
+    from across every session (see app_multiuser.answer_cache_version)
+    """
+
+    def __init__(self, maxsize: int = MAX_CACHED_ANSWERS,
+                 threshold: float = SEMANTIC_SIMILARITY_THRESHOLD,
+                 ttl: float = ANSWER_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.ttl = ttl
+        # key -> (stored at, answer)
+        self._answers: "OrderedDict[Tuple[str, str, str], Tuple[float, Dict]]" = OrderedDict()
+        # Unit-normalized question embeddings, int8-quantized with a per-vector scale
+        self._embeddings: Dict[Tuple[str, str, str], Tuple[np.ndarray, float]] = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key) -> Optional[Dict]:
+        """The answer stored under key, dropping it if it has expired (lock held)"""
+        entry = self._answers.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] >= self.ttl:
+            del self._answers[key]
+            self._embeddings.pop(key, None)
+            return None
+        self._answers.move_to_end(key)
+        return entry[1]
+
+    def _embed(self, embedding_model, normalized: str) -> Tuple[np.ndarray, float]:
+        # Unit-length straight from the encoder, so int8 dot products are cosines
+        embedding = embedding_model.encode([normalized], convert_to_numpy=True, normalize_embeddings=True)[0]
+        return quantize_int8(embedding.astype(np.float32, copy=False))
+
+    def get(self, username: str, kb_version: str, query: str,
+            embedding_model=None) -> Optional[Dict]:
+        """
+        Look up a cached answer for this user and KB version
+        Tries an exact match on the normalized query first, then (if an
+        embedding model is given) the most similar cached question
+        """
+        normalized = normalize_query(query)
+        if not normalized:
+            return None
+
+        key = (username, kb_version, normalized)
+        with self._lock:
+            result = self._live(key)
+            if result is not None:
+                logger.info(f"Answer cache hit (exact): {normalized}")
+                return result
+
+            candidates = [(k, emb) for k, emb in self._embeddings.items()
+                          if k[0] == username and k[1] == kb_version]
+
+        if embedding_model is None or not candidates:
+            return None
+
+        query_codes, query_scale = self._embed(embedding_model, normalized)
+        codes = np.stack([emb[0] for _, emb in candidates])
+        scales = np.array([emb[1] for _, emb in candidates], dtype=np.float32)
+        # Integer dot products, rescaled back to cosine similarity
+        scores = (codes.astype(np.int32) @ query_codes.astype(np.int32)) * scales * query_scale
+        best = int(np.argmax(scores))
+
+        if scores[best] < self.threshold:
+            return None
+
+        best_key = candidates[best][0]
+        with self._lock:
+            result = self._live(best_key)
+            if result is not None:
+                logger.info(f"Answer cache hit (semantic {scores[best]:.3f}): {normalized}")
+        return result
+
+    def put(self, username: str, kb_version: str, query: str, result: Dict,
+            embedding_model=None):
+        """Store an answer; errors are never cached"""
+        normalized = normalize_query(query)
+        if not normalized or result.get("confidence") == "error":
+            return
+
+        key = (username, kb_version, normalized)
+        embedding = self._embed(embedding_model, normalized) if embedding_model is not None else None
+
+        with self._lock:
+            self._answers[key] = (time.monotonic(), {
+                "answer": result["answer"],
+                "citations": result["citations"],
+                "confidence": result["confidence"]
+            })
+            self._answers.move_to_end(key)
+            if embedding is not None:
+                self._embeddings[key] = embedding
+
+            while len(self._answers) > self.maxsize:
+                evicted, _ = self._answers.popitem(last=False)
+                self._embeddings.pop(evicted, None)
+
+    def put_async(self, username: str, kb_version: str, query: str, result: Dict,
+                  embedding_model=None):
+        """Store an answer from a background thread (embedding the query off the hot path)"""
+        threading.Thread(
+            target=self.put,
+            args=(username, kb_version, query, result, embedding_model),
+            daemon=True
+        ).start()
+
+
+# Singleton instance
+_answer_cache = None
+
+def get_answer_cache() -> AnswerCache:
+    """Get or create AnswerCache singleton"""
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = AnswerCache()
+    return _answer_cache
@@ -4,14 +4,20 @@ BRAND NEW UI - Modern Design
 """
 import streamlit as st
 import os
-import json
+import threading
+from string import Template
 from datetime import datetime
 from pathlib import Path
-import PyPDF2
 import markdown
 from agent2_rag_expert import OneStreamExpert
 from multi_user_vector_store import MultiUserVectorStore
 from user_manager import get_user_manager
+from answer_cache import get_answer_cache
+from user_kb_store import UserKBStore, kb_index_path
+from kb_fingerprint import ADMIN_FINGERPRINT, fingerprint_path, kb_files_version, user_fingerprint
+from pdf_extraction import extract_pdf_text_cached
+from json_store import read_json
+from background_writer import get_background_writer
 import config
 
 # Initialize database on first run
@@ -36,7 +42,7 @@ st.set_page_config(
 )
 
 # BRAND NEW MODERN CSS
-st.markdown("""
+APP_CSS = """
 <style>
     @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap');
 
@@ -471,7 +477,8 @@ st.markdown("""
         color: #DC2626;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+st.markdown(APP_CSS, unsafe_allow_html=True)
 
 # Initialize session state
 if "authenticated" not in st.session_state:
@@ -488,25 +495,125 @@ if "expert" not in st.session_state:
     st.session_state.expert = None
 if "vector_store" not in st.session_state:
     st.session_state.vector_store = None
+if "is_admin" not in st.session_state:
+    st.session_state.is_admin = False
+if "kb_version" not in st.session_state:
+    st.session_state.kb_version = 0
 
 user_manager = get_user_manager()
+answer_cache = get_answer_cache()
+background_writer = get_background_writer()
+
+# HTML templates - static markup is built once; only the $fields vary per render
+HEADER_HTML_TEMPLATE = Template("""
+    <div class="modern-header">
+        <h1>✨ SmartDoc AI</h1>
+        <p class="tagline">Your Intelligent Knowledge Assistant</p>
+        <div class="user-chip">
+            <span class="name">Welcome, $full_name</span>
+            <span class="badge $badge_class">$role</span>
+        </div>
+    </div>
+    """)
+
+STAT_CARD_TEMPLATE = Template("""
+        <div class="modern-card">
+            <div class="icon">$icon</div>
+            <div class="title">$title</div>
+            <div class="value">$value</div>
+        </div>
+        """)
+
+CONFIDENCE_BADGE_TEMPLATE = Template("""
+    <div style="display: flex; justify-content: flex-start; margin-bottom: 10px;">
+        <div class="confidence-badge $confidence">
+            $confidence confidence
+        </div>
+    </div>
+    """)
+
+MESSAGE_TEMPLATE = Template("""
+    <div class="chat-wrapper $role">
+        <div class="chat-label $role">
+            <span class="avatar $role">$avatar_emoji</span>
+            <span>$label_text</span>
+        </div>
+        <div class="chat-bubble $role">
+            $html_content
+        </div>
+    </div>
+    """)
+
+def build_header_html(user_info: dict, is_admin: bool) -> str:
+    return HEADER_HTML_TEMPLATE.substitute(
+        full_name=user_info['full_name'],
+        badge_class='admin' if is_admin else '',
+        role=user_info['role']
+    )
 
 # Helper functions (keep all existing logic)
 def get_session_file_path(username: str) -> str:
+    # Legacy single-file layout, migrated on first load
     return str(Path(f"user_data/{username}/chat_sessions.json"))
 
+def get_sessions_index_path(username: str) -> Path:
+    return Path(f"user_data/{username}/sessions_index.json")
+
+def get_session_messages_path(username: str, session_id: str) -> Path:
+    return Path(f"user_data/{username}/sessions/{session_id}.json")
+
+def save_sessions_index(username: str, sessions: dict):
+    index = {
+        session_id: {key: value for key, value in session.items() if key != "messages"}
+        for session_id, session in sessions.items()
+    }
+    background_writer.submit(get_sessions_index_path(username), index)
+
+def load_session_messages(username: str, session_id: str) -> list:
+    messages_path = get_session_messages_path(username, session_id)
+    if messages_path.exists():
+        return read_json(messages_path)
+    return []
+
+def save_session_messages(username: str, session_id: str, messages: list):
+    # Queued, not written inline; repeated saves of one session coalesce
+    background_writer.submit(get_session_messages_path(username, session_id), messages)
+
+def delete_session(username: str, session_id: str):
+    del st.session_state.chat_sessions[username][session_id]
+    # Let queued writes land first so they cannot recreate the deleted file
+    background_writer.flush()
+    get_session_messages_path(username, session_id).unlink(missing_ok=True)
+    save_sessions_index(username, st.session_state.chat_sessions[username])
+
+def migrate_chat_sessions(username: str):
+    session_file = Path(get_session_file_path(username))
+    if not session_file.exists() or get_sessions_index_path(username).exists():
+        return
+
+    sessions = read_json(session_file)
+
+    for session_id, session in sessions.items():
+        save_session_messages(username, session_id, session.get("messages", []))
+    save_sessions_index(username, sessions)
+    background_writer.flush()
+    session_file.unlink()
+
 def load_chat_sessions(username: str) -> dict:
-    session_file = get_session_file_path(username)
-    if Path(session_file).exists():
-        with open(session_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {}
-
-def save_chat_sessions(username: str, sessions: dict):
-    session_file = get_session_file_path(username)
-    Path(session_file).parent.mkdir(parents=True, exist_ok=True)
-    with open(session_file, 'w', encoding='utf-8') as f:
-        json.dump(sessions, f, indent=2, ensure_ascii=False)
+    # Only session metadata is read here; messages load lazily per session
+    migrate_chat_sessions(username)
+    background_writer.flush()
+
+    index_path = get_sessions_index_path(username)
+    if not index_path.exists():
+        return {}
+
+    index = read_json(index_path)
+
+    return {
+        session_id: {**meta, "messages": None}
+        for session_id, meta in index.items()
+    }
 
 def create_new_session(username: str, session_name: str = None) -> str:
     session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -522,16 +629,25 @@ def create_new_session(username: str, session_name: str = None) -> str:
         "messages": []
     }
 
-    save_chat_sessions(username, st.session_state.chat_sessions[username])
+    save_sessions_index(username, st.session_state.chat_sessions[username])
     return session_id
 
-def get_current_messages() -> list:
+def get_current_session() -> dict:
+    # Single lookup shared by the message list and the session caption
     username = st.session_state.username
-    session_id = st.session_state.current_session_id
+    sessions = st.session_state.chat_sessions.get(username)
+    if not sessions:
+        return None
 
-    if (username in st.session_state.chat_sessions and
-        session_id in st.session_state.chat_sessions[username]):
-        return st.session_state.chat_sessions[username][session_id]["messages"]
+    session = sessions.get(st.session_state.current_session_id)
+    if session is not None and session["messages"] is None:
+        session["messages"] = load_session_messages(username, st.session_state.current_session_id)
+    return session
+
+def get_current_messages() -> list:
+    session = get_current_session()
+    if session is not None:
+        return session["messages"]
     return []
 
 def save_current_messages(messages: list):
@@ -547,28 +663,84 @@ def save_current_messages(messages: list):
             "created_at": datetime.now().isoformat(),
             "messages": messages
         }
+        save_sessions_index(username, st.session_state.chat_sessions[username])
     else:
         st.session_state.chat_sessions[username][session_id]["messages"] = messages
 
-    save_chat_sessions(username, st.session_state.chat_sessions[username])
+    # Only the current session's messages are rewritten
+    save_session_messages(username, session_id, messages)
 
 def extract_pdf_content(pdf_file):
     try:
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        num_pages = len(pdf_reader.pages)
-
-        content = []
-        for page_num in range(num_pages):
-            page = pdf_reader.pages[page_num]
-            text = page.extract_text()
-            if text.strip():
-                content.append(text)
-
-        full_content = "\n\n".join(content)
-        return full_content, num_pages
+        # Pass raw bytes (picklable) so pages can be extracted across processes,
+        # and so re-uploads of the same file hit the content-hash cache
+        pdf_bytes = pdf_file.getvalue() if hasattr(pdf_file, "getvalue") else pdf_file.read()
+        return extract_pdf_text_cached(pdf_bytes)
     except Exception as e:
         return None, str(e)
 
+@st.cache_resource(show_spinner=False)
+def get_vector_store(username: str) -> MultiUserVectorStore:
+    # One store per user for the lifetime of the server process. Uploads and
+    # removals update it in place, so it never needs rebuilding per kb_version.
+    return MultiUserVectorStore(username)
+
+@st.cache_resource(show_spinner=False)
+def get_expert(username: str) -> OneStreamExpert:
+    return OneStreamExpert(vector_store=get_vector_store(username))
+
+@st.cache_data(ttl=30, show_spinner=False)
+def get_kb_stats(username: str, kb_version: int) -> dict:
+    # Chroma count() round-trips, cached per KB version instead of per rerun
+    return get_vector_store(username).get_stats()
+
+def answer_cache_version(username: str) -> str:
+    # Shared by every session and process: changes whenever the user's KB files
+    # are written or the admin/user chunks are re-embedded (fingerprint rewritten)
+    kb_path = user_manager.get_user_kb_path(username)
+    return kb_files_version([
+        kb_path,
+        kb_index_path(kb_path),
+        fingerprint_path(config.VECTOR_DB_PATH, ADMIN_FINGERPRINT),
+        fingerprint_path(config.VECTOR_DB_PATH, user_fingerprint(username))
+    ])
+
+def _preload(username: str, state: dict):
+    # Runs without a script context, so results go into a plain dict, not session_state
+    try:
+        get_expert(username)
+    except Exception as e:
+        state["error"] = e
+
+def preload_knowledge_base(username: str):
+    # Warm the cached store and expert (get_expert builds both) off the script thread
+    state = {"error": None}
+    state["thread"] = threading.Thread(target=_preload, args=(username, state), daemon=True)
+    state["thread"].start()
+    st.session_state.kb_preload = state
+
+def knowledge_base_ready() -> bool:
+    # False while the background load runs. A failed preload is raised here
+    # once; after that the store loads (and can fail) on first use instead
+    if st.session_state.vector_store is not None:
+        return True
+    preload = st.session_state.get("kb_preload")
+    if preload is None:
+        return True
+    if preload["thread"].is_alive():
+        return False
+    st.session_state.kb_preload = None
+    if preload["error"] is not None:
+        raise preload["error"]
+    return True
+
+def get_session_vector_store(username):
+    # Reuse the logged-in store (and its loaded embedding model) when possible
+    if st.session_state.vector_store is None:
+        st.session_state.vector_store = get_vector_store(username)
+        st.session_state.expert = get_expert(username)
+    return st.session_state.vector_store
+
 def add_user_pdf(pdf_file, pdf_name, username):
     content, num_pages = extract_pdf_content(pdf_file)
 
@@ -579,11 +751,7 @@ def add_user_pdf(pdf_file, pdf_name, username):
         return False, "Insufficient content extracted from PDF"
 
     user_kb_path = user_manager.get_user_kb_path(username)
-    if Path(user_kb_path).exists():
-        with open(user_kb_path, 'r', encoding='utf-8') as f:
-            documents = json.load(f)
-    else:
-        documents = []
+    kb_store = UserKBStore(user_kb_path)
 
     doc = {
         "title": pdf_name.replace(".pdf", ""),
@@ -601,75 +769,58 @@ def add_user_pdf(pdf_file, pdf_name, username):
         }
     }
 
-    existing_idx = None
-    for idx, existing_doc in enumerate(documents):
-        if existing_doc.get('metadata', {}).get('filename') == pdf_name:
-            existing_idx = idx
-            break
-
-    if existing_idx is not None:
-        documents[existing_idx] = doc
-        action = "updated"
-    else:
-        documents.append(doc)
-        action = "added"
-
-    with open(user_kb_path, 'w', encoding='utf-8') as f:
-        json.dump(documents, f, indent=2, ensure_ascii=False)
+    # Appends the document; a re-upload of the same filename supersedes the old record
+    action = kb_store.put(doc)
+    user_manager.set_doc_count(username, kb_store.count())
 
     try:
-        vector_store = MultiUserVectorStore(username)
-        vector_store.embed_user_documents(user_kb_path)
+        vector_store = get_session_vector_store(username)
 
-        st.session_state.vector_store = vector_store
-        st.session_state.expert = OneStreamExpert(vector_store=vector_store)
+        if kb_store.count() > 1 and not vector_store.has_user_chunks():
+            # Nothing indexed yet for this user - embed the whole KB once
+            vector_store.embed_user_documents(user_kb_path)
+        else:
+            # Only embed the new/replaced document
+            vector_store.upsert_document(doc)
 
-        return True, f"PDF {action} successfully! Total user documents: {len(documents)}"
+        st.session_state.kb_version += 1
+
+        return True, f"PDF {action} successfully! Total user documents: {kb_store.count()}"
     except Exception as e:
         return False, f"Error rebuilding vector store: {str(e)}"
 
 def remove_user_document(username, doc_title):
     user_kb_path = user_manager.get_user_kb_path(username)
+    kb_store = UserKBStore(user_kb_path)
 
-    if not Path(user_kb_path).exists():
+    if not kb_store.kb_path.exists():
         return False, "Knowledge base not found"
 
-    with open(user_kb_path, 'r', encoding='utf-8') as f:
-        documents = json.load(f)
-
-    original_count = len(documents)
-    documents = [doc for doc in documents if doc.get('title') != doc_title]
-
-    if len(documents) == original_count:
+    if not kb_store.remove_by_title(doc_title):
         return False, "Document not found"
 
-    with open(user_kb_path, 'w', encoding='utf-8') as f:
-        json.dump(documents, f, indent=2, ensure_ascii=False)
+    remaining = kb_store.count()
+    user_manager.set_doc_count(username, remaining)
 
     try:
-        vector_store = MultiUserVectorStore(username)
-        if documents:
-            vector_store.embed_user_documents(user_kb_path)
-        else:
-            if vector_store.user_collection:
-                vector_store.user_collection.delete(where={"username": username})
+        # Only the removed document's chunks are deleted - no re-embedding
+        vector_store = get_session_vector_store(username)
+        vector_store.delete_document(doc_title)
 
-        st.session_state.vector_store = vector_store
-        st.session_state.expert = OneStreamExpert(vector_store=vector_store)
+        st.session_state.kb_version += 1
 
-        return True, f"Document removed successfully! Remaining documents: {len(documents)}"
+        return True, f"Document removed successfully! Remaining documents: {remaining}"
     except Exception as e:
         return False, f"Error rebuilding vector store: {str(e)}"
 
 def get_user_documents(username):
-    user_kb_path = user_manager.get_user_kb_path(username)
-
-    if not Path(user_kb_path).exists():
-        return []
-
-    with open(user_kb_path, 'r', encoding='utf-8') as f:
-        documents = json.load(f)
+    # Memoized per session until the next upload/removal bumps kb_version
+    cached = st.session_state.get("user_documents")
+    if cached and cached[0] == (username, st.session_state.kb_version):
+        return cached[1]
 
+    documents = UserKBStore(user_manager.get_user_kb_path(username)).documents()
+    st.session_state.user_documents = ((username, st.session_state.kb_version), documents)
     return documents
 
 def admin_panel():
@@ -694,13 +845,7 @@ def admin_panel():
 
                 with col3:
                     if user['username'] != 'admin':
-                        user_kb_path = user_manager.get_user_kb_path(user['username'])
-                        if Path(user_kb_path).exists():
-                            with open(user_kb_path, 'r', encoding='utf-8') as f:
-                                user_docs = json.load(f)
-                                st.metric("Documents", len(user_docs))
-                        else:
-                            st.metric("Documents", 0)
+                        st.metric("Documents", user_manager.get_doc_count(user['username']))
 
                 with col4:
                     if user['username'] != 'admin':
@@ -752,6 +897,8 @@ def login_page():
                     st.session_state.authenticated = True
                     st.session_state.username = username
                     st.session_state.user_info = user_manager.get_user_info(username)
+                    st.session_state.is_admin = user_manager.is_admin(username)
+                    st.session_state.header_html = None
 
                     st.session_state.chat_sessions[username] = load_chat_sessions(username)
 
@@ -763,10 +910,13 @@ def login_page():
 
                     with st.spinner("Loading your knowledge base..."):
                         try:
-                            st.session_state.vector_store = MultiUserVectorStore(username)
-                            st.session_state.expert = OneStreamExpert(
-                                vector_store=st.session_state.vector_store
-                            )
+                            if not config.XAI_API_KEY:
+                                raise ValueError("XAI_API_KEY is not set. Please configure your API key in environment variables or .env file.")
+                            # Chroma and the embedding model load in the background;
+                            # the first question (or upload) waits only if still loading
+                            st.session_state.vector_store = None
+                            st.session_state.expert = None
+                            preload_knowledge_base(username)
                             st.success("Login successful!")
                             st.rerun()
                         except ValueError as e:
@@ -784,108 +934,203 @@ def login_page():
         st.markdown("---")
         st.info("**Default Admin Credentials:**\n- Username: `admin`\n- Password: `admin123`")
 
+# Characters that would otherwise be interpreted as markdown in citation fields
+MARKDOWN_ESCAPE_TABLE = str.maketrans({ch: "\\" + ch for ch in "\\`*_[]<>#|"})
+
+def format_citations_markdown(citations: list) -> str:
+    # One markdown block for all sources instead of two Streamlit calls per citation
+    lines = []
+    for idx, citation in enumerate(citations, 1):
+        badge = "📁 My Documents" if citation.get('source_type') == 'user_uploaded' else "🌐 Admin KB"
+        title = str(citation['title']).translate(MARKDOWN_ESCAPE_TABLE)
+        source_type = str(citation['source_type']).translate(MARKDOWN_ESCAPE_TABLE)
+        lines.append(f"**{idx}. {title}** {badge}  \n:gray[Type: {source_type}]")
+    return "\n\n".join(lines)
+
+def render_markdown(content: str) -> str:
+    return markdown.markdown(content, extensions=['extra', 'nl2br', 'sane_lists'])
+
+@st.cache_data(max_entries=1024, show_spinner=False)
+def markdown_to_html(content: str) -> str:
+    # Every rerun redraws the whole conversation; convert each answer only once
+    return render_markdown(content)
+
+def message_html(role: str, content: str, streaming: bool = False) -> str:
+    # Label with avatar
+    avatar_emoji = "👤" if role == "user" else "🤖"
+    label_text = "You" if role == "user" else "Assistant"
+
+    # Format content based on role
+    if role == "assistant":
+        # Convert markdown to HTML for assistant messages (partial streamed
+        # text changes every token, so it bypasses the cache)
+        html_content = render_markdown(content) if streaming else markdown_to_html(content)
+    else:
+        # For user messages, just escape HTML and convert newlines
+        html_content = content.replace('<', '&lt;').replace('>', '&gt;').replace('\n', '<br>')
+
+    # Complete chat wrapper with label and bubble
+    return MESSAGE_TEMPLATE.substitute(
+        role=role,
+        avatar_emoji=avatar_emoji,
+        label_text=label_text,
+        html_content=html_content
+    )
+
+def render_confidence_badge(confidence: str, target=st):
+    # target may be an st.empty() placeholder so the badge can be redrawn in place
+    target.markdown(CONFIDENCE_BADGE_TEMPLATE.substitute(confidence=confidence), unsafe_allow_html=True)
+
+def render_citations(citations: list):
+    if citations:
+        with st.expander("📚 Sources"):
+            st.markdown(format_citations_markdown(citations))
+
+def render_message(message: dict):
+    role = message["role"]
+    st.markdown(message_html(role, message.get("content", "")), unsafe_allow_html=True)
+
+    # Confidence badge and citations (assistant messages only)
+    if role == "assistant" and "confidence" in message:
+        render_confidence_badge(message["confidence"])
+
+    if role == "assistant" and "citations" in message:
+        render_citations(message["citations"])
+
+# Conversation memory: recent turns verbatim (truncated), older turns as a rolling summary
+MAX_HISTORY_CHARS = 400
+HISTORY_TURNS = 6
+SUMMARY_THRESHOLD = 12
+
+def build_conversation_context(session: dict, history: list) -> str:
+    if not history:
+        return ""
+
+    parts = []
+    recent = history[-HISTORY_TURNS:]
+
+    if session is not None and len(history) > SUMMARY_THRESHOLD:
+        # Advance the summary boundary in steps of HISTORY_TURNS so the
+        # summary is only regenerated every few exchanges, not every turn
+        boundary = ((len(history) - HISTORY_TURNS) // HISTORY_TURNS) * HISTORY_TURNS
+        if session.get("summary_upto") != boundary:
+            session["summary"] = st.session_state.expert.summarize(history[:boundary])
+            session["summary_upto"] = boundary
+            save_sessions_index(st.session_state.username, st.session_state.chat_sessions[st.session_state.username])
+        if session.get("summary"):
+            parts.append(f"Earlier conversation summary: {session['summary']}")
+        recent = history[boundary:]
+
+    for msg in recent:
+        speaker = "User" if msg["role"] == "user" else "Assistant"
+        parts.append(f"{speaker}: {msg.get('content', '')[:MAX_HISTORY_CHARS]}")
+
+    return "\n".join(parts)
+
+def stream_assistant_message(prompt: str, conversation: str = "") -> dict:
+    # Paint tokens into the assistant bubble as they arrive
+    bubble = st.empty()
+    bubble.markdown(message_html("assistant", "_Searching knowledge base..._"), unsafe_allow_html=True)
+    badge = st.empty()
+
+    # IMPORTANT: Use ONLY the current prompt for retrieval, not conversation history
+    # The conversation history confuses semantic search - it is passed to the LLM only
+    buf = ""
+    citations = []
+    confidence = "low"
+    for event in st.session_state.expert.answer_question_stream(prompt, conversation=conversation):
+        if event["type"] == "meta":
+            citations = event["citations"]
+            confidence = event["confidence"]
+            render_confidence_badge(confidence, badge)
+        elif event["type"] == "token":
+            buf += event["text"]
+            bubble.markdown(message_html("assistant", buf, streaming=True), unsafe_allow_html=True)
+        elif event["type"] == "done":
+            # Generation can still fail after meta, e.g. downgrading to "error"
+            if event["confidence"] != confidence:
+                confidence = event["confidence"]
+                render_confidence_badge(confidence, badge)
+            render_citations(citations)
+
+    return {
+        "role": "assistant",
+        "content": buf,
+        "citations": citations,
+        "confidence": confidence
+    }
+
 def chat_interface():
-    messages = get_current_messages()
+    session = get_current_session()
+    messages = session["messages"] if session is not None else []
 
-    username = st.session_state.username
-    session_id = st.session_state.current_session_id
-    if username in st.session_state.chat_sessions and session_id in st.session_state.chat_sessions[username]:
-        session = st.session_state.chat_sessions[username][session_id]
+    if session is not None:
         st.caption(f"📝 {session['name']} • Started: {session['created_at'][:16]}")
 
     # Display chat messages with new bubble design
     for message in messages:
-        role = message["role"]
-        content = message.get("content", "")
-
-        # Label with avatar
-        avatar_emoji = "👤" if role == "user" else "🤖"
-        label_text = "You" if role == "user" else "Assistant"
-
-        # Format content based on role
-        if role == "assistant":
-            # Convert markdown to HTML for assistant messages
-            html_content = markdown.markdown(
-                content,
-                extensions=['extra', 'nl2br', 'sane_lists']
-            )
-        else:
-            # For user messages, just escape HTML and convert newlines
-            html_content = content.replace('<', '&lt;').replace('>', '&gt;').replace('\n', '<br>')
-
-        # Complete chat wrapper with label and bubble
-        st.markdown(f"""
-        <div class="chat-wrapper {role}">
-            <div class="chat-label {role}">
-                <span class="avatar {role}">{avatar_emoji}</span>
-                <span>{label_text}</span>
-            </div>
-            <div class="chat-bubble {role}">
-                {html_content}
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
-
-        # Confidence badge (aligned based on role)
-        if role == "assistant" and "confidence" in message:
-            confidence = message["confidence"]
-            st.markdown(f"""
-            <div style="display: flex; justify-content: flex-start; margin-bottom: 10px;">
-                <div class="confidence-badge {confidence}">
-                    {confidence} confidence
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
-
-        # Citations (aligned based on role)
-        if role == "assistant" and "citations" in message:
-            if message["citations"]:
-                with st.expander("📚 Sources"):
-                    for idx, citation in enumerate(message["citations"], 1):
-                        is_admin = citation.get('source_type') != 'user_uploaded'
-                        badge = "🌐 Admin KB" if is_admin else "📁 My Documents"
-                        st.markdown(f"**{idx}. {citation['title']}** {badge}")
-                        st.caption(f"Type: {citation['source_type']}")
+        render_message(message)
 
     # Chat input
     if prompt := st.chat_input("Ask me anything..."):
+        if st.session_state.vector_store is None:
+            with st.spinner("Loading your knowledge base..."):
+                try:
+                    get_session_vector_store(st.session_state.username)
+                except Exception as e:
+                    st.error(f"Error initializing system: {str(e)}")
+                    return
+
+        conversation = build_conversation_context(session, messages)
         messages.append({"role": "user", "content": prompt})
+        render_message(messages[-1])
+
+        username = st.session_state.username
+        kb_version = answer_cache_version(username)
+        embedding_model = st.session_state.vector_store.embedding_model
+
+        # Repeated (or near-identical) questions skip retrieval and generation.
+        # Follow-ups depend on the conversation, so only opening questions are cached.
+        cached = None
+        if not conversation:
+            cached = answer_cache.get(username, kb_version, prompt, embedding_model)
+
+        if cached is not None:
+            assistant_message = {
+                "role": "assistant",
+                "content": cached["answer"],
+                "citations": cached["citations"],
+                "confidence": cached["confidence"]
+            }
+            render_message(assistant_message)
+        else:
+            assistant_message = stream_assistant_message(prompt, conversation)
+            if not conversation:
+                answer_cache.put_async(username, kb_version, prompt, {
+                    "answer": assistant_message["content"],
+                    "citations": assistant_message["citations"],
+                    "confidence": assistant_message["confidence"]
+                }, embedding_model)
 
-        with st.spinner("🤔 Thinking..."):
-            # IMPORTANT: Use ONLY the current prompt for retrieval, not conversation history
-            # The conversation history confuses semantic search
-            result = st.session_state.expert.answer_question(prompt)
-
-            response = result["answer"]
-            citations = result["citations"]
-            confidence = result["confidence"]
-
-        messages.append({
-            "role": "assistant",
-            "content": response,
-            "citations": citations,
-            "confidence": confidence
-        })
+        messages.append(assistant_message)
 
         save_current_messages(messages)
-        st.rerun()
+
+        # The reply is already on screen (streamed in place), so skip the full
+        # rerun unless the sidebar must pick up a session that was just created
+        if session is None:
+            st.rerun()
 
 def main_app():
     username = st.session_state.username
     user_info = st.session_state.user_info
-    is_admin = user_manager.is_admin(username)
+    is_admin = st.session_state.is_admin
 
-    # Modern header
-    st.markdown(f"""
-    <div class="modern-header">
-        <h1>✨ SmartDoc AI</h1>
-        <p class="tagline">Your Intelligent Knowledge Assistant</p>
-        <div class="user-chip">
-            <span class="name">Welcome, {user_info['full_name']}</span>
-            <span class="badge {'admin' if is_admin else ''}">{user_info['role']}</span>
-        </div>
-    </div>
-    """, unsafe_allow_html=True)
+    # Modern header (Streamlit drops elements that are not re-emitted, so the
+    # markup is rendered every run but only formatted once per login)
+    if st.session_state.get("header_html") is None:
+        st.session_state.header_html = build_header_html(user_info, is_admin)
+    st.markdown(st.session_state.header_html, unsafe_allow_html=True)
 
     # Sidebar
     with st.sidebar:
@@ -917,30 +1162,27 @@ def main_app():
 
                     with col2:
                         if not is_current and st.button("🗑️", key=f"del_session_{session_id}"):
-                            del st.session_state.chat_sessions[username][session_id]
-                            save_chat_sessions(username, st.session_state.chat_sessions[username])
+                            delete_session(username, session_id)
                             st.rerun()
 
         st.divider()
 
         st.markdown("### 📊 Knowledge Base")
-        stats = st.session_state.vector_store.get_stats()
-
-        st.markdown(f"""
-        <div class="modern-card">
-            <div class="icon">🌐</div>
-            <div class="title">Admin KB</div>
-            <div class="value">{stats['admin_chunks']}</div>
-        </div>
-        """, unsafe_allow_html=True)
-
-        st.markdown(f"""
-        <div class="modern-card">
-            <div class="icon">📁</div>
-            <div class="title">My Documents</div>
-            <div class="value">{stats['user_chunks']}</div>
-        </div>
-        """, unsafe_allow_html=True)
+        stats = {"admin_chunks": "—", "user_chunks": "—"}
+        try:
+            if knowledge_base_ready():
+                get_session_vector_store(username)
+                stats = get_kb_stats(username, st.session_state.kb_version)
+        except Exception as e:
+            st.error(f"Error initializing system: {str(e)}")
+
+        st.markdown(STAT_CARD_TEMPLATE.substitute(
+            icon="🌐", title="Admin KB", value=stats['admin_chunks']
+        ), unsafe_allow_html=True)
+
+        st.markdown(STAT_CARD_TEMPLATE.substitute(
+            icon="📁", title="My Documents", value=stats['user_chunks']
+        ), unsafe_allow_html=True)
 
         st.divider()
 
@@ -996,8 +1238,10 @@ def main_app():
         st.divider()
 
         if st.button("Logout", type="secondary", use_container_width=True):
+            background_writer.flush()
             st.session_state.authenticated = False
             st.session_state.username = None
+            st.session_state.is_admin = False
             st.session_state.current_session_id = None
             st.rerun()
 
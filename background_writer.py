@@ -0,0 +1,71 @@
+"""
+Background Writer
+Moves JSON file writes off the request path onto a single daemon thread
+"""
+import atexit
+import logging
+import queue
+import threading
+from pathlib import Path
+from typing import Any, Dict
+from json_store import dumps, write_bytes_atomic
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class BackgroundWriter:
+    """
+    Queue of pending file writes, coalesced per path: if a file is submitted
+    several times before the writer gets to it, only the latest payload is
+    written. Payloads are serialized at submit time, so callers can keep
+    mutating their objects.
+    """
+
+    def __init__(self):
+        self._pending: Dict[Path, bytes] = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._writer_loop, name="background-writer",
+                                        daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def submit(self, path, data: Any):
+        """Schedule `data` to be written as JSON to `path`; returns immediately"""
+        path = Path(path)
+        payload = dumps(data)
+        with self._lock:
+            self._pending[path] = payload
+        self._queue.put(path)
+
+    def flush(self):
+        """Block until every submitted write has reached disk"""
+        self._queue.join()
+
+    def _writer_loop(self):
+        while True:
+            path = self._queue.get()
+            try:
+                with self._lock:
+                    payload = self._pending.pop(path, None)
+                # None means a later queue entry's payload was already written
+                if payload is not None:
+                    write_bytes_atomic(path, payload)
+            except Exception as e:
+                logger.error(f"Background write to {path} failed: {e}")
+            finally:
+                self._queue.task_done()
+
+
+# Singleton instance
+_background_writer = None
+_background_writer_lock = threading.Lock()
+
+def get_background_writer() -> BackgroundWriter:
+    """Get or create BackgroundWriter singleton"""
+    global _background_writer
+    with _background_writer_lock:
+        if _background_writer is None:
+            _background_writer = BackgroundWriter()
+    return _background_writer
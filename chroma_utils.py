@@ -0,0 +1,71 @@
+"""
+Chroma Utilities
+Collection copying and distance-space migration shared by the vector stores
+"""
+import logging
+from typing import Dict, Optional
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Every collection ranks by inner product over unit-length embeddings
+# (distance = 1 - cosine similarity)
+DISTANCE_SPACE = "ip"
+# Chunks copied per batch when migrating a collection
+COPY_BATCH_SIZE = 1024
+
+
+def unit_normalize(embeddings) -> np.ndarray:
+    """L2-normalize embedding rows (float32), leaving all-zero rows as they are"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.where(norms == 0, 1, norms)
+
+
+def copy_collection(source, target, metadata_update: Optional[Dict] = None) -> int:
+    """
+    Copy every chunk (embeddings included, nothing is re-encoded) from source
+    into target, unit-normalizing the vectors and merging metadata_update into
+    each chunk's metadata. Returns the number of chunks copied
+    """
+    metadata_update = metadata_update or {}
+    total = source.count()
+    for offset in range(0, total, COPY_BATCH_SIZE):
+        batch = source.get(limit=COPY_BATCH_SIZE, offset=offset,
+                           include=["embeddings", "documents", "metadatas"])
+        target.upsert(
+            ids=batch["ids"],
+            embeddings=unit_normalize(batch["embeddings"]),
+            documents=batch["documents"],
+            metadatas=[{**metadata, **metadata_update} for metadata in batch["metadatas"]]
+        )
+    return total
+
+
+def open_ip_collection(client, name: str, metadata: Dict):
+    """
+    get_or_create a collection in inner-product space
+    A collection built in another space (Chroma fixes the space at creation)
+    is copied into a fresh ip collection, which then takes over its name
+    """
+    metadata = {**metadata, "hnsw:space": DISTANCE_SPACE}
+    collection = client.get_or_create_collection(name=name, metadata=metadata)
+
+    space = (collection.metadata or {}).get("hnsw:space", "l2")
+    if space == DISTANCE_SPACE:
+        return collection
+
+    logger.info(f"Migrating collection {name} from {space} to {DISTANCE_SPACE} space...")
+    staging_name = f"{name}_{DISTANCE_SPACE}_migration"
+    existing = {getattr(c, "name", c) for c in client.list_collections()}
+    if staging_name in existing:
+        # Left over from an interrupted migration
+        client.delete_collection(staging_name)
+
+    staging = client.create_collection(name=staging_name, metadata=metadata)
+    copied = copy_collection(collection, staging)
+    client.delete_collection(name)
+    staging.modify(name=name)
+    logger.info(f"Migrated {copied} chunks in {name} to {DISTANCE_SPACE} space")
+    return client.get_collection(name)
@@ -0,0 +1,27 @@
+"""
+CLI History
+readline line editing and persistent history for the interactive prompts
+"""
+import atexit
+import os
+
+HISTORY_LENGTH = 1000
+
+
+def enable_history(name: str):
+    """
+    Turn on readline editing for input() and keep history in ~/.{name}_history
+    No-op where readline is unavailable (e.g. Windows)
+    """
+    try:
+        import readline
+    except ImportError:
+        return
+
+    histfile = os.path.expanduser(f"~/.{name}_history")
+    readline.set_history_length(HISTORY_LENGTH)
+    try:
+        readline.read_history_file(histfile)
+    except (FileNotFoundError, OSError):
+        pass
+    atexit.register(readline.write_history_file, histfile)
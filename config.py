@@ -32,11 +32,46 @@ CRAWL_DELAY = 1  # seconds between requests
 # Chunking settings
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 2000))  # Increased for better context
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 400))  # Increased overlap
+# VectorStore splits on headings/paragraphs/sentences into chunks of at most
+# this many tokens (capped at the embedding model's max sequence length)
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", 400))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", 50))
 
 # Vector DB settings
 VECTOR_DB_PATH = "./onestream_vectordb"
 EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 
+# On CPU, run the embedding model through ONNX Runtime with dynamic INT8
+# weights (exported once into ONNX_MODEL_DIR); set EMBEDDING_ONNX=0 to use PyTorch
+EMBEDDING_ONNX = os.getenv("EMBEDDING_ONNX", "1") == "1"
+ONNX_MODEL_DIR = "./cache/onnx_embedding_model"
+ONNX_QUANTIZATION = os.getenv("ONNX_QUANTIZATION", "avx2")  # arm64, avx2, avx512 or avx512_vnni
+
+# On CUDA, compile the PyTorch encoder with torch.compile (paid once at load,
+# behind the warmup batch); set EMBEDDING_TORCH_COMPILE=0 to skip
+EMBEDDING_TORCH_COMPILE = os.getenv("EMBEDDING_TORCH_COMPILE", "1") == "1"
+
+# PyTorch intra-op threads for CPU embedding; scaling flattens out past ~8
+RAG_NUM_THREADS = int(os.getenv("RAG_NUM_THREADS", max(1, min(os.cpu_count() or 1, 8))))
+
+# Document embedding batches: sized per device, and capped so a batch of
+# long chunks never pads out to more than this many tokens
+EMBEDDING_BATCH_SIZE_GPU = int(os.getenv("EMBEDDING_BATCH_SIZE_GPU", 256))
+EMBEDDING_BATCH_SIZE_CPU = int(os.getenv("EMBEDDING_BATCH_SIZE_CPU", 8))
+EMBEDDING_MAX_TOKENS_PER_BATCH = int(os.getenv("EMBEDDING_MAX_TOKENS_PER_BATCH", 8192))
+
+# Index behind the single-KB VectorStore: "faiss" (FAISS HNSW + SQLite
+# metadata) or "chroma". The multi-user store always uses Chroma
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "faiss")
+# How new FAISS indexes store vectors: "fp16" (half the RAM/disk of fp32,
+# negligible recall loss on unit-length SBERT vectors) or "fp32"
+FAISS_VECTOR_ENCODING = os.getenv("FAISS_VECTOR_ENCODING", "fp16")
+
+# HNSW index settings (applied when a collection is created)
+HNSW_M = int(os.getenv("HNSW_M", 32))  # Graph degree
+HNSW_CONSTRUCTION_EF = int(os.getenv("HNSW_CONSTRUCTION_EF", 200))
+HNSW_SEARCH_EF = int(os.getenv("HNSW_SEARCH_EF", 64))  # Higher = better recall, slower queries
+
 # Knowledge base output
 KB_OUTPUT_PATH = "./onestream_kb.json"
 
@@ -1,8 +1,48 @@
 """
 Example Usage Scripts for OneStream Knowledge Agent System
 """
+import functools
+import os
+from collections import Counter
+from typing import Tuple
+import ijson
+from cli_history import enable_history
+import config
+
+
+# Examples share one vector store (embedding model + ChromaDB) and pipeline,
+# so running several examples loads them once. The heavy modules are imported
+# here rather than at the top, so the menu itself starts instantly.
+@functools.lru_cache(maxsize=1)
+def _get_vector_store() -> "VectorStore":
+    from vector_store import VectorStore
+    return VectorStore()
+
+
+@functools.lru_cache(maxsize=1)
+def _get_pipeline() -> "OneStreamPipeline":
+    from pipeline import OneStreamPipeline
+    return OneStreamPipeline(vector_store=_get_vector_store())
+
 
-from pipeline import OneStreamPipeline
+@functools.lru_cache(maxsize=1)
+def _knowledge_base_stats(path: str, mtime: float) -> Tuple[int, Counter, int]:
+    """
+    (document count, source type counts, total words) in one streaming pass
+    Documents are never held in memory together; recomputed only when the mtime changes
+    """
+    num_docs = 0
+    source_types = Counter()
+    total_words = 0
+
+    # ijson uses its C (yajl2_c) backend when available
+    with open(path, 'rb') as f:
+        for doc in ijson.items(f, 'item'):
+            num_docs += 1
+            source_types[doc['source_type']] += 1
+            total_words += doc['metadata']['word_count']
+
+    return num_docs, source_types, total_words
 
 
 def example_1_quick_start():
@@ -11,7 +51,7 @@ def example_1_quick_start():
     print("Example 1: Quick Start")
     print("="*70 + "\n")
 
-    pipeline = OneStreamPipeline()
+    pipeline = _get_pipeline()
 
     # Ask a question
     question = "How do I configure VIE elimination logic in OneStream?"
@@ -28,7 +68,7 @@ def example_2_batch_queries():
     print("Example 2: Batch Queries")
     print("="*70 + "\n")
 
-    pipeline = OneStreamPipeline()
+    pipeline = _get_pipeline()
 
     questions = [
         "Explain dynamic data management sequences in OneStream",
@@ -37,12 +77,14 @@ def example_2_batch_queries():
         "What is the consolidation engine in OneStream?"
     ]
 
-    for i, question in enumerate(questions, 1):
+    # One batched retrieval pass, LLM calls in parallel
+    results = pipeline.query_batch(questions)
+
+    for i, (question, result) in enumerate(zip(questions, results), 1):
         print(f"\n{'─'*70}")
         print(f"Question {i}/{len(questions)}: {question}")
         print(f"{'─'*70}\n")
 
-        result = pipeline.query(question)
         print(result['answer'])
 
 
@@ -52,7 +94,7 @@ def example_3_with_citations():
     print("Example 3: Citations Extraction")
     print("="*70 + "\n")
 
-    pipeline = OneStreamPipeline()
+    pipeline = _get_pipeline()
 
     question = "What are the key components of OneStream platform?"
     result = pipeline.query(question)
@@ -74,7 +116,7 @@ def example_4_interactive():
     print("Example 4: Interactive Mode")
     print("="*70 + "\n")
 
-    pipeline = OneStreamPipeline()
+    pipeline = _get_pipeline()
     pipeline.run_interactive()
 
 
@@ -84,7 +126,7 @@ def example_5_setup_from_scratch():
     print("Example 5: Full Setup (First Time)")
     print("="*70 + "\n")
 
-    pipeline = OneStreamPipeline()
+    pipeline = _get_pipeline()
 
     # Force complete rebuild
     print("⚠️  This will re-crawl all websites and rebuild the database")
@@ -98,27 +140,30 @@ def example_5_setup_from_scratch():
         print("Setup cancelled")
 
 
-def example_6_vector_search_only():
-    """Example 6: Direct vector search without LLM"""
+def example_6_vector_search_only(ef: int = config.HNSW_SEARCH_EF):
+    """
+    Example 6: Direct vector search without LLM
+    Raise ef for better recall, lower it for faster queries
+    """
     print("\n" + "="*70)
     print("Example 6: Vector Search Only")
     print("="*70 + "\n")
 
-    from vector_store import VectorStore
+    vector_store = _get_vector_store()
 
-    vector_store = VectorStore()
+    queries = ["business rules VB.NET", "cube views", "VIE elimination"]
+    # All queries are embedded and searched in one batched call
+    result_groups = vector_store.search_batch(queries, top_k=5, ef=ef)
 
-    query = "business rules VB.NET"
-    results = vector_store.search(query, top_k=5)
+    for query, results in zip(queries, result_groups):
+        print(f"\nSearch query: '{query}'")
+        print(f"Found {len(results)} results\n")
 
-    print(f"Search query: '{query}'")
-    print(f"Found {len(results)} results\n")
-
-    for i, result in enumerate(results, 1):
-        print(f"\n{i}. {result['metadata']['document_title']}")
-        print(f"   URL: {result['metadata']['url']}")
-        print(f"   Relevance score: {1 - result['distance']:.3f}")
-        print(f"   Preview: {result['content'][:150]}...")
+        for i, result in enumerate(results, 1):
+            print(f"\n{i}. {result['metadata']['document_title']}")
+            print(f"   URL: {result['metadata']['url']}")
+            print(f"   Relevance score: {1 - result['distance']:.3f}")
+            print(f"   Preview: {result['content'][:150]}...")
 
 
 def example_7_knowledge_base_stats():
@@ -127,63 +172,59 @@ def example_7_knowledge_base_stats():
     print("Example 7: Knowledge Base Statistics")
     print("="*70 + "\n")
 
-    import json
-    import os
-    from vector_store import VectorStore
-    import config
-
     # Load knowledge base
     if os.path.exists(config.KB_OUTPUT_PATH):
-        with open(config.KB_OUTPUT_PATH, 'r') as f:
-            kb = json.load(f)
+        num_docs, source_types, total_words = _knowledge_base_stats(
+            config.KB_OUTPUT_PATH, os.path.getmtime(config.KB_OUTPUT_PATH)
+        )
 
         print(f"📚 Knowledge Base Stats:")
-        print(f"   Total documents: {len(kb)}")
+        print(f"   Total documents: {num_docs}")
 
         # Count by source type
-        source_types = {}
-        for doc in kb:
-            st = doc['source_type']
-            source_types[st] = source_types.get(st, 0) + 1
-
         print(f"\n   By source type:")
         for st, count in source_types.items():
             print(f"     • {st}: {count}")
 
         # Total words
-        total_words = sum(doc['metadata']['word_count'] for doc in kb)
         print(f"\n   Total words: {total_words:,}")
-        print(f"   Average words per doc: {total_words // len(kb):,}")
+        print(f"   Average words per doc: {total_words // num_docs:,}")
 
     # Vector DB stats
-    vector_store = VectorStore()
+    vector_store = _get_vector_store()
     stats = vector_store.get_stats()
     print(f"\n🔍 Vector Database Stats:")
     print(f"   Total chunks indexed: {stats['total_chunks']:,}")
 
 
 # Menu system
+EXAMPLES = {
+    "1": ("Quick Start - Single Question", example_1_quick_start),
+    "2": ("Batch Queries", example_2_batch_queries),
+    "3": ("With Citations", example_3_with_citations),
+    "4": ("Interactive Mode", example_4_interactive),
+    "5": ("Full Setup (First Time)", example_5_setup_from_scratch),
+    "6": ("Vector Search Only", example_6_vector_search_only),
+    "7": ("Knowledge Base Stats", example_7_knowledge_base_stats),
+}
+
+# Rendered once at import
+MENU_TEXT = "\n".join(
+    ["Available examples:\n"]
+    + [f"  {key}. {description}" for key, (description, _) in EXAMPLES.items()]
+    + ["\n  0. Exit"]
+)
+
+
 def main():
     """Main menu for examples"""
-    examples = {
-        "1": ("Quick Start - Single Question", example_1_quick_start),
-        "2": ("Batch Queries", example_2_batch_queries),
-        "3": ("With Citations", example_3_with_citations),
-        "4": ("Interactive Mode", example_4_interactive),
-        "5": ("Full Setup (First Time)", example_5_setup_from_scratch),
-        "6": ("Vector Search Only", example_6_vector_search_only),
-        "7": ("Knowledge Base Stats", example_7_knowledge_base_stats),
-    }
-
     print("\n" + "="*70)
     print("OneStream Knowledge Agent - Example Usage")
     print("="*70 + "\n")
 
-    print("Available examples:\n")
-    for key, (description, _) in examples.items():
-        print(f"  {key}. {description}")
+    print(MENU_TEXT)
 
-    print("\n  0. Exit")
+    enable_history("onestream_examples")
 
     while True:
         choice = input("\nSelect example (0-7): ").strip()
@@ -192,8 +233,8 @@ def main():
             print("Goodbye!")
             break
 
-        if choice in examples:
-            _, func = examples[choice]
+        if choice in EXAMPLES:
+            _, func = EXAMPLES[choice]
             try:
                 func()
             except KeyboardInterrupt:
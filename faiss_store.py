@@ -0,0 +1,204 @@
+"""
+FAISS Chunk Index
+A FAISS inner-product index with chunk text and metadata in SQLite, exposing
+the subset of the Chroma collection API that VectorStore uses
+"""
+import os
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+import faiss
+from json_store import dumps, loads
+import config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Rebuild the index once orphaned (upserted-over) vectors exceed this share of
+# live rows, bounding how far query() has to over-fetch
+ORPHAN_REBUILD_RATIO = 0.25
+# ...but not for a handful of orphans in a small index
+MIN_ORPHANS_FOR_REBUILD = 1024
+# Rows re-added / reconciled per step
+REBUILD_BATCH_SIZE = 4096
+
+
+class FaissChunkIndex:
+    """
+    Vectors live in a FAISS HNSW index (inner product over unit-length
+    embeddings, stored as fp16 by default) keyed by SQLite rowid; ids, documents and metadata live in a
+    WAL-mode SQLite table next to it. HNSW cannot delete vectors, so an
+    upserted chunk's old vector is left in place and dropped from results
+    once its row is gone (rowids are never reused), until enough pile up to
+    rebuild the index. Rows are committed per write but the index only on
+    persist(); rows whose vectors never reached disk are dropped on open
+    """
+
+    def __init__(self, directory: str, name: str, dim: int, metadata: Optional[Dict] = None):
+        self.name = name
+        self.dim = dim
+        self.metadata = {**(metadata or {}), "hnsw:space": "ip"}
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.index_path = directory / f"{name}.faiss"
+
+        # Writes come from VectorStore's writer threads
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(directory / f"{name}.sqlite", check_same_thread=False,
+                                    isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "row INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT UNIQUE NOT NULL, document TEXT, metadata BLOB)"
+        )
+
+        if self.index_path.exists():
+            self.index = faiss.read_index(str(self.index_path))
+        else:
+            self.index = self._new_index()
+        self._apply_search_ef()
+        self._reconcile()
+
+    def _new_index(self):
+        """HNSW over fp16 scalar-quantized or raw fp32 vectors (config.FAISS_VECTOR_ENCODING)"""
+        m = self.metadata.get("hnsw:M", config.HNSW_M)
+        if config.FAISS_VECTOR_ENCODING == "fp16":
+            # fp16 needs no training, so vectors can still be added batch by batch
+            hnsw = faiss.IndexHNSWSQ(self.dim, faiss.ScalarQuantizer.QT_fp16, m, faiss.METRIC_INNER_PRODUCT)
+        else:
+            hnsw = faiss.IndexHNSWFlat(self.dim, m, faiss.METRIC_INNER_PRODUCT)
+        hnsw.hnsw.efConstruction = self.metadata.get("hnsw:construction_ef", config.HNSW_CONSTRUCTION_EF)
+        return faiss.IndexIDMap2(hnsw)
+
+    def _apply_search_ef(self):
+        faiss.downcast_index(self.index.index).hnsw.efSearch = \
+            self.metadata.get("hnsw:search_ef", config.HNSW_SEARCH_EF)
+
+    def _reconcile(self):
+        """
+        Drop rows whose vectors are missing from the loaded index (indexing was
+        interrupted before persist), so the next add inserts them again instead
+        of ignoring their ids
+        """
+        indexed = faiss.vector_to_array(self.index.id_map)
+        rows = np.fromiter((row for (row,) in self.conn.execute("SELECT row FROM chunks")), dtype=np.int64)
+        missing = np.setdiff1d(rows, indexed).tolist()
+        if not missing:
+            return
+
+        logger.warning(f"Dropping {len(missing)} rows of {self.name} with no vector in the saved index")
+        self.conn.execute("BEGIN")
+        for start in range(0, len(missing), REBUILD_BATCH_SIZE):
+            self.conn.executemany("DELETE FROM chunks WHERE row = ?",
+                                  [(row,) for row in missing[start:start + REBUILD_BATCH_SIZE]])
+        self.conn.execute("COMMIT")
+
+    def _rebuild(self):
+        """Re-create the index from the live rows' vectors, dropping orphans (lock held)"""
+        rows = np.fromiter((row for (row,) in self.conn.execute("SELECT row FROM chunks")), dtype=np.int64)
+        index = self._new_index()
+        for start in range(0, len(rows), REBUILD_BATCH_SIZE):
+            batch = rows[start:start + REBUILD_BATCH_SIZE]
+            index.add_with_ids(self.index.reconstruct_batch(batch), batch)
+
+        logger.info(f"Rebuilt FAISS index {self.name}: dropped {self.index.ntotal - index.ntotal} orphaned vectors")
+        self.index = index
+        self._apply_search_ef()
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def modify(self, metadata: Dict):
+        """Only hnsw:search_ef can change after creation, as in Chroma"""
+        with self._lock:
+            self.metadata.update(metadata)
+            self._apply_search_ef()
+
+    def add(self, ids: List[str], embeddings, documents: List[str], metadatas: List[Dict]):
+        """Add chunks; ids that already exist are ignored, as Chroma's add does"""
+        self._write(ids, embeddings, documents, metadatas, replace=False)
+
+    def upsert(self, ids: List[str], embeddings, documents: List[str], metadatas: List[Dict]):
+        self._write(ids, embeddings, documents, metadatas, replace=True)
+
+    def _write(self, ids, embeddings, documents, metadatas, replace: bool):
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                # A replaced row gets a fresh rowid, orphaning its old vector
+                positions = []
+                rows = []
+                for position, (chunk_id, document, metadata) in enumerate(zip(ids, documents, metadatas)):
+                    cursor = self.conn.execute(f"{verb} INTO chunks (id, document, metadata) VALUES (?, ?, ?)",
+                                               (chunk_id, document, dumps(metadata)))
+                    if cursor.rowcount:
+                        positions.append(position)
+                        rows.append(cursor.lastrowid)
+
+                if rows:
+                    self.index.add_with_ids(embeddings[positions], np.asarray(rows, dtype=np.int64))
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+            if replace:
+                orphans = self.index.ntotal - self.count()
+                if orphans > max(MIN_ORPHANS_FOR_REBUILD, ORPHAN_REBUILD_RATIO * self.count()):
+                    self._rebuild()
+
+    def query(self, query_embeddings, n_results: int, include: List[str] = None) -> Dict:
+        """Chroma-shaped results; distance is 1 - inner product, as in Chroma's ip space"""
+        query_embeddings = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+
+        with self._lock:
+            total = self.index.ntotal
+            live = self.count()
+            # Over-fetch by the number of orphaned vectors so n_results live rows survive
+            k = min(total, n_results + max(0, total - live))
+            scores, rows = self.index.search(query_embeddings, k) if k else (
+                np.empty((len(query_embeddings), 0)), np.empty((len(query_embeddings), 0), dtype=np.int64))
+
+            for q in range(len(query_embeddings)):
+                hits = [(int(row), float(score)) for row, score in zip(rows[q], scores[q]) if row >= 0]
+                found = {}
+                if hits:
+                    placeholders = ",".join("?" * len(hits))
+                    found = {row: (chunk_id, document, metadata) for row, chunk_id, document, metadata in
+                             self.conn.execute(f"SELECT row, id, document, metadata FROM chunks "
+                                               f"WHERE row IN ({placeholders})", [row for row, _ in hits])}
+
+                live_hits = [(found[row], score) for row, score in hits if row in found][:n_results]
+                results["ids"].append([chunk[0] for chunk, _ in live_hits])
+                results["documents"].append([chunk[1] for chunk, _ in live_hits])
+                results["metadatas"].append([loads(chunk[2]) for chunk, _ in live_hits])
+                results["distances"].append([1.0 - score for _, score in live_hits])
+
+        return results
+
+    def persist(self):
+        """
+        Write the FAISS index to disk. Until this runs, rows committed since the
+        last persist have no saved vectors (_reconcile drops them on reopen)
+        """
+        with self._lock:
+            tmp_path = self.index_path.with_suffix(".faiss.tmp")
+            faiss.write_index(self.index, str(tmp_path))
+            os.replace(tmp_path, self.index_path)
+
+    def reset(self):
+        """Drop every chunk and start a fresh index"""
+        with self._lock:
+            self.conn.execute("DELETE FROM chunks")
+            self.index = self._new_index()
+            self._apply_search_ef()
+            self.index_path.unlink(missing_ok=True)
+        logger.info(f"Cleared FAISS index {self.name}")
@@ -3,7 +3,8 @@ Initialize Database for Cloud Deployment
 Creates admin knowledge base and vector database if they don't exist
 """
 import os
-import json
+import orjson
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import logging
 
@@ -100,8 +101,8 @@ def create_sample_admin_kb():
     # Only create if it doesn't exist
     if not os.path.exists(kb_path):
         logger.info("Creating sample admin knowledge base...")
-        with open(kb_path, 'w', encoding='utf-8') as f:
-            json.dump(sample_docs, f, indent=2, ensure_ascii=False)
+        with open(kb_path, 'wb') as f:
+            f.write(orjson.dumps(sample_docs, option=orjson.OPT_INDENT_2))
         logger.info(f"✓ Created {kb_path} with {len(sample_docs)} sample documents")
         return True
     else:
@@ -122,18 +123,26 @@ def create_directory_structure():
         logger.info(f"✓ Ensured directory exists: {directory}")
 
     # Create admin user KB if doesn't exist
-    admin_kb_path = "./user_data/admin/user_kb.json"
-    if not os.path.exists(admin_kb_path):
-        with open(admin_kb_path, 'w', encoding='utf-8') as f:
-            json.dump([], f)
+    admin_kb_path = "./user_data/admin/user_kb.jsonl"
+    if not os.path.exists(admin_kb_path) and not os.path.exists("./user_data/admin/user_kb.json"):
+        Path(admin_kb_path).touch()
         logger.info("✓ Created empty admin user KB")
 
 
-def initialize_vector_database():
-    """Initialize vector database with sample documents"""
+def open_vector_store():
+    """Open the admin vector store (ChromaDB client + embedding model)"""
+    from multi_user_vector_store import MultiUserVectorStore
+    return MultiUserVectorStore()
+
+
+def initialize_vector_database(vector_store=None):
+    """
+    Initialize vector database with sample documents
+    vector_store: an already opened MultiUserVectorStore to reuse, if any
+    """
     try:
-        from multi_user_vector_store import MultiUserVectorStore
         import config
+        from kb_fingerprint import ADMIN_FINGERPRINT, kb_file_hash, embedded_kb_hash, record_embedded_kb_hash
 
         kb_path = config.KB_OUTPUT_PATH
 
@@ -145,16 +154,21 @@ def initialize_vector_database():
 
         # Check if vector DB is empty
         try:
-            vector_store = MultiUserVectorStore()
+            vector_store = vector_store or open_vector_store()
             stats = vector_store.get_stats()
 
-            if stats['admin_chunks'] == 0:
-                logger.info("Vector database is empty, embedding documents...")
+            # Redeploys with an unchanged KB skip the embedding pass entirely
+            kb_hash = kb_file_hash(kb_path)
+            kb_changed = embedded_kb_hash(config.VECTOR_DB_PATH, ADMIN_FINGERPRINT) != kb_hash
+
+            if stats['admin_chunks'] == 0 or kb_changed:
+                logger.info("Vector database is empty or out of date, embedding documents...")
                 vector_store.embed_admin_documents(kb_path)
+                record_embedded_kb_hash(config.VECTOR_DB_PATH, ADMIN_FINGERPRINT, kb_hash)
                 logger.info("✓ Vector database initialized successfully")
                 return True
             else:
-                logger.info(f"Vector database already has {stats['admin_chunks']} chunks - skipping")
+                logger.info(f"Vector database already has {stats['admin_chunks']} chunks for this KB - skipping")
                 return False
         except Exception as ve:
             logger.warning(f"Could not check vector database: {ve}")
@@ -177,17 +191,29 @@ def init_for_deployment():
     logger.info("="*60)
 
     try:
-        # Step 1: Create directory structure
-        logger.info("\n[1/3] Creating directory structure...")
-        create_directory_structure()
+        # Steps 1 and 2 are independent file work; meanwhile the vector store
+        # (ChromaDB client + embedding model, the slow part) opens on its own thread
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            warmup = executor.submit(open_vector_store)
+
+            logger.info("\n[1/3] Creating directory structure...")
+            directories = executor.submit(create_directory_structure)
+
+            logger.info("\n[2/3] Checking admin knowledge base...")
+            kb_created = executor.submit(create_sample_admin_kb)
+
+            directories.result()
+            kb_created.result()
 
-        # Step 2: Create sample knowledge base if needed
-        logger.info("\n[2/3] Checking admin knowledge base...")
-        kb_created = create_sample_admin_kb()
+            try:
+                vector_store = warmup.result()
+            except Exception as e:
+                logger.warning(f"Could not open vector store in the background: {e}")
+                vector_store = None
 
         # Step 3: Initialize vector database
         logger.info("\n[3/3] Initializing vector database...")
-        initialize_vector_database()
+        initialize_vector_database(vector_store)
 
         logger.info("\n" + "="*60)
         logger.info("✓ Initialization complete!")
@@ -2,19 +2,51 @@
 Interactive OneStream Q&A Mode
 Ask questions and get answers using Grok-4 RAG system
 """
-import json
 import os
+import sys
+import time
+import orjson
+from dataclasses import dataclass
+from typing import Dict, Tuple
 from agent2_rag_expert import OneStreamExpert
-from vector_store import VectorStore
+from vector_store import VectorStore, COLLECTION_NAME
+from kb_fingerprint import kb_file_hash, embedded_kb_hash, record_embedded_kb_hash
+from answer_cache import AnswerCache
+from cli_history import enable_history
 import config
 
+
+@dataclass(frozen=True)
+class KBDoc:
+    """Sample knowledge base document"""
+    title: str
+    url: str
+    summary: str
+    content: str
+    source_type: str
+    date_collected: str
+    word_count: int
+
+    def to_dict(self) -> Dict:
+        """Knowledge base JSON record layout"""
+        return {
+            "title": self.title,
+            "url": self.url,
+            "summary": self.summary,
+            "content": self.content,
+            "source_type": self.source_type,
+            "date_collected": self.date_collected,
+            "metadata": {"word_count": self.word_count}
+        }
+
+
 # Sample OneStream knowledge for immediate use
-SAMPLE_KB = [
-    {
-        "title": "OneStream Business Rules Guide",
-        "url": "https://docs.onestreamsoftware.com/business-rules",
-        "summary": "Guide to creating and managing business rules in OneStream using VB.NET",
-        "content": """
+SAMPLE_KB = (
+    KBDoc(
+        title="OneStream Business Rules Guide",
+        url="https://docs.onestreamsoftware.com/business-rules",
+        summary="Guide to creating and managing business rules in OneStream using VB.NET",
+        content="""
         OneStream Business Rules are written in VB.NET and allow for custom calculations,
         validations, and data transformations. Key concepts include:
 
@@ -42,15 +74,15 @@ SAMPLE_KB = [
 
         Best practices: Always use error handling, cache member lookups, and test thoroughly.
         """,
-        "source_type": "documentation",
-        "date_collected": "2025-01-10",
-        "metadata": {"word_count": 150}
-    },
-    {
-        "title": "OneStream Cube Views Overview",
-        "url": "https://docs.onestreamsoftware.com/cube-views",
-        "summary": "Overview of creating and configuring cube views in OneStream",
-        "content": """
+        source_type="documentation",
+        date_collected="2025-01-10",
+        word_count=150
+    ),
+    KBDoc(
+        title="OneStream Cube Views Overview",
+        url="https://docs.onestreamsoftware.com/cube-views",
+        summary="Overview of creating and configuring cube views in OneStream",
+        content="""
         Cube Views in OneStream provide multi-dimensional data visualization and reporting.
 
         Key Components:
@@ -77,15 +109,15 @@ SAMPLE_KB = [
         - Cell-level annotations
         - Drill-through capabilities
         """,
-        "source_type": "documentation",
-        "date_collected": "2025-01-10",
-        "metadata": {"word_count": 120}
-    },
-    {
-        "title": "VIE Elimination Configuration",
-        "url": "https://community.onestreamsoftware.com/vie-elimination",
-        "summary": "How to configure Variable Interest Entity (VIE) elimination logic",
-        "content": """
+        source_type="documentation",
+        date_collected="2025-01-10",
+        word_count=120
+    ),
+    KBDoc(
+        title="VIE Elimination Configuration",
+        url="https://community.onestreamsoftware.com/vie-elimination",
+        summary="How to configure Variable Interest Entity (VIE) elimination logic",
+        content="""
         VIE (Variable Interest Entity) Elimination in OneStream requires careful configuration:
 
         Step 1: Define VIE Relationships
@@ -113,15 +145,15 @@ SAMPLE_KB = [
         - Missing elimination accounts
         - Circular reference errors in consolidation
         """,
-        "source_type": "community",
-        "date_collected": "2025-01-10",
-        "metadata": {"word_count": 145}
-    },
-    {
-        "title": "Dynamic Data Management Sequences",
-        "url": "https://docs.onestreamsoftware.com/data-management",
-        "summary": "Guide to implementing data management sequences for automated data processing",
-        "content": """
+        source_type="community",
+        date_collected="2025-01-10",
+        word_count=145
+    ),
+    KBDoc(
+        title="Dynamic Data Management Sequences",
+        url="https://docs.onestreamsoftware.com/data-management",
+        summary="Guide to implementing data management sequences for automated data processing",
+        content="""
         Data Management Sequences automate data integration and transformation workflows.
 
         Sequence Types:
@@ -158,15 +190,15 @@ SAMPLE_KB = [
         - Implement retry logic for transient errors
         - Maintain audit trails of all data changes
         """,
-        "source_type": "documentation",
-        "date_collected": "2025-01-10",
-        "metadata": {"word_count": 155}
-    },
-    {
-        "title": "OneStream Workflow Configuration",
-        "url": "https://docs.onestreamsoftware.com/workflow",
-        "summary": "Setting up and managing workflows in OneStream",
-        "content": """
+        source_type="documentation",
+        date_collected="2025-01-10",
+        word_count=155
+    ),
+    KBDoc(
+        title="OneStream Workflow Configuration",
+        url="https://docs.onestreamsoftware.com/workflow",
+        summary="Setting up and managing workflows in OneStream",
+        content="""
         OneStream Workflows coordinate the data collection, validation, and approval process.
 
         Workflow Components:
@@ -204,15 +236,15 @@ SAMPLE_KB = [
         - Monitor workflow status dashboards
         - Train users on submission procedures
         """,
-        "source_type": "documentation",
-        "date_collected": "2025-01-10",
-        "metadata": {"word_count": 140}
-    },
-    {
-        "title": "OneStream Consolidation Engine",
-        "url": "https://docs.onestreamsoftware.com/consolidation",
-        "summary": "Understanding the consolidation engine and custom consolidation logic",
-        "content": """
+        source_type="documentation",
+        date_collected="2025-01-10",
+        word_count=140
+    ),
+    KBDoc(
+        title="OneStream Consolidation Engine",
+        url="https://docs.onestreamsoftware.com/consolidation",
+        summary="Understanding the consolidation engine and custom consolidation logic",
+        content="""
         The OneStream Consolidation Engine handles multi-level entity consolidations automatically.
 
         Core Concepts:
@@ -256,26 +288,62 @@ SAMPLE_KB = [
         - Optimize elimination rules
         - Pre-calculate common allocations
         """,
-        "source_type": "documentation",
-        "date_collected": "2025-01-10",
-        "metadata": {"word_count": 180}
-    }
-]
+        source_type="documentation",
+        date_collected="2025-01-10",
+        word_count=180
+    )
+)
 
 def setup_kb():
     """Setup knowledge base if needed"""
     if not os.path.exists(config.KB_OUTPUT_PATH):
         print("[Setup] Creating knowledge base...")
-        with open(config.KB_OUTPUT_PATH, 'w', encoding='utf-8') as f:
-            json.dump(SAMPLE_KB, f, indent=2)
+        with open(config.KB_OUTPUT_PATH, 'wb') as f:
+            f.write(orjson.dumps([doc.to_dict() for doc in SAMPLE_KB], option=orjson.OPT_INDENT_2))
         print(f"[OK] Created knowledge base with {len(SAMPLE_KB)} documents\n")
 
-    if not os.path.exists(config.VECTOR_DB_PATH):
+    # Re-embed only when the KB file differs from the one the vector DB was built from
+    kb_hash = kb_file_hash(config.KB_OUTPUT_PATH)
+    if embedded_kb_hash(config.VECTOR_DB_PATH, COLLECTION_NAME) != kb_hash:
         print("[Setup] Building vector database...")
         vector_store = VectorStore()
+        vector_store.clear()
         vector_store.embed_documents(config.KB_OUTPUT_PATH)
+        record_embedded_kb_hash(config.VECTOR_DB_PATH, COLLECTION_NAME, kb_hash)
         print("[OK] Vector database ready\n")
 
+QUIT_COMMANDS = frozenset({"quit", "exit", "q"})
+HELP_COMMANDS = frozenset({"help", "?"})
+
+# Streamed tokens are written in small bursts rather than one write per token
+STREAM_FLUSH_TOKENS = 8
+STREAM_FLUSH_INTERVAL = 0.05  # seconds
+
+
+def stream_answer(expert: OneStreamExpert, question: str) -> Tuple[str, str]:
+    """Print the answer as it is generated; returns (full_answer, confidence)"""
+    full_answer = ""
+    confidence = "low"
+    buffer = []
+    last_flush = time.monotonic()
+
+    for event in expert.answer_question_stream(question):
+        if event["type"] == "token":
+            buffer.append(event["text"])
+            if len(buffer) >= STREAM_FLUSH_TOKENS or time.monotonic() - last_flush > STREAM_FLUSH_INTERVAL:
+                sys.stdout.write("".join(buffer))
+                sys.stdout.flush()
+                buffer.clear()
+                last_flush = time.monotonic()
+        elif event["type"] == "done":
+            full_answer = event["full_answer"]
+            confidence = event["confidence"]
+
+    sys.stdout.write("".join(buffer))
+    sys.stdout.flush()
+    return full_answer, confidence
+
+
 def main():
     """Run interactive Q&A session"""
     print("\n" + "="*70)
@@ -288,8 +356,13 @@ def main():
     # Initialize expert
     print("Initializing expert system...")
     expert = OneStreamExpert()
+    expert.warmup()
     print("[OK] System ready!\n")
 
+    # Up-arrow recalls earlier questions; repeats are answered from the cache
+    enable_history("onestream")
+    answers = AnswerCache(maxsize=256)
+
     print("Ask me anything about OneStream!")
     print("Commands: 'quit' or 'exit' to stop, 'help' for tips\n")
 
@@ -302,11 +375,12 @@ def main():
             if not question:
                 continue
 
-            if question.lower() in ['quit', 'exit', 'q']:
+            command = question.lower()
+            if command in QUIT_COMMANDS:
                 print("\nGoodbye!")
                 break
 
-            if question.lower() == 'help':
+            if command in HELP_COMMANDS:
                 print("\nTips:")
                 print("  - Ask about business rules, cube views, workflows, consolidation")
                 print("  - Request VB.NET code examples")
@@ -317,16 +391,23 @@ def main():
             question_count += 1
             print(f"\n[Question #{question_count}] Processing...")
 
-            # Get answer
-            result = expert.answer_question(question)
-
-            # Display answer
+            # Display answer as it streams in
             print("\n" + "="*70)
             print("ANSWER:")
             print("="*70 + "\n")
-            print(result['answer'])
-            print("\n" + "="*70)
-            print(f"Confidence: {result['confidence']}")
+            cached = answers.get("interactive", "", question)
+            if cached is not None:
+                print(cached["answer"], end="")
+                confidence = cached["confidence"]
+            else:
+                full_answer, confidence = stream_answer(expert, question)
+                answers.put("interactive", "", question, {
+                    "answer": full_answer,
+                    "citations": [],
+                    "confidence": confidence
+                })
+            print("\n\n" + "="*70)
+            print(f"Confidence: {confidence}")
             print("="*70)
 
         except KeyboardInterrupt:
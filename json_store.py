@@ -0,0 +1,57 @@
+"""
+JSON Store
+orjson serialization and crash-safe atomic writes for chat and KB files
+"""
+import os
+import tempfile
+from pathlib import Path
+from typing import Any
+import orjson
+
+# Compact output by default; set DEBUG_JSON=1 for indented files when inspecting by hand
+DUMPS_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+if os.getenv("DEBUG_JSON"):
+    DUMPS_OPTIONS |= orjson.OPT_INDENT_2
+
+
+def dumps(data: Any) -> bytes:
+    """Serialize to UTF-8 JSON bytes"""
+    return orjson.dumps(data, option=DUMPS_OPTIONS)
+
+
+def dumps_line(data: Any) -> bytes:
+    """Serialize one newline-terminated JSONL record (always compact)"""
+    return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+                        | orjson.OPT_APPEND_NEWLINE)
+
+
+def loads(data) -> Any:
+    return orjson.loads(data)
+
+
+def read_json(path) -> Any:
+    return orjson.loads(Path(path).read_bytes())
+
+
+def write_json_atomic(path, data: Any):
+    """Serialize and atomically write JSON (see write_bytes_atomic)"""
+    write_bytes_atomic(path, dumps(data))
+
+
+def write_bytes_atomic(path, payload: bytes):
+    """
+    Write to a temp file in the target directory, then os.replace() it
+    over the target so readers never see a partially written file
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp = tempfile.NamedTemporaryFile(dir=path.parent, prefix=f".{path.name}.",
+                                      suffix=".tmp", delete=False)
+    try:
+        with tmp:
+            tmp.write(payload)
+        os.replace(tmp.name, path)
+    except BaseException:
+        Path(tmp.name).unlink(missing_ok=True)
+        raise
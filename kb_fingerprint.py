@@ -0,0 +1,64 @@
+"""
+KB Fingerprints
+Records which knowledge base file contents a vector collection was built from,
+so unchanged knowledge bases are not re-embedded on restart
+"""
+import os
+import hashlib
+from pathlib import Path
+from typing import Iterable, Optional
+from json_store import write_bytes_atomic
+
+# Fingerprint names: the admin KB, and each user's chunks in the multi-user
+# collection (prefix = multi_user_vector_store.GLOBAL_COLLECTION_NAME)
+ADMIN_FINGERPRINT = "admin_kb"
+USER_FINGERPRINT_PREFIX = "kb_global"
+
+
+def user_fingerprint(username: str) -> str:
+    """Fingerprint name recording which KB contents a user's chunks were built from"""
+    return f"{USER_FINGERPRINT_PREFIX}.{username}"
+
+
+def kb_file_hash(kb_path: str) -> str:
+    """BLAKE2b digest of the knowledge base file, read in 1 MB blocks"""
+    return kb_files_hash([kb_path])
+
+
+def kb_files_hash(paths: Iterable[str]) -> str:
+    """One BLAKE2b digest over several files (e.g. a JSONL KB and its index), in order"""
+    digest = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def kb_files_version(paths: Iterable) -> str:
+    """
+    Cheap change token for a set of files: size and mtime of each ("-" when
+    missing). Unlike kb_files_hash it reads no data, so it can run per request
+    """
+    parts = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            parts.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+        except FileNotFoundError:
+            parts.append("-")
+    return "/".join(parts)
+
+
+def fingerprint_path(db_path: str, collection_name: str) -> Path:
+    return Path(db_path) / f".{collection_name}.kb_hash"
+
+
+def embedded_kb_hash(db_path: str, collection_name: str) -> Optional[str]:
+    """Hash of the KB the collection was last built from, if recorded"""
+    path = fingerprint_path(db_path, collection_name)
+    return path.read_text().strip() if path.exists() else None
+
+
+def record_embedded_kb_hash(db_path: str, collection_name: str, kb_hash: str):
+    write_bytes_atomic(fingerprint_path(db_path, collection_name), kb_hash.encode())
@@ -1,46 +1,103 @@
 """
 Batch load all PDF files from Regulations Dataset into the knowledge base
 """
-import json
+import os
+import hashlib
 import logging
+import orjson
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
-import PyPDF2
+from typing import Dict, Iterable, Iterator, List, Optional
+import fitz  # PyMuPDF
+from json_store import read_json, write_bytes_atomic
 import config
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# PDFs extracted per round; the knowledge base is saved after each round
+PDFS_PER_GROUP = 16
+# Minimum words for a trailing chunk to be kept
+MIN_CHUNK_WORDS = 50
 
-def extract_pdf_content(pdf_path: str) -> str:
-    """Extract text content from PDF file"""
-    logger.info(f"Extracting content from {Path(pdf_path).name}...")
 
-    try:
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            num_pages = len(pdf_reader.pages)
+def iter_pdf_pages(pdf_path: str) -> Iterator[str]:
+    """Yield the text of each non-empty page of a PDF file"""
+    with fitz.open(pdf_path) as pdf_doc:
+        num_pages = pdf_doc.page_count
+
+        for page_num, page in enumerate(pdf_doc):
+            text = page.get_text("text")
+            if text.strip():
+                yield text
 
-            content = []
-            for page_num in range(num_pages):
-                page = pdf_reader.pages[page_num]
-                text = page.extract_text()
-                if text.strip():
-                    content.append(text)
+            if (page_num + 1) % 50 == 0:
+                logger.info(f"  Processed {page_num + 1}/{num_pages} pages")
 
-                if (page_num + 1) % 50 == 0:
-                    logger.info(f"  Processed {page_num + 1}/{num_pages} pages")
 
-            full_content = "\n\n".join(content)
-            logger.info(f"  Extracted {len(full_content)} characters from {num_pages} pages")
-            return full_content
+def stream_chunks(pages: Iterable[str], chunk_size: int = config.CHUNK_SIZE,
+                  overlap: int = config.CHUNK_OVERLAP) -> Iterator[str]:
+    """
+    Overlapping word-window chunks over a stream of pages
+    Only ever buffers about one chunk's worth of words
+    """
+    stride = chunk_size - overlap
+    window = []
+
+    for page in pages:
+        window.extend(page.split())
+        while len(window) >= chunk_size:
+            yield ' '.join(window[:chunk_size])
+            del window[:stride]
 
+    # Trailing partial windows
+    while window:
+        if len(window) > MIN_CHUNK_WORDS:
+            yield ' '.join(window)
+        del window[:stride]
+
+
+def extract_pdf_chunks(pdf_path: str) -> Optional[Dict]:
+    """
+    Extract a PDF straight into chunks, without materializing its full text
+    Returns {chunks, word_count, char_count, content_hash}, or None on failure
+    """
+    logger.info(f"Extracting content from {Path(pdf_path).name}...")
+
+    word_count = 0
+    char_count = 0
+    content_hash = hashlib.sha256()
+
+    def counted(pages: Iterable[str]) -> Iterator[str]:
+        nonlocal word_count, char_count
+        for page in pages:
+            content_hash.update(page.encode('utf-8'))
+            word_count += len(page.split())
+            char_count += len(page)
+            yield page
+
+    try:
+        chunks: List[str] = list(stream_chunks(counted(iter_pdf_pages(pdf_path))))
     except Exception as e:
         logger.error(f"Error extracting PDF {pdf_path}: {e}")
         return None
 
+    logger.info(f"  Extracted {char_count} characters into {len(chunks)} chunks")
+    return {
+        "chunks": chunks,
+        "word_count": word_count,
+        "char_count": char_count,
+        "content_hash": content_hash.hexdigest()
+    }
+
+
+def save_knowledge_base(documents: list, kb_path: str):
+    """Write the knowledge base JSON file (atomically, so checkpoints never leave it truncated)"""
+    write_bytes_atomic(kb_path, orjson.dumps(documents, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
 
-def load_regulations_dataset(dataset_dir: str, kb_path: str):
+
+def load_regulations_dataset(dataset_dir: str, kb_path: str, max_workers: int = None):
     """
     Load all PDF files from the Regulations Dataset directory into knowledge base
     """
@@ -60,68 +117,80 @@ def load_regulations_dataset(dataset_dir: str, kb_path: str):
     # Load existing knowledge base or create new one
     if Path(kb_path).exists():
         logger.info(f"Loading existing knowledge base from {kb_path}")
-        with open(kb_path, 'r', encoding='utf-8') as f:
-            documents = json.load(f)
+        documents = read_json(kb_path)
         logger.info(f"Existing knowledge base has {len(documents)} documents")
     else:
         logger.info("Creating new knowledge base")
         documents = []
 
+    # filename -> position in documents, for O(1) update-or-append
+    # (first occurrence wins, as with the previous linear scan)
+    idx_by_filename = {}
+    for doc_idx, doc in enumerate(documents):
+        idx_by_filename.setdefault(doc.get('metadata', {}).get('filename'), doc_idx)
+
     # Track statistics
     added_count = 0
     updated_count = 0
     skipped_count = 0
     failed_count = 0
 
-    # Process each PDF
-    for idx, pdf_path in enumerate(pdf_files, 1):
-        pdf_filename = pdf_path.name
-
-        logger.info(f"\n[{idx}/{len(pdf_files)}] Processing: {pdf_filename}")
-
-        # Extract content
-        content = extract_pdf_content(str(pdf_path))
-
-        if not content or len(content) < 100:
-            logger.warning(f"  Insufficient content extracted, skipping")
-            failed_count += 1
-            continue
-
-        # Create document entry
-        doc = {
-            "title": pdf_filename.replace(".pdf", ""),
-            "url": f"file:///{pdf_path}",
-            "summary": f"Regulatory document: {pdf_filename}",
-            "content": content,
-            "source_type": "regulation_document",
-            "date_collected": datetime.now().isoformat(),
-            "metadata": {
-                "word_count": len(content.split()),
-                "filename": pdf_filename,
-                "category": "regulations"
-            }
-        }
-
-        # Check if PDF already in knowledge base
-        existing_idx = None
-        for doc_idx, existing_doc in enumerate(documents):
-            if existing_doc.get('metadata', {}).get('filename') == pdf_filename:
-                existing_idx = doc_idx
-                break
-
-        if existing_idx is not None:
-            documents[existing_idx] = doc
-            updated_count += 1
-            logger.info(f"  Updated existing entry")
-        else:
-            documents.append(doc)
-            added_count += 1
-            logger.info(f"  Added new entry")
-
-    # Save updated knowledge base
-    logger.info(f"\nSaving knowledge base to {kb_path}...")
-    with open(kb_path, 'w', encoding='utf-8') as f:
-        json.dump(documents, f, indent=2, ensure_ascii=False)
+    # PDFs are independent, so extraction fans out across processes; results
+    # are merged here in file order, one group at a time to bound memory
+    max_workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for group_start in range(0, len(pdf_files), PDFS_PER_GROUP):
+            group = pdf_files[group_start:group_start + PDFS_PER_GROUP]
+            extracted = executor.map(extract_pdf_chunks, [str(p) for p in group])
+
+            for idx, (pdf_path, result) in enumerate(zip(group, extracted), group_start + 1):
+                pdf_filename = pdf_path.name
+
+                logger.info(f"\n[{idx}/{len(pdf_files)}] Processing: {pdf_filename}")
+
+                if not result or result["char_count"] < 100:
+                    logger.warning(f"  Insufficient content extracted, skipping")
+                    failed_count += 1
+                    continue
+
+                # Check if PDF already in knowledge base
+                existing_idx = idx_by_filename.get(pdf_filename)
+
+                if (existing_idx is not None and
+                        documents[existing_idx].get('metadata', {}).get('content_hash') == result["content_hash"]):
+                    skipped_count += 1
+                    logger.info(f"  Unchanged since last load, skipping")
+                    continue
+
+                # Create document entry; content is stored pre-chunked
+                doc = {
+                    "title": pdf_filename.replace(".pdf", ""),
+                    "url": f"file:///{pdf_path}",
+                    "summary": f"Regulatory document: {pdf_filename}",
+                    "content": result["chunks"],
+                    "source_type": "regulation_document",
+                    "date_collected": datetime.now().isoformat(),
+                    "metadata": {
+                        "word_count": result["word_count"],
+                        "filename": pdf_filename,
+                        "category": "regulations",
+                        "content_hash": result["content_hash"]
+                    }
+                }
+
+                if existing_idx is not None:
+                    documents[existing_idx] = doc
+                    updated_count += 1
+                    logger.info(f"  Updated existing entry")
+                else:
+                    idx_by_filename[pdf_filename] = len(documents)
+                    documents.append(doc)
+                    added_count += 1
+                    logger.info(f"  Added new entry")
+
+            # Checkpoint after each group so an interrupted run keeps its progress
+            save_knowledge_base(documents, kb_path)
+            logger.info(f"Saved {len(documents)} documents after {min(group_start + PDFS_PER_GROUP, len(pdf_files))}/{len(pdf_files)} PDFs")
 
     logger.info("="*70)
     logger.info("BATCH LOAD COMPLETE")
@@ -129,6 +198,7 @@ def load_regulations_dataset(dataset_dir: str, kb_path: str):
     logger.info(f"Total documents in knowledge base: {len(documents)}")
     logger.info(f"  Added: {added_count}")
     logger.info(f"  Updated: {updated_count}")
+    logger.info(f"  Unchanged: {skipped_count}")
     logger.info(f"  Failed: {failed_count}")
     logger.info("="*70)
 
@@ -136,6 +206,7 @@ def load_regulations_dataset(dataset_dir: str, kb_path: str):
         "total_documents": len(documents),
         "added": added_count,
         "updated": updated_count,
+        "skipped": skipped_count,
         "failed": failed_count
     }
 
@@ -159,6 +230,7 @@ def main():
         print(f"Total documents: {stats['total_documents']}")
         print(f"  New documents added: {stats['added']}")
         print(f"  Documents updated: {stats['updated']}")
+        print(f"  Documents unchanged: {stats['skipped']}")
         print(f"  Documents failed: {stats['failed']}")
         print(f"\nNext steps:")
         print(f"1. Rebuild vector database: python vector_store.py")
@@ -1,72 +1,432 @@
 """
 Multi-User Vector Store
-Manages separate vector databases for admin (global) and user-specific documents
+Admin (global) and user-specific documents in one vector collection
 """
-import json
+import os
+import shutil
 import logging
-from typing import List, Dict
+import functools
+import hashlib
+import threading
+import contextlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Iterable, List, Dict, Tuple
 from pathlib import Path
+import numpy as np
+import torch
+import diskcache
+import ijson
 import chromadb
 from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
+from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+from tqdm.auto import tqdm
+from user_kb_store import load_kb_documents
+from chroma_utils import copy_collection, open_ip_collection
+from json_store import read_json, write_json_atomic
 import config
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-
-class MultiUserVectorStore:
-    """Vector store with admin and user-specific collections"""
-
-    def __init__(self, username: str = None):
-        self.username = username
-
-        # Initialize embedding model with explicit device handling
-        import torch
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-
+# Single collection holding admin chunks (is_admin=True) and every user's
+# chunks (is_admin=False, username=<user>)
+GLOBAL_COLLECTION_NAME = "kb_global"
+# Pre-kb_global layout: admin collection beside it, one DB per user
+LEGACY_ADMIN_COLLECTION = "admin_kb"
+LEGACY_USER_DB_PATH = "./user_data/{username}/user_vectordb"
+
+# FP16 copy of the admin chunk embeddings, memory-mapped for brute-force search
+ADMIN_SIDECAR_EMBEDDINGS = os.path.join(config.VECTOR_DB_PATH, "admin_emb.npy")
+ADMIN_SIDECAR_IDS = os.path.join(config.VECTOR_DB_PATH, "admin_ids.json")
+# Admin chunk count, recorded when the admin KB is embedded: Chroma's count()
+# takes no filter, and counting through get() is O(admin corpus)
+ADMIN_CHUNK_COUNT = os.path.join(config.VECTOR_DB_PATH, "admin_count.json")
+# FP16 rows appended batch by batch while the admin KB is embedded
+ADMIN_SIDECAR_ROWS = os.path.join(config.VECTOR_DB_PATH, "admin_emb.rows.tmp")
+# Above this many admin chunks, searches go back to Chroma's HNSW index
+SIDECAR_MAX_CHUNKS = 1_000_000
+# Sidecar rows upcast to float32 per matrix-vector product
+SIDECAR_BLOCK_ROWS = 65536
+
+# Query embeddings kept per store (LRU)
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+# Query embeddings persisted across processes and restarts
+QUERY_EMBEDDING_DISK_CACHE_DIR = "./cache/query_embeddings"
+QUERY_EMBEDDING_DISK_CACHE_BYTES = 64 * 1024 ** 2
+# Chunk embeddings keyed by SHA-256 of (model, backend, chunk), so re-embeds
+# only encode chunks whose text changed
+CHUNK_EMBEDDING_CACHE_DIR = "./cache/chunk_embeddings"
+CHUNK_EMBEDDING_CACHE_BYTES = 4 * 1024 ** 3
+# Chunks per Chroma add()/upsert() call (Chroma caps a batch at ~5k)
+CHROMA_WRITE_BATCH_SIZE = 1024
+# Rough WordPiece tokens per whitespace word, for sizing batches without tokenizing
+TOKENS_PER_WORD = 1.3
+
+
+def compute_chunk_offsets(word_counts: np.ndarray, chunk_size: int, overlap: int) -> np.ndarray:
+    """
+    Sentence-window chunking kernel
+    Given per-sentence word counts, returns an (n_chunks, 2) array of
+    [start, end) sentence indices. A chunk closes before the sentence that
+    would push it past chunk_size; the next one reopens with the trailing
+    whole sentences that fit within overlap words.
+    """
+    n_sentences = len(word_counts)
+    # Every chunk ends at a distinct sentence, so there are at most n_sentences
+    spans = np.empty((n_sentences, 2), dtype=np.int64)
+    n_spans = 0
+    start = 0
+    count = 0
+
+    for i in range(n_sentences):
+        n = int(word_counts[i])
+        if count + n > chunk_size and i > start:
+            spans[n_spans, 0] = start
+            spans[n_spans, 1] = i
+            n_spans += 1
+
+            # Walk back over whole sentences while they fit in the overlap
+            new_start = i
+            carried = 0
+            while new_start > start and carried + int(word_counts[new_start - 1]) <= overlap:
+                new_start -= 1
+                carried += int(word_counts[new_start])
+
+            start = new_start
+            count = carried
+
+        count += n
+
+    if n_sentences > start:
+        spans[n_spans, 0] = start
+        spans[n_spans, 1] = n_sentences
+        n_spans += 1
+
+    return spans[:n_spans]
+
+
+@functools.cache
+def get_chunker(chunk_size: int, overlap: int):
+    """
+    compute_chunk_offsets specialized for one (chunk_size, overlap) pair
+    With Numba installed, the pair is baked in as compile-time constants and
+    the kernel is JIT-compiled (and cached on disk); otherwise it runs as NumPy/Python
+    """
+    def chunker(word_counts):
+        return compute_chunk_offsets(word_counts, chunk_size, overlap)
+
+    try:
+        import numba
+    except ImportError:
+        return chunker
+
+    kernel = numba.njit(cache=True)(compute_chunk_offsets)
+
+    def jit_chunker(word_counts):
+        return kernel(word_counts, chunk_size, overlap)
+
+    return numba.njit(jit_chunker)
+
+
+def write_in_batches(write, ids: List[str], embeddings: np.ndarray,
+                     documents: List[str], metadatas: List[Dict],
+                     batch_size: int = CHROMA_WRITE_BATCH_SIZE) -> int:
+    """
+    Write chunks through a collection's add/upsert in large batches
+    A failing batch is retried in halves, so one bad chunk only loses itself
+    Returns the number of chunks that could not be written
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    pending = [(i, min(i + batch_size, len(ids))) for i in range(0, len(ids), batch_size)]
+    failed = 0
+
+    while pending:
+        start, end = pending.pop()
         try:
-            # Load model with explicit device and trust_remote_code
-            self.embedding_model = SentenceTransformer(
-                config.EMBEDDING_MODEL,
-                device=device,
-                trust_remote_code=True
+            write(
+                ids=ids[start:end],
+                embeddings=embeddings[start:end],
+                documents=documents[start:end],
+                metadatas=metadatas[start:end]
             )
-            logger.info(f"Loaded embedding model on {device}")
         except Exception as e:
-            logger.warning(f"Failed to load on {device}, trying CPU: {e}")
-            # Fallback to CPU with explicit settings
-            self.embedding_model = SentenceTransformer(
-                config.EMBEDDING_MODEL,
-                device="cpu",
-                trust_remote_code=True
-            )
-            logger.info("Loaded embedding model on CPU")
-
-        # Admin vector store (shared)
-        self.admin_client = chromadb.PersistentClient(
-            path=config.VECTOR_DB_PATH,
-            settings=Settings(anonymized_telemetry=False)
+            if end - start == 1:
+                logger.error(f"Failed to write chunk {ids[start]}: {e}")
+                failed += 1
+            else:
+                mid = (start + end) // 2
+                logger.warning(f"Batch write of {end - start} chunks failed, retrying in halves: {e}")
+                pending.extend([(mid, end), (start, mid)])
+
+    return failed
+
+
+def write_admin_sidecar(ids: List[str], rows_path: str, dim: int):
+    """
+    Persist the admin sidecar (FP16 .npy plus chunk ids, both atomically) from
+    a raw file of FP16 rows appended while embedding; the rows are copied
+    behind an .npy header block by block, never loaded whole
+    """
+    tmp_path = ADMIN_SIDECAR_EMBEDDINGS + ".tmp.npy"
+    header = {
+        "descr": np.lib.format.dtype_to_descr(np.dtype(np.float16)),
+        "fortran_order": False,
+        "shape": (len(ids), dim)
+    }
+    with open(tmp_path, 'wb') as out, open(rows_path, 'rb') as rows:
+        np.lib.format.write_array_header_1_0(out, header)
+        shutil.copyfileobj(rows, out, 1 << 20)
+    write_json_atomic(ADMIN_SIDECAR_IDS, ids)
+    os.replace(tmp_path, ADMIN_SIDECAR_EMBEDDINGS)
+
+
+def remove_admin_sidecar():
+    for path in (ADMIN_SIDECAR_EMBEDDINGS, ADMIN_SIDECAR_IDS):
+        Path(path).unlink(missing_ok=True)
+
+
+@functools.lru_cache(maxsize=1)
+def _load_admin_sidecar(mtime: float) -> Tuple[np.ndarray, List[str]]:
+    return np.load(ADMIN_SIDECAR_EMBEDDINGS, mmap_mode='r'), read_json(ADMIN_SIDECAR_IDS)
+
+
+def load_admin_sidecar():
+    """
+    (memory-mapped FP16 embeddings, chunk ids), or None when there is no
+    usable sidecar; reloaded only when the sidecar file changes
+    """
+    try:
+        embeddings, ids = _load_admin_sidecar(os.path.getmtime(ADMIN_SIDECAR_EMBEDDINGS))
+    except (OSError, ValueError) as e:
+        if Path(ADMIN_SIDECAR_EMBEDDINGS).exists():
+            logger.warning(f"Ignoring unreadable admin embedding sidecar: {e}")
+        return None
+
+    if len(ids) != len(embeddings) or len(ids) > SIDECAR_MAX_CHUNKS:
+        return None
+    return embeddings, ids
+
+
+def sidecar_scores(embeddings: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Inner products of every sidecar row with the query, block by block in float32 BLAS"""
+    query = query.astype(np.float32, copy=False)
+    return np.concatenate([
+        embeddings[start:start + SIDECAR_BLOCK_ROWS].astype(np.float32) @ query
+        for start in range(0, len(embeddings), SIDECAR_BLOCK_ROWS)
+    ]) if len(embeddings) else np.empty(0, dtype=np.float32)
+
+
+@functools.cache
+def get_query_embedding_disk_cache() -> diskcache.Cache:
+    """Disk-backed LRU of query embeddings, shared by every store in the process"""
+    return diskcache.Cache(QUERY_EMBEDDING_DISK_CACHE_DIR,
+                           size_limit=QUERY_EMBEDDING_DISK_CACHE_BYTES,
+                           eviction_policy="least-recently-used")
+
+
+@functools.cache
+def get_chunk_embedding_cache() -> diskcache.Cache:
+    """Disk-backed LRU of chunk embeddings (raw float32 bytes), shared across processes"""
+    return diskcache.Cache(CHUNK_EMBEDDING_CACHE_DIR,
+                           size_limit=CHUNK_EMBEDDING_CACHE_BYTES,
+                           eviction_policy="least-recently-used")
+
+
+def chunk_embedding_key(backend: str, chunk: str) -> bytes:
+    return hashlib.sha256(f"{config.EMBEDDING_MODEL}\x00{backend}\x00{chunk}".encode()).digest()
+
+
+def normalize_query_text(text: str) -> str:
+    """Query cache key; the embedding model is uncased, so case never changes the vector"""
+    return text.strip().lower()
+
+
+@functools.cache
+def configure_cpu_threads():
+    """
+    Pin PyTorch's CPU thread pools once per process (set_num_interop_threads
+    raises if called again after inter-op work has started)
+    """
+    torch.set_num_threads(config.RAG_NUM_THREADS)
+    try:
+        torch.set_num_interop_threads(2)
+    except RuntimeError as e:
+        logger.warning(f"Could not set PyTorch inter-op threads: {e}")
+    logger.info(f"PyTorch CPU threads: {config.RAG_NUM_THREADS} intra-op, 2 inter-op")
+
+
+def load_onnx_embedding_model() -> SentenceTransformer:
+    """
+    CPU embedding model on ONNX Runtime with dynamic INT8 quantization
+    The quantized export is written to config.ONNX_MODEL_DIR on first use
+    """
+    onnx_file = f"onnx/model_qint8_{config.ONNX_QUANTIZATION}.onnx"
+    model_dir = Path(config.ONNX_MODEL_DIR)
+
+    if not (model_dir / onnx_file).exists():
+        logger.info(f"Exporting {config.EMBEDDING_MODEL} to ONNX in {model_dir}...")
+        model = SentenceTransformer(config.EMBEDDING_MODEL, device="cpu", backend="onnx")
+        model.save_pretrained(str(model_dir))
+        export_dynamic_quantized_onnx_model(model, config.ONNX_QUANTIZATION, str(model_dir))
+
+    return SentenceTransformer(str(model_dir), device="cpu", backend="onnx",
+                               model_kwargs={"file_name": onnx_file})
+
+
+def _load_torch_embedding_model(device: str) -> Tuple[SentenceTransformer, str]:
+    """PyTorch embedding model on device, falling back to CPU; returns (model, device)"""
+    try:
+        # Load model with explicit device and trust_remote_code
+        model = SentenceTransformer(
+            config.EMBEDDING_MODEL,
+            device=device,
+            trust_remote_code=True
         )
-        self.admin_collection = self.admin_client.get_or_create_collection(
-            name="admin_kb",
-            metadata={"description": "Admin Knowledge Base"}
+        logger.info(f"Loaded embedding model on {device}")
+        return model, device
+    except Exception as e:
+        logger.warning(f"Failed to load on {device}, trying CPU: {e}")
+        # Fallback to CPU with explicit settings
+        model = SentenceTransformer(
+            config.EMBEDDING_MODEL,
+            device="cpu",
+            trust_remote_code=True
         )
+        logger.info("Loaded embedding model on CPU")
+        return model, "cpu"
+
+
+def encode_context(device: str) -> contextlib.AbstractContextManager:
+    """Inference mode, plus FP16 autocast on CUDA, around model.encode"""
+    stack = contextlib.ExitStack()
+    stack.enter_context(torch.inference_mode())
+    if device == "cuda":
+        stack.enter_context(torch.autocast(device_type="cuda", dtype=torch.float16))
+    return stack
+
+
+def compile_torch_encoder(model: SentenceTransformer, device: str) -> bool:
+    """
+    torch.compile the transformer (dynamic shapes, since batch and sequence
+    lengths vary) and warm it up. Compilation is lazy, so failures (no Triton,
+    unsupported ops) only surface in the warmup; the eager module is then
+    restored. Returns whether the compiled model is in place and warmed up
+    """
+    transformer = model[0]
+    eager_model = transformer.auto_model
+    try:
+        transformer.auto_model = torch.compile(eager_model, dynamic=True)
+        warm_up_embedder(model, device)
+        logger.info("Compiled embedding model with torch.compile")
+        return True
+    except Exception as e:
+        transformer.auto_model = eager_model
+        logger.warning(f"torch.compile unavailable for the embedding model: {e}")
+        return False
+
+
+def warm_up_embedder(model: SentenceTransformer, device: str):
+    """
+    Run one dummy batch so session setup, CUDA context/kernel selection and
+    any torch.compile happen at load time rather than on the first search
+    """
+    with encode_context(device):
+        model.encode(["warmup"] * 8, batch_size=8, convert_to_numpy=True, show_progress_bar=False)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_embedder(model_name: str, device: str) -> Tuple[SentenceTransformer, str, str]:
+    """
+    Load (and warm up) the embedding model once per (model, device)
+    Returns (model, device, backend)
+    """
+    if device == "cpu":
+        configure_cpu_threads()
+
+        if config.EMBEDDING_ONNX:
+            try:
+                model = load_onnx_embedding_model()
+                logger.info("Loaded INT8 ONNX embedding model on CPU")
+                warm_up_embedder(model, "cpu")
+                return model, "cpu", f"onnx-qint8-{config.ONNX_QUANTIZATION}"
+            except Exception as e:
+                logger.warning(f"ONNX embedding model unavailable, using PyTorch: {e}")
+
+    model, device = _load_torch_embedding_model(device)
+    model.eval()
+    # CPU inference goes through ONNX by default, so only CUDA is compiled
+    if not (device == "cuda" and config.EMBEDDING_TORCH_COMPILE and compile_torch_encoder(model, device)):
+        warm_up_embedder(model, device)
+    return model, device, f"torch-{device}"
+
+
+_embedder_lock = threading.Lock()
+
+def get_shared_embedder() -> Tuple[SentenceTransformer, str, str]:
+    """
+    Embedding model shared by every MultiUserVectorStore in the process
+    Returns (model, device, backend); the lock keeps concurrent first calls
+    from loading the weights twice
+    """
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    with _embedder_lock:
+        return _load_embedder(config.EMBEDDING_MODEL, device)
+
+
+def user_chunk_prefix(username: str, title: str = None) -> str:
+    """
+    Id prefix for a user's chunks in kb_global: of one document (title), or of
+    a full-KB embed (no title). The username is length-prefixed and hashed
+    with the title, so ids of different users never collide whatever
+    characters usernames and titles contain
+    """
+    scope = "*" if title is None else f"doc:{title}"
+    key = f"{len(username)}:{username}:{scope}"
+    return "user_" + hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+
+
+@dataclass
+class UserChunks:
+    """
+    A user's chunks with metadata stored column-wise: one record per document
+    plus two int32 arrays per chunk, instead of a dict per chunk. Ids and
+    metadata dicts are materialized only when written
+    """
+    username: str
+    chunks: List[str]
+    # Per document: title, url, source_type, summary and chunk count
+    documents: List[Dict]
+    # Per chunk: index into documents, and position within that document
+    doc_rows: np.ndarray
+    chunk_indices: np.ndarray
+
+    def ids(self) -> List[str]:
+        prefix = user_chunk_prefix(self.username)
+        return [f"{prefix}_chunk_{chunk_id}" for chunk_id in range(len(self.chunks))]
+
+    def metadatas(self) -> List[Dict]:
+        metadatas = []
+        for doc_row, chunk_index in zip(self.doc_rows.tolist(), self.chunk_indices.tolist()):
+            doc = self.documents[doc_row]
+            metadatas.append({
+                "document_title": doc['title'],
+                "url": doc['url'],
+                "source_type": doc['source_type'],
+                "chunk_index": chunk_index,
+                "total_chunks": doc['total_chunks'],
+                "doc_summary": doc['summary'],
+                "is_admin": False,
+                "username": self.username
+            })
+        return metadatas
 
-        # User vector store (if username provided)
-        self.user_collection = None
-        if username:
-            user_vector_path = f"./user_data/{username}/user_vectordb"
-            Path(user_vector_path).mkdir(parents=True, exist_ok=True)
 
-            self.user_client = chromadb.PersistentClient(
-                path=user_vector_path,
-                settings=Settings(anonymized_telemetry=False)
-            )
-            self.user_collection = self.user_client.get_or_create_collection(
-                name=f"user_{username}_kb",
-                metadata={"description": f"User {username} Knowledge Base"}
-            )
+class DocumentChunker:
+    """
+    Chunking without a model or vector database, so it can run in worker
+    processes that must not open the (single-process) Chroma store
+    """
 
     def chunk_text(self, text: str, chunk_size: int = config.CHUNK_SIZE,
                    overlap: int = config.CHUNK_OVERLAP) -> List[str]:
@@ -77,118 +437,313 @@ class MultiUserVectorStore:
         sentence_endings = r'(?<=[.!?])\s+'
         sentences = re.split(sentence_endings, text)
 
-        chunks = []
-        current_chunk = []
-        current_word_count = 0
-
-        for sentence in sentences:
-            sentence_words = sentence.split()
-            sentence_word_count = len(sentence_words)
-
-            # If adding this sentence exceeds chunk_size, save current chunk
-            if current_word_count + sentence_word_count > chunk_size and current_chunk:
-                chunk_text = ' '.join(current_chunk)
-                if len(chunk_text.split()) > 50:  # Min chunk size
-                    chunks.append(chunk_text)
-
-                # Start new chunk with overlap
-                # Keep last 'overlap' words from previous chunk
-                overlap_words = []
-                temp_count = 0
-                for sent in reversed(current_chunk):
-                    sent_words = sent.split()
-                    if temp_count + len(sent_words) <= overlap:
-                        overlap_words.insert(0, sent)
-                        temp_count += len(sent_words)
-                    else:
-                        break
-
-                current_chunk = overlap_words
-                current_word_count = temp_count
-
-            # Add current sentence
-            current_chunk.append(sentence)
-            current_word_count += sentence_word_count
-
-        # Add final chunk
-        if current_chunk:
-            chunk_text = ' '.join(current_chunk)
-            if len(chunk_text.split()) > 50:
-                chunks.append(chunk_text)
-
-        return chunks
-
-    def embed_admin_documents(self, kb_path: str):
-        """Embed admin knowledge base documents"""
-        logger.info(f"Loading admin knowledge base from {kb_path}...")
-
-        with open(kb_path, 'r', encoding='utf-8') as f:
-            documents = json.load(f)
-
-        logger.info(f"Processing {len(documents)} admin documents...")
-
+        # Count words once per sentence; the window math runs on counts only
+        word_counts = np.fromiter((len(sentence.split()) for sentence in sentences),
+                                  dtype=np.int64, count=len(sentences))
+        spans = get_chunker(chunk_size, overlap)(word_counts)
+
+        # Words per chunk via prefix sums, instead of re-splitting each chunk
+        cumulative = np.concatenate(([0], np.cumsum(word_counts)))
+        chunk_word_counts = cumulative[spans[:, 1]] - cumulative[spans[:, 0]]
+
+        return [' '.join(sentences[start:end])
+                for (start, end), n_words in zip(spans.tolist(), chunk_word_counts.tolist())
+                if n_words > 50]  # Min chunk size
+
+    def document_chunks(self, doc: Dict) -> List[str]:
+        """A document's chunks - content is either raw text or already chunked at load time"""
+        content = doc['content']
+        return content if isinstance(content, list) else self.chunk_text(content)
+
+    def chunk_user_documents(self, username: str, documents: Iterable[Dict]) -> UserChunks:
+        """
+        Chunk a user's documents for kb_global, with column-wise metadata
+        documents may be a stream (see user_kb_store.iter_kb_documents)
+        """
+        total_docs = len(documents) if hasattr(documents, "__len__") else "?"
         all_chunks = []
-        all_metadata = []
-        all_ids = []
-        chunk_id = 0
+        doc_records = []
 
         for doc_idx, doc in enumerate(documents):
-            chunks = self.chunk_text(doc['content'])
-
-            logger.info(f"Document {doc_idx + 1}/{len(documents)}: "
-                       f"{doc['title']} -> {len(chunks)} chunks")
-
-            for chunk_idx, chunk in enumerate(chunks):
-                metadata = {
-                    "document_title": doc['title'],
-                    "url": doc['url'],
-                    "source_type": doc['source_type'],
-                    "chunk_index": chunk_idx,
-                    "total_chunks": len(chunks),
-                    "doc_summary": doc['summary'],
-                    "is_admin": True
-                }
+            chunks = self.document_chunks(doc)
+
+            logger.info("User Document %d/%s: %s -> %d chunks",
+                        doc_idx + 1, total_docs, doc['title'], len(chunks))
+
+            all_chunks.extend(chunks)
+            doc_records.append({
+                "title": doc['title'],
+                "url": doc['url'],
+                "source_type": doc['source_type'],
+                "summary": doc['summary'],
+                "total_chunks": len(chunks)
+            })
 
-                all_chunks.append(chunk)
-                all_metadata.append(metadata)
-                all_ids.append(f"admin_chunk_{chunk_id}")
-                chunk_id += 1
+        # Per-chunk columns from the per-document counts, without a Python loop per chunk
+        counts = np.fromiter((doc['total_chunks'] for doc in doc_records), dtype=np.int32,
+                             count=len(doc_records))
+        doc_starts = np.cumsum(counts) - counts
+        doc_rows = np.repeat(np.arange(len(doc_records), dtype=np.int32), counts)
+        chunk_indices = (np.arange(len(all_chunks), dtype=np.int32) - doc_starts[doc_rows]).astype(np.int32)
+
+        return UserChunks(username, all_chunks, doc_records, doc_rows, chunk_indices)
+
+    def prepare_user_chunks(self, username: str,
+                            documents: Iterable[Dict]) -> Tuple[List[str], List[str], List[Dict]]:
+        """Chunk a user's documents into (ids, chunks, metadatas) for kb_global"""
+        user_chunks = self.chunk_user_documents(username, documents)
+        return user_chunks.ids(), user_chunks.chunks, user_chunks.metadatas()
+
+
+class ChunkEmbedder(DocumentChunker):
+    """Chunking plus embedding, still without a vector database"""
+
+    def __init__(self):
+        # Loaded once per process and shared across users
+        self.embedding_model, self.device, self.embedding_backend = get_shared_embedder()
+
+        self.batch_size = (config.EMBEDDING_BATCH_SIZE_GPU if self.device == "cuda"
+                           else config.EMBEDDING_BATCH_SIZE_CPU)
+
+    def encode(self, texts: List[str], batch_size: int) -> np.ndarray:
+        """
+        model.encode under inference mode, with FP16 autocast on CUDA
+        Embeddings always come back unit-length float32, as the ip-space
+        collection expects
+        """
+        with encode_context(self.device):
+            embeddings = self.embedding_model.encode(texts, batch_size=batch_size, convert_to_numpy=True,
+                                                     normalize_embeddings=True)
+        return embeddings.astype(np.float32, copy=False)
+
+    def encode_chunks(self, chunks: List[str], show_progress_bar: bool = False) -> np.ndarray:
+        """
+        Embed chunks, encoding each distinct text once and only if it is
+        missing from the chunk embedding cache; rows are returned in the
+        original chunk order
+        """
+        # Identical chunks (boilerplate headers/footers, repeated TOCs) share one row
+        positions = {}
+        back = [positions.setdefault(chunk, len(positions)) for chunk in chunks]
+        if len(positions) == len(chunks):
+            return self._encode_cached(chunks, show_progress_bar)
+
+        logger.info("Embedding %d distinct texts for %d chunks", len(positions), len(chunks))
+        return self._encode_cached(list(positions), show_progress_bar)[back]
+
+    def _encode_cached(self, chunks: List[str], show_progress_bar: bool = False) -> np.ndarray:
+        """Embed chunks through the on-disk chunk embedding cache"""
+        if not chunks:
+            return self._encode_smart_batched(chunks)
+
+        cache = get_chunk_embedding_cache()
+        keys = [chunk_embedding_key(self.embedding_backend, chunk) for chunk in chunks]
+        cached = [cache.get(key) for key in keys]
+        misses = [i for i, value in enumerate(cached) if value is None]
+
+        if not misses:
+            logger.info(f"All {len(chunks)} chunk embeddings served from cache")
+            return np.stack([np.frombuffer(value, dtype=np.float32) for value in cached])
+
+        logger.info(f"Encoding {len(misses)} of {len(chunks)} chunks ({len(chunks) - len(misses)} cached)")
+        encoded = self._encode_smart_batched([chunks[i] for i in misses], show_progress_bar)
+
+        # One SQLite transaction for the whole write-back
+        with cache.transact():
+            for i, embedding in zip(misses, encoded):
+                cache.set(keys[i], embedding.tobytes())
+
+        embeddings = np.empty((len(chunks), encoded.shape[1]), dtype=np.float32)
+        embeddings[misses] = encoded
+        for i, value in enumerate(cached):
+            if value is not None:
+                embeddings[i] = np.frombuffer(value, dtype=np.float32)
+        return embeddings
+
+    def _encode_smart_batched(self, chunks: List[str], show_progress_bar: bool = False) -> np.ndarray:
+        """
+        Embed chunks longest-first so each batch pads to near-uniform length
+        ("smart batching"); rows are returned in the original chunk order
+        Batches hold at most self.batch_size chunks and
+        config.EMBEDDING_MAX_TOKENS_PER_BATCH padded tokens
+        """
+        if not chunks:
+            return np.empty((0, self.embedding_model.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        lengths = np.fromiter((len(chunk.split()) for chunk in chunks), dtype=np.int64, count=len(chunks))
+        order = np.argsort(-lengths, kind='stable')
+
+        # Estimated tokens per chunk (+2 for [CLS]/[SEP]), truncated like the model does
+        tokens = np.minimum(np.ceil(lengths[order] * TOKENS_PER_WORD).astype(np.int64) + 2,
+                            self.embedding_model.max_seq_length).tolist()
+        sorted_chunks = [chunks[i] for i in order.tolist()]
+
+        # Longest chunk comes first in each batch, so it sets the padded width
+        batches = []
+        start = 0
+        while start < len(sorted_chunks):
+            size = max(1, min(self.batch_size, config.EMBEDDING_MAX_TOKENS_PER_BATCH // tokens[start]))
+            batches.append(sorted_chunks[start:start + size])
+            start += size
+
+        sorted_embeddings = np.concatenate([
+            self.encode(batch, batch_size=len(batch))
+            for batch in tqdm(batches, desc="Embedding", disable=not show_progress_bar)
+        ])
+
+        # Invert the permutation so rows line up with ids/metadata again
+        embeddings = np.empty_like(sorted_embeddings)
+        embeddings[order] = sorted_embeddings
+        return embeddings
+
+
+class MultiUserVectorStore(ChunkEmbedder):
+    """Vector store over admin and user-specific documents"""
 
-        logger.info(f"Generating embeddings for {len(all_chunks)} chunks...")
+    def __init__(self, username: str = None):
+        super().__init__()
+        self.username = username
+        self._query_embeddings = OrderedDict()
+        self._query_embeddings_lock = threading.Lock()
 
-        embeddings = self.embedding_model.encode(
-            all_chunks,
-            show_progress_bar=True,
-            batch_size=32
+        # One collection for admin and user chunks; searches filter on metadata
+        self.client = chromadb.PersistentClient(
+            path=config.VECTOR_DB_PATH,
+            settings=Settings(anonymized_telemetry=False)
         )
+        self.collection = open_ip_collection(
+            self.client,
+            GLOBAL_COLLECTION_NAME,
+            {"description": "Admin and user knowledge bases"}
+        )
+        self._migrate_legacy_collections()
+
+    def _migrate_legacy_collections(self):
+        """Fold the old admin_kb collection and this user's own vector DB into kb_global"""
+        existing = {getattr(c, "name", c) for c in self.client.list_collections()}
+        if LEGACY_ADMIN_COLLECTION in existing:
+            legacy = self.client.get_collection(LEGACY_ADMIN_COLLECTION)
+            copied = copy_collection(legacy, self.collection, {"is_admin": True})
+            Path(ADMIN_CHUNK_COUNT).unlink(missing_ok=True)
+            self.client.delete_collection(LEGACY_ADMIN_COLLECTION)
+            logger.info(f"Migrated {copied} admin chunks into {GLOBAL_COLLECTION_NAME}")
+
+        if not self.username:
+            return
 
-        logger.info("Storing in admin vector database...")
-
-        # Clear existing and add new
-        self.admin_collection.delete(where={"is_admin": True})
+        legacy_path = Path(LEGACY_USER_DB_PATH.format(username=self.username))
+        if not legacy_path.exists():
+            return
 
-        batch_size = 100
-        for i in range(0, len(all_chunks), batch_size):
-            batch_end = min(i + batch_size, len(all_chunks))
+        legacy_client = chromadb.PersistentClient(
+            path=str(legacy_path),
+            settings=Settings(anonymized_telemetry=False)
+        )
+        legacy_name = f"user_{self.username}_kb"
+        if legacy_name in {getattr(c, "name", c) for c in legacy_client.list_collections()}:
+            legacy = legacy_client.get_collection(legacy_name)
+            copied = copy_collection(legacy, self.collection,
+                                     {"is_admin": False, "username": self.username})
+            legacy_client.delete_collection(legacy_name)
+            logger.info(f"Migrated {copied} chunks for {self.username} into {GLOBAL_COLLECTION_NAME}")
+
+    def _user_filter(self) -> Dict:
+        return {"$and": [{"is_admin": False}, {"username": self.username}]}
+
+    def _search_filter(self) -> Dict:
+        """Admin chunks plus this user's own chunks"""
+        if not self.username:
+            return {"is_admin": True}
+        return {"$or": [{"is_admin": True}, {"username": self.username}]}
 
-            self.admin_collection.add(
-                ids=all_ids[i:batch_end],
-                embeddings=embeddings[i:batch_end].tolist(),
-                documents=all_chunks[i:batch_end],
-                metadatas=all_metadata[i:batch_end]
-            )
+    def embed_admin_documents(self, kb_path: str):
+        """
+        Embed admin knowledge base documents
+        The KB is stream-parsed one document at a time and chunks are embedded
+        and stored every CHROMA_WRITE_BATCH_SIZE, so memory stays O(batch)
+        rather than O(corpus)
+        """
+        logger.info(f"Streaming admin knowledge base from {kb_path}...")
+
+        # Clear existing; new chunks are added as they are embedded
+        remove_admin_sidecar()
+        Path(ADMIN_CHUNK_COUNT).unlink(missing_ok=True)
+        self.collection.delete(where={"is_admin": True})
+
+        batch_chunks = []
+        batch_metadata = []
+        batch_ids = []
+        chunk_id = 0
+        num_docs = 0
+        failed = 0
+        # FP16 rows for the search sidecar, in chunk id order, streamed to disk
+        Path(ADMIN_SIDECAR_ROWS).parent.mkdir(parents=True, exist_ok=True)
+        sidecar_rows = open(ADMIN_SIDECAR_ROWS, 'wb')
+
+        def flush():
+            # Boilerplate repeated within the batch is encoded once, and copies
+            # in earlier batches come back from the content-keyed chunk embedding
+            # cache, so no corpus-wide digest -> embedding map is held here
+            embeddings = self.encode_chunks(batch_chunks)
+            failures = write_in_batches(self.collection.add, batch_ids, embeddings,
+                                        batch_chunks, batch_metadata)
+            embeddings.astype(np.float16).tofile(sidecar_rows)
+            logger.info(f"Indexed {chunk_id} admin chunks")
+            batch_chunks.clear()
+            batch_metadata.clear()
+            batch_ids.clear()
+            return failures
 
-        logger.info(f"✓ Successfully indexed {len(all_chunks)} admin chunks")
+        try:
+            with sidecar_rows, open(kb_path, 'rb') as f:
+                for doc_idx, doc in enumerate(ijson.items(f, 'item', use_float=True)):
+                    chunks = self.document_chunks(doc)
+                    num_docs += 1
+
+                    logger.info("Document %d: %s -> %d chunks", doc_idx + 1, doc['title'], len(chunks))
+
+                    for chunk_idx, chunk in enumerate(chunks):
+                        metadata = {
+                            "document_title": doc['title'],
+                            "url": doc['url'],
+                            "source_type": doc['source_type'],
+                            "chunk_index": chunk_idx,
+                            "total_chunks": len(chunks),
+                            "doc_summary": doc['summary'],
+                            "is_admin": True
+                        }
+
+                        batch_chunks.append(chunk)
+                        batch_metadata.append(metadata)
+                        batch_ids.append(f"admin_chunk_{chunk_id}")
+                        chunk_id += 1
+
+                        if len(batch_chunks) == CHROMA_WRITE_BATCH_SIZE:
+                            failed += flush()
+
+                if batch_chunks:
+                    failed += flush()
+
+            write_json_atomic(ADMIN_CHUNK_COUNT, chunk_id - failed)
+            if failed:
+                logger.warning("Some admin chunks failed to index; searching via Chroma only")
+            elif chunk_id:
+                # Sidecar rows are in chunk id order, one per admin chunk
+                write_admin_sidecar([f"admin_chunk_{i}" for i in range(chunk_id)], ADMIN_SIDECAR_ROWS,
+                                    self.embedding_model.get_sentence_embedding_dimension())
+        finally:
+            Path(ADMIN_SIDECAR_ROWS).unlink(missing_ok=True)
+
+        logger.info(f"✓ Successfully indexed {chunk_id - failed} admin chunks from {num_docs} documents")
 
     def embed_user_documents(self, user_kb_path: str):
         """Embed user-specific documents"""
-        if not self.user_collection:
+        if not self.username:
             raise ValueError("No user specified for user documents")
 
         logger.info(f"Loading user knowledge base from {user_kb_path}...")
 
-        with open(user_kb_path, 'r', encoding='utf-8') as f:
-            documents = json.load(f)
+        documents = load_kb_documents(user_kb_path)
 
         if not documents:
             logger.info("No user documents to embed")
@@ -196,108 +751,233 @@ class MultiUserVectorStore:
 
         logger.info(f"Processing {len(documents)} user documents...")
 
-        all_chunks = []
-        all_metadata = []
-        all_ids = []
-        chunk_id = 0
-
-        for doc_idx, doc in enumerate(documents):
-            chunks = self.chunk_text(doc['content'])
-
-            logger.info(f"User Document {doc_idx + 1}/{len(documents)}: "
-                       f"{doc['title']} -> {len(chunks)} chunks")
-
-            for chunk_idx, chunk in enumerate(chunks):
-                metadata = {
-                    "document_title": doc['title'],
-                    "url": doc['url'],
-                    "source_type": doc['source_type'],
-                    "chunk_index": chunk_idx,
-                    "total_chunks": len(chunks),
-                    "doc_summary": doc['summary'],
-                    "is_admin": False,
-                    "username": self.username
-                }
-
-                all_chunks.append(chunk)
-                all_metadata.append(metadata)
-                all_ids.append(f"user_{self.username}_chunk_{chunk_id}")
-                chunk_id += 1
+        all_ids, all_chunks, all_metadata = self.prepare_user_chunks(self.username, documents)
 
         if not all_chunks:
             return
 
         logger.info(f"Generating embeddings for {len(all_chunks)} user chunks...")
 
-        embeddings = self.embedding_model.encode(
-            all_chunks,
-            show_progress_bar=True,
-            batch_size=32
-        )
+        embeddings = self.encode_chunks(all_chunks, show_progress_bar=True)
+
+        self.store_user_chunks(all_ids, embeddings, all_chunks, all_metadata)
+
+    def store_user_chunks(self, ids: List[str], embeddings: np.ndarray,
+                          chunks: List[str], metadatas: List[Dict]) -> int:
+        """
+        Replace this user's chunks with pre-embedded ones
+        Returns the number of chunks that could not be written
+        """
+        if not self.username:
+            raise ValueError("No user specified for user documents")
 
         logger.info("Storing in user vector database...")
 
         # Clear existing and add new
-        self.user_collection.delete(where={"username": self.username})
+        self.collection.delete(where=self._user_filter())
 
-        batch_size = 100
-        for i in range(0, len(all_chunks), batch_size):
-            batch_end = min(i + batch_size, len(all_chunks))
+        failed = write_in_batches(self.collection.add, ids, embeddings, chunks, metadatas)
 
-            self.user_collection.add(
-                ids=all_ids[i:batch_end],
-                embeddings=embeddings[i:batch_end].tolist(),
-                documents=all_chunks[i:batch_end],
-                metadatas=all_metadata[i:batch_end]
-            )
+        logger.info(f"✓ Successfully indexed {len(chunks) - failed} user chunks")
+        return failed
+
+    def upsert_document(self, doc: Dict):
+        """Embed a single user document, replacing any chunks it had before"""
+        if not self.username:
+            raise ValueError("No user specified for user documents")
+
+        chunks = self.document_chunks(doc)
+        logger.info(f"Upserting user document {doc['title']} -> {len(chunks)} chunks")
+
+        # Drop the previous version's chunks first - it may have had more of them
+        self.delete_document(doc['title'])
+
+        if not chunks:
+            return
+
+        prefix = user_chunk_prefix(self.username, doc['title'])
+        ids = []
+        metadatas = []
+        for chunk_idx in range(len(chunks)):
+            metadatas.append({
+                "document_title": doc['title'],
+                "url": doc['url'],
+                "source_type": doc['source_type'],
+                "chunk_index": chunk_idx,
+                "total_chunks": len(chunks),
+                "doc_summary": doc['summary'],
+                "is_admin": False,
+                "username": self.username
+            })
+            ids.append(f"{prefix}_chunk_{chunk_idx}")
+
+        embeddings = self.encode_chunks(chunks)
+
+        failed = write_in_batches(self.collection.upsert, ids, embeddings, chunks, metadatas)
 
-        logger.info(f"✓ Successfully indexed {len(all_chunks)} user chunks")
+        logger.info(f"✓ Upserted {len(chunks) - failed} chunks for {doc['title']}")
+
+    def delete_document(self, title: str):
+        """Remove all chunks of a single user document"""
+        if not self.username:
+            raise ValueError("No user specified for user documents")
+
+        self.collection.delete(where={"$and": [self._user_filter(), {"document_title": title}]})
+
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed query texts in one forward pass, skipping any already in the
+        in-memory LRU or the on-disk cache
+        Returns one float32 embedding row per input text
+        """
+        keys = [normalize_query_text(text) for text in texts]
+
+        # The store is shared by every tab of a user (st.cache_resource), so
+        # the LRU is only touched under the lock; rows are collected locally
+        found = {}
+        with self._query_embeddings_lock:
+            for key in dict.fromkeys(keys):
+                if key in self._query_embeddings:
+                    self._query_embeddings.move_to_end(key)
+                    found[key] = self._query_embeddings[key]
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+
+        if missing:
+            disk_cache = get_query_embedding_disk_cache()
+            to_encode = []
+            for key in missing:
+                embedding = disk_cache.get((config.EMBEDDING_MODEL, self.embedding_backend, key))
+                if embedding is None:
+                    to_encode.append(key)
+                else:
+                    found[key] = embedding
+
+            if to_encode:
+                embeddings = self.encode(to_encode, batch_size=32)
+                for key, embedding in zip(to_encode, embeddings):
+                    found[key] = embedding
+                    disk_cache.set((config.EMBEDDING_MODEL, self.embedding_backend, key), embedding)
+
+            with self._query_embeddings_lock:
+                for key in missing:
+                    self._query_embeddings[key] = found[key]
+                while len(self._query_embeddings) > QUERY_EMBEDDING_CACHE_SIZE:
+                    self._query_embeddings.popitem(last=False)
+
+        return np.stack([found[key] for key in keys])
 
     def search(self, query: str, top_k: int = config.TOP_K_RESULTS) -> List[Dict]:
         """Search both admin and user knowledge bases"""
-        query_embedding = self.embedding_model.encode([query])[0]
-
-        # Search admin collection
-        admin_results = self.admin_collection.query(
-            query_embeddings=[query_embedding.tolist()],
+        return self.search_batch([query], top_k)[0]
+
+    def search_batch(self, queries: List[str], top_k: int = config.TOP_K_RESULTS) -> List[List[Dict]]:
+        """
+        Search both knowledge bases for several queries at once: one encode
+        pass and (without the admin sidecar) one Chroma query
+        Returns one result list per query, in input order
+        """
+        if not queries:
+            return []
+
+        # (n, dim) float32 rows, passed to Chroma as-is
+        query_embeddings = self.embed_batch(queries).astype(np.float32, copy=False)
+
+        sidecar = load_admin_sidecar()
+        if sidecar is not None:
+            return [self._search_with_sidecar(query_embeddings[q:q + 1], top_k, *sidecar)
+                    for q in range(len(queries))]
+
+        # One ANN search; Chroma applies the admin/user filter and the top_k merge
+        results = self.collection.query(
+            query_embeddings=query_embeddings,
             n_results=top_k,
+            where=self._search_filter(),
             include=["documents", "metadatas", "distances"]
         )
 
-        formatted_results = []
-
-        # Add admin results
-        for i in range(len(admin_results['ids'][0])):
-            formatted_results.append({
-                "content": admin_results['documents'][0][i],
-                "metadata": admin_results['metadatas'][0][i],
-                "distance": admin_results['distances'][0][i]
-            })
-
-        # Search user collection if available
-        if self.user_collection:
-            user_results = self.user_collection.query(
-                query_embeddings=[query_embedding.tolist()],
+        return [
+            [
+                {
+                    "content": results['documents'][q][i],
+                    "metadata": results['metadatas'][q][i],
+                    "distance": results['distances'][q][i]
+                }
+                for i in range(len(results['ids'][q]))
+            ]
+            for q in range(len(queries))
+        ]
+
+    def _search_with_sidecar(self, query_embedding: np.ndarray, top_k: int,
+                             admin_embeddings: np.ndarray, admin_ids: List[str]) -> List[Dict]:
+        """
+        Admin chunks ranked exactly by a dot product over the FP16 sidecar;
+        user chunks still come from Chroma. Admin text and metadata are
+        fetched only for hits that make the final top_k
+        """
+        # ip distance, as Chroma reports it: 1 - cosine similarity
+        distances = 1 - sidecar_scores(admin_embeddings, query_embedding[0])
+        if len(distances) > top_k:
+            top_idx = np.argpartition(distances, top_k - 1)[:top_k]
+        else:
+            top_idx = np.arange(len(distances))
+        hits = [(float(distances[i]), admin_ids[i], None) for i in top_idx.tolist()]
+
+        if self.username:
+            user_results = self.collection.query(
+                query_embeddings=query_embedding,
                 n_results=top_k,
+                where=self._user_filter(),
                 include=["documents", "metadatas", "distances"]
             )
-
-            # Add user results
-            for i in range(len(user_results['ids'][0])):
-                formatted_results.append({
+            hits.extend(
+                (user_results['distances'][0][i], user_results['ids'][0][i], {
                     "content": user_results['documents'][0][i],
-                    "metadata": user_results['metadatas'][0][i],
-                    "distance": user_results['distances'][0][i]
+                    "metadata": user_results['metadatas'][0][i]
                 })
+                for i in range(len(user_results['ids'][0]))
+            )
+
+        hits.sort(key=lambda hit: hit[0])
+        hits = hits[:top_k]
+
+        admin_hit_ids = [chunk_id for _, chunk_id, payload in hits if payload is None]
+        admin_chunks = {}
+        if admin_hit_ids:
+            fetched = self.collection.get(ids=admin_hit_ids, include=["documents", "metadatas"])
+            admin_chunks = {
+                chunk_id: {"content": document, "metadata": metadata}
+                for chunk_id, document, metadata in zip(fetched['ids'], fetched['documents'], fetched['metadatas'])
+            }
+
+        results = []
+        for distance, chunk_id, payload in hits:
+            payload = payload or admin_chunks.get(chunk_id)
+            if payload is not None:
+                results.append({**payload, "distance": distance})
+        return results
+
+    def count_chunks(self, where: Dict) -> int:
+        """Chunks matching a metadata filter (collection.count() takes no filter, so fetch ids only)"""
+        return len(self.collection.get(where=where, include=[])["ids"])
+
+    def admin_chunk_count(self) -> int:
+        """Admin chunks, as recorded at embed time (counted once if no record exists)"""
+        try:
+            return read_json(ADMIN_CHUNK_COUNT)
+        except (OSError, ValueError):
+            count = self.count_chunks({"is_admin": True})
+            write_json_atomic(ADMIN_CHUNK_COUNT, count)
+            return count
 
-        # Sort by distance and return top_k
-        formatted_results.sort(key=lambda x: x['distance'])
-        return formatted_results[:top_k]
+    def has_user_chunks(self) -> bool:
+        """Whether anything is indexed for this user (fetches at most one id)"""
+        return bool(self.username) and bool(
+            self.collection.get(where=self._user_filter(), limit=1, include=[])["ids"])
 
     def get_stats(self) -> Dict:
-        """Get statistics for both collections"""
-        admin_count = self.admin_collection.count()
-        user_count = self.user_collection.count() if self.user_collection else 0
+        """Get admin and user chunk counts"""
+        admin_count = self.admin_chunk_count()
+        user_count = self.count_chunks(self._user_filter()) if self.username else 0
 
         return {
             "admin_chunks": admin_count,
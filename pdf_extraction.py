@@ -0,0 +1,111 @@
+"""
+PDF Text Extraction
+Extracts page text in parallel across processes, with a content-addressed disk cache
+"""
+import io
+import os
+import functools
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Tuple
+from json_store import read_json, write_json_atomic
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Pages per worker task - bounds the work (and result payload) of each task
+PAGES_PER_TASK = 64
+# Below this many pages the process pool costs more than it saves
+MIN_PAGES_FOR_POOL = 8
+
+# Extracted text keyed by BLAKE2b hash of the PDF bytes
+PDF_TEXT_CACHE_DIR = Path("./cache/pdf_text")
+# Least-recently-accessed entries are evicted above this total size
+PDF_TEXT_CACHE_MAX_BYTES = 1024 ** 3
+
+
+@functools.cache
+def _pypdf2():
+    """Import PyPDF2 on first use, keeping it off the app's startup path"""
+    import PyPDF2
+    return PyPDF2
+
+
+def _extract_page_range(pdf_bytes: bytes, start: int, end: int) -> List[Tuple[int, str]]:
+    """Worker: extract text for pages [start, end) of a PDF"""
+    pdf_reader = _pypdf2().PdfReader(io.BytesIO(pdf_bytes))
+    return [(page_num, pdf_reader.pages[page_num].extract_text() or "")
+            for page_num in range(start, end)]
+
+
+def extract_pdf_text(pdf_bytes: bytes, max_workers: int = None) -> Tuple[str, int]:
+    """
+    Extract text from PDF bytes, fanning page ranges out to a process pool
+    Returns (full_content, num_pages); empty pages are skipped
+    """
+    num_pages = len(_pypdf2().PdfReader(io.BytesIO(pdf_bytes)).pages)
+
+    if num_pages < MIN_PAGES_FOR_POOL:
+        pages = _extract_page_range(pdf_bytes, 0, num_pages)
+    else:
+        max_workers = max_workers or min(os.cpu_count() or 1, 8)
+        # Split into at least one range per worker, capped at PAGES_PER_TASK pages each
+        step = max(1, min(PAGES_PER_TASK, -(-num_pages // max_workers)))
+        ranges = [(start, min(start + step, num_pages)) for start in range(0, num_pages, step)]
+        logger.info(f"Extracting {num_pages} pages in {len(ranges)} tasks across {max_workers} processes")
+
+        pages = []
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_extract_page_range, pdf_bytes, start, end)
+                       for start, end in ranges]
+            for future in futures:
+                pages.extend(future.result())
+
+    pages.sort(key=lambda page: page[0])
+    content = [text for _, text in pages if text.strip()]
+    return "\n\n".join(content), num_pages
+
+
+def _evict_pdf_text_cache():
+    """Drop least-recently-accessed entries until the cache fits its size budget"""
+    entries = [(path, path.stat()) for path in PDF_TEXT_CACHE_DIR.glob("*.json")]
+    total = sum(stat.st_size for _, stat in entries)
+    if total <= PDF_TEXT_CACHE_MAX_BYTES:
+        return
+
+    entries.sort(key=lambda entry: entry[1].st_atime)
+    for path, stat in entries:
+        if total <= PDF_TEXT_CACHE_MAX_BYTES:
+            break
+        path.unlink(missing_ok=True)
+        total -= stat.st_size
+    logger.info(f"Evicted PDF text cache down to {total} bytes")
+
+
+def extract_pdf_text_cached(pdf_bytes: bytes) -> Tuple[str, int]:
+    """
+    extract_pdf_text() memoized on disk by content hash, so re-uploading the
+    same file skips PyPDF2 entirely
+    """
+    digest = hashlib.blake2b(pdf_bytes, digest_size=16).hexdigest()
+    cache_path = PDF_TEXT_CACHE_DIR / f"{digest}.json"
+
+    if cache_path.exists():
+        try:
+            cached = read_json(cache_path)
+            logger.info(f"PDF text cache hit: {digest}")
+            return cached["content"], cached["num_pages"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable PDF text cache entry {cache_path}: {e}")
+
+    content, num_pages = extract_pdf_text(pdf_bytes)
+
+    try:
+        write_json_atomic(cache_path, {"content": content, "num_pages": num_pages})
+        _evict_pdf_text_cache()
+    except OSError as e:
+        logger.warning(f"Could not write PDF text cache entry {cache_path}: {e}")
+
+    return content, num_pages
@@ -4,7 +4,11 @@ Coordinates Agent 1 (Knowledge Harvester) and Agent 2 (RAG Expert)
 """
 import logging
 import os
-from typing import Optional
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from typing import Dict, Iterator, List, Optional
 from agent1_knowledge_harvester import KnowledgeHarvester
 from vector_store import VectorStore
 from agent2_rag_expert import OneStreamExpert
@@ -13,6 +17,9 @@ import config
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Harvested documents buffered between the crawler and the indexer
+HARVEST_QUEUE_SIZE = 32
+
 
 class OneStreamPipeline:
     """
@@ -20,9 +27,9 @@ class OneStreamPipeline:
     Manages the two-agent system workflow
     """
 
-    def __init__(self):
+    def __init__(self, vector_store: Optional[VectorStore] = None):
         self.harvester = KnowledgeHarvester()
-        self.vector_store = VectorStore()
+        self.vector_store = vector_store or VectorStore()
         self.expert = OneStreamExpert(vector_store=self.vector_store)
 
     def run_harvester(self, force_refresh: bool = False):
@@ -78,6 +85,61 @@ class OneStreamPipeline:
         stats = self.vector_store.get_stats()
         logger.info(f"\n✓ Phase 2 complete: {stats['total_chunks']} chunks indexed")
 
+    def harvest_and_build(self):
+        """
+        Phases 1 and 2 overlapped: a crawler thread (network-bound) feeds
+        each harvested document through a bounded queue to an indexer
+        thread (CPU/GPU-bound), instead of harvesting everything first
+        """
+        logger.info("\n" + "="*70)
+        logger.info("PHASES 1+2: Knowledge Harvesting + Vector Database Construction")
+        logger.info("="*70 + "\n")
+
+        if os.path.exists(config.VECTOR_DB_PATH):
+            self.vector_store.clear()
+
+        documents = queue.Queue(maxsize=HARVEST_QUEUE_SIZE)
+        done = object()
+        # Set if indexing fails, so the crawler stops instead of blocking on a full queue
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    documents.put(item, timeout=1)
+                    return
+                except queue.Full:
+                    pass
+
+        def produce():
+            try:
+                for doc in self.harvester.iter_harvest(config.ONESTREAM_URLS):
+                    if stop.is_set():
+                        return
+                    put(asdict(doc))
+            finally:
+                put(done)
+
+        def consume() -> Iterator[Dict]:
+            while (doc := documents.get()) is not done:
+                yield doc
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            harvested = executor.submit(produce)
+            indexed = executor.submit(self.vector_store.index_documents, consume())
+            try:
+                num_chunks = indexed.result()
+            except Exception:
+                stop.set()
+                raise
+            harvested.result()
+
+        # Save knowledge base
+        self.harvester.save_knowledge_base(config.KB_OUTPUT_PATH)
+
+        logger.info(f"\n✓ Phases 1+2 complete: {len(self.harvester.documents)} documents harvested, "
+                    f"{num_chunks} chunks indexed")
+
     def query(self, question: str) -> dict:
         """
         Execute Agent 2: RAG Expert
@@ -97,6 +159,23 @@ class OneStreamPipeline:
         result = self.expert.answer_question(question)
         return result
 
+    def query_batch(self, questions: List[str]) -> List[dict]:
+        """
+        Answer several questions with batched retrieval and concurrent LLM calls
+        Returns one result per question, in input order
+        """
+        logger.info("\n" + "="*70)
+        logger.info(f"PHASE 3: Question Answering ({len(questions)} questions)")
+        logger.info("="*70 + "\n")
+
+        # Verify vector DB exists
+        if not os.path.exists(config.VECTOR_DB_PATH):
+            raise FileNotFoundError(
+                f"Vector database not found. Run build_vector_db() first."
+            )
+
+        return self.expert.answer_questions(questions)
+
     def run_interactive(self):
         """Run interactive Q&A mode"""
         self.expert.interactive_mode()
@@ -110,11 +189,18 @@ class OneStreamPipeline:
         logger.info("OneStream Knowledge Agent System - Full Setup")
         logger.info("="*70 + "\n")
 
-        # Phase 1: Harvest knowledge
-        self.run_harvester(force_refresh=force_refresh)
+        needs_harvest = force_refresh or not os.path.exists(config.KB_OUTPUT_PATH)
+        needs_build = force_refresh or not os.path.exists(config.VECTOR_DB_PATH)
+
+        if needs_harvest and needs_build:
+            # Both phases run: overlap crawling with embedding
+            self.harvest_and_build()
+        else:
+            # Phase 1: Harvest knowledge
+            self.run_harvester(force_refresh=force_refresh)
 
-        # Phase 2: Build vector database
-        self.build_vector_db(force_rebuild=force_refresh)
+            # Phase 2: Build vector database
+            self.build_vector_db(force_rebuild=force_refresh)
 
         logger.info("\n" + "="*70)
         logger.info("✓ Setup Complete - System Ready")
@@ -3,19 +3,37 @@ Re-embed All Documents Script
 Applies the improved chunking strategy to all existing documents
 """
 import os
-import json
+import argparse
+import functools
 import logging
+import multiprocessing
 from pathlib import Path
-from multi_user_vector_store import MultiUserVectorStore
+from typing import Dict, List, Optional, Tuple
+from multi_user_vector_store import DocumentChunker, MultiUserVectorStore, UserChunks
+from kb_fingerprint import (ADMIN_FINGERPRINT, embedded_kb_hash, kb_file_hash, kb_files_hash,
+                            record_embedded_kb_hash, user_fingerprint)
 from user_manager import get_user_manager
+from user_kb_store import UserKBStore, iter_kb_documents
 import config
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Processes loading and chunking user KBs in parallel
+REEMBED_WORKERS = int(os.getenv("REEMBED_WORKERS", max(1, (os.cpu_count() or 1) - 1)))
 
-def reembed_admin_kb():
-    """Re-embed the admin knowledge base"""
+
+def user_kb_hash(kb_store: UserKBStore) -> str:
+    """Hash of the user's JSONL data file and index (removals only touch the index)"""
+    paths = [kb_store.kb_path] + ([kb_store.index_path] if kb_store.index_path.exists() else [])
+    return kb_files_hash(paths)
+
+
+def reembed_admin_kb(only_changed: bool = False) -> Optional[bool]:
+    """
+    Re-embed the admin knowledge base
+    Returns None when only_changed is set and the KB is unchanged since it was last embedded
+    """
     logger.info("=" * 70)
     logger.info("RE-EMBEDDING ADMIN KNOWLEDGE BASE")
     logger.info("=" * 70)
@@ -23,70 +41,153 @@ def reembed_admin_kb():
     kb_path = config.KB_OUTPUT_PATH
 
     if not Path(kb_path).exists():
-        logger.warning(f"Admin KB not found at {kb_path}. Skipping admin KB.")
+        logger.warning("Admin KB not found at %s. Skipping admin KB.", kb_path)
         return False
 
+    kb_hash = kb_file_hash(kb_path)
+    if only_changed and embedded_kb_hash(config.VECTOR_DB_PATH, ADMIN_FINGERPRINT) == kb_hash:
+        logger.info("Admin KB unchanged since it was last embedded. Skipping.")
+        return None
+
     try:
         # Create vector store with no username for admin
         vector_store = MultiUserVectorStore(username=None)
 
         # Re-embed with new chunking strategy
         vector_store.embed_admin_documents(kb_path)
+        record_embedded_kb_hash(config.VECTOR_DB_PATH, ADMIN_FINGERPRINT, kb_hash)
 
         # Get stats
         stats = vector_store.get_stats()
-        logger.info(f"✓ Admin KB re-embedded successfully!")
-        logger.info(f"  Total admin chunks: {stats['admin_chunks']}")
+        logger.info("✓ Admin KB re-embedded successfully!")
+        logger.info("  Total admin chunks: %s", stats['admin_chunks'])
         return True
 
     except Exception as e:
-        logger.error(f"✗ Failed to re-embed admin KB: {e}")
+        logger.error("✗ Failed to re-embed admin KB: %s", e)
         return False
 
 
-def reembed_user_kb(username: str):
-    """Re-embed a specific user's knowledge base"""
-    logger.info(f"\n{'=' * 70}")
-    logger.info(f"RE-EMBEDDING USER KB: {username}")
-    logger.info("=" * 70)
-
-    user_manager = get_user_manager()
-    user_kb_path = user_manager.get_user_kb_path(username)
+def chunk_user_kb(username: str, only_changed: bool = False) -> Tuple[str, str, Optional[tuple]]:
+    """
+    Worker: load and chunk one user's KB (no model, no vector DB)
+    Returns (username, status, payload) where status is "chunked", "skipped",
+    "unchanged" (only_changed and the KB hash matches its fingerprint) or
+    "failed", and payload is (UserChunks, kb_hash)
+    """
+    user_kb_path = get_user_manager().get_user_kb_path(username)
+    kb_store = UserKBStore(user_kb_path)
 
-    if not Path(user_kb_path).exists():
-        logger.info(f"  No KB found for user {username}. Skipping.")
-        return False
+    if not kb_store.kb_path.exists():
+        logger.info("  No KB found for user %s. Skipping.", username)
+        return username, "skipped", None
 
     # Check if user has any documents
-    with open(user_kb_path, 'r', encoding='utf-8') as f:
-        documents = json.load(f)
+    document_count = kb_store.count()
 
-    if not documents:
-        logger.info(f"  User {username} has no documents. Skipping.")
-        return False
+    if not document_count:
+        logger.info("  User %s has no documents. Skipping.", username)
+        return username, "skipped", None
+
+    kb_hash = user_kb_hash(kb_store)
+    if only_changed and embedded_kb_hash(config.VECTOR_DB_PATH, user_fingerprint(username)) == kb_hash:
+        logger.info("  KB for user %s unchanged since it was last embedded. Skipping.", username)
+        return username, "unchanged", None
 
-    logger.info(f"  Found {len(documents)} documents for {username}")
+    logger.info("  Found %s documents for %s", document_count, username)
 
     try:
-        # Create user-specific vector store
-        vector_store = MultiUserVectorStore(username=username)
+        # Column-wise metadata keeps the result pickled back to the parent small
+        user_chunks = DocumentChunker().chunk_user_documents(username, iter_kb_documents(user_kb_path))
+        return username, "chunked", (user_chunks, kb_hash)
 
-        # Re-embed with new chunking strategy
-        vector_store.embed_user_documents(user_kb_path)
+    except Exception as e:
+        logger.error("✗ Failed to chunk KB for user %s: %s", username, e)
+        return username, "failed", None
+
+
+def collect_all_chunks(usernames: List[str], only_changed: bool = False
+                       ) -> Tuple[List[str], Dict[str, Tuple[int, UserChunks]],
+                                  Dict[str, str], Dict[str, str]]:
+    """
+    Chunk every user's KB across a process pool and concatenate the chunk texts
+    Returns (chunks, user_chunks, statuses, kb_hashes): user_chunks maps each
+    chunked user to (offset of their first chunk, their UserChunks), statuses
+    holds each user's chunk_user_kb status and kb_hashes the KB hash of each
+    chunked user
+    """
+    all_chunks = []
+    user_chunks = {}
+    statuses = {}
+    kb_hashes = {}
+
+    workers = max(1, min(REEMBED_WORKERS, len(usernames)))
+    logger.info("Chunking %s user KBs across %s processes", len(usernames), workers)
+
+    # spawn: the parent may already hold CUDA/thread-pool state that fork would copy
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers) as pool:
+        worker = functools.partial(chunk_user_kb, only_changed=only_changed)
+        for username, status, payload in pool.imap_unordered(worker, usernames):
+            statuses[username] = status
+            if status != "chunked":
+                continue
+
+            chunked, kb_hashes[username] = payload
+            user_chunks[username] = (len(all_chunks), chunked)
+            all_chunks.extend(chunked.chunks)
+
+    return all_chunks, user_chunks, statuses, kb_hashes
+
+
+def store_user_kb(vector_store: MultiUserVectorStore, user_chunks: UserChunks,
+                  embeddings, kb_hash: str) -> bool:
+    """
+    Write one user's slice of the embeddings into the vector DB, recording
+    kb_hash as the user's fingerprint if every chunk was written
+    Ids and metadata dicts are only built here, one user at a time
+    """
+    username = user_chunks.username
+    try:
+        vector_store.username = username
+        failed = vector_store.store_user_chunks(user_chunks.ids(), embeddings, user_chunks.chunks,
+                                                user_chunks.metadatas())
+        if not failed:
+            record_embedded_kb_hash(config.VECTOR_DB_PATH, user_fingerprint(username), kb_hash)
 
-        # Get stats
-        stats = vector_store.get_stats()
-        logger.info(f"✓ User {username} KB re-embedded successfully!")
-        logger.info(f"  Total user chunks: {stats['user_chunks']}")
-        return True
+        logger.info("✓ User %s KB re-embedded successfully!", username)
+        logger.info("  Total user chunks: %s", len(user_chunks.chunks) - failed)
+        return not failed
 
     except Exception as e:
-        logger.error(f"✗ Failed to re-embed KB for user {username}: {e}")
+        logger.error("✗ Failed to store KB for user %s: %s", username, e)
         return False
 
 
-def reembed_all_users():
-    """Re-embed all user knowledge bases"""
+def reembed_user_kb(username: str, only_changed: bool = False) -> bool:
+    """Re-embed a specific user's knowledge base"""
+    logger.info("\n" + "=" * 70)
+    logger.info("RE-EMBEDDING USER KB: %s", username)
+    logger.info("=" * 70)
+
+    username, status, payload = chunk_user_kb(username, only_changed)
+    if status != "chunked":
+        return status == "unchanged"
+
+    user_chunks, kb_hash = payload
+    vector_store = MultiUserVectorStore(username=username)
+    embeddings = vector_store.encode_chunks(user_chunks.chunks)
+    return store_user_kb(vector_store, user_chunks, embeddings, kb_hash)
+
+
+def reembed_all_users(only_changed: bool = False):
+    """
+    Re-embed all user knowledge bases
+    KBs are chunked in parallel worker processes, then every user's chunks
+    are embedded in a single smart-batched pass and scattered back per user
+    (the vector DB is one Chroma store, written only from this process)
+    only_changed skips users whose KB files match their recorded fingerprint
+    """
     logger.info("\n" + "=" * 70)
     logger.info("RE-EMBEDDING ALL USER KNOWLEDGE BASES")
     logger.info("=" * 70)
@@ -94,42 +195,54 @@ def reembed_all_users():
     user_manager = get_user_manager()
     users = user_manager.list_users()
 
-    logger.info(f"Found {len(users)} total users")
+    logger.info("Found %s total users", len(users))
 
+    # Skip admin user for user KB (admin uses admin KB)
+    usernames = [user['username'] for user in users if user['username'] != 'admin']
+    skip_count = len(users) - len(usernames)
     success_count = 0
-    skip_count = 0
     fail_count = 0
 
-    for user in users:
-        username = user['username']
-
-        # Skip admin user for user KB (admin uses admin KB)
-        if username == 'admin':
-            logger.info(f"\n  Skipping user KB for admin (uses admin KB)")
-            skip_count += 1
-            continue
-
-        result = reembed_user_kb(username)
-
-        if result:
-            success_count += 1
-        elif result is False and Path(user_manager.get_user_kb_path(username)).exists():
-            fail_count += 1
-        else:
-            skip_count += 1
+    if usernames:
+        chunks, user_chunks, statuses, kb_hashes = collect_all_chunks(usernames, only_changed)
+
+        vector_store = MultiUserVectorStore()
+        logger.info("Embedding %s chunks from %s users in one pass", len(chunks), len(usernames))
+        embeddings = vector_store.encode_chunks(chunks, show_progress_bar=True)
+
+        for username, status in statuses.items():
+            if status in ("skipped", "unchanged"):
+                skip_count += 1
+                continue
+            if status == "failed":
+                fail_count += 1
+                continue
+
+            # Users whose documents yield no chunks still get their old chunks cleared
+            offset, chunked = user_chunks[username]
+            if store_user_kb(vector_store, chunked, embeddings[offset:offset + len(chunked.chunks)],
+                             kb_hashes[username]):
+                success_count += 1
+            else:
+                fail_count += 1
 
     logger.info("\n" + "=" * 70)
     logger.info("USER KB RE-EMBEDDING SUMMARY")
     logger.info("=" * 70)
-    logger.info(f"  ✓ Successfully re-embedded: {success_count} users")
-    logger.info(f"  - Skipped (no documents): {skip_count} users")
-    logger.info(f"  ✗ Failed: {fail_count} users")
+    logger.info("  ✓ Successfully re-embedded: %s users", success_count)
+    logger.info("  - Skipped (no documents or unchanged): %s users", skip_count)
+    logger.info("  ✗ Failed: %s users", fail_count)
 
     return success_count, skip_count, fail_count
 
 
 def main():
     """Main execution function"""
+    parser = argparse.ArgumentParser(description="Re-embed the admin and user knowledge bases")
+    parser.add_argument("--only-changed", action="store_true",
+                        help="skip knowledge bases unchanged since they were last embedded")
+    args = parser.parse_args()
+
     print("\n" + "=" * 70)
     print("DOCUMENT RE-EMBEDDING TOOL")
     print("Applying improved chunking strategy to all documents")
@@ -138,6 +251,8 @@ def main():
     print("\nThis script will:")
     print("1. Re-embed the admin knowledge base with improved chunking")
     print("2. Re-embed all user knowledge bases with improved chunking")
+    if args.only_changed:
+        print("   (only knowledge bases changed since they were last embedded)")
     print("\nThis may take several minutes depending on document count.")
 
     response = input("\nProceed? (yes/no): ").strip().lower()
@@ -152,15 +267,15 @@ def main():
 
     # Step 1: Re-embed admin KB
     try:
-        admin_success = reembed_admin_kb()
+        admin_success = reembed_admin_kb(args.only_changed)
     except Exception as e:
-        logger.error(f"Unexpected error during admin KB re-embedding: {e}")
+        logger.error("Unexpected error during admin KB re-embedding: %s", e)
 
     # Step 2: Re-embed all user KBs
     try:
-        user_success_count, user_skip_count, user_fail_count = reembed_all_users()
+        user_success_count, user_skip_count, user_fail_count = reembed_all_users(args.only_changed)
     except Exception as e:
-        logger.error(f"Unexpected error during user KB re-embedding: {e}")
+        logger.error("Unexpected error during user KB re-embedding: %s", e)
         user_success_count = 0
         user_skip_count = 0
         user_fail_count = 0
@@ -172,13 +287,15 @@ def main():
 
     if admin_success:
         print("✓ Admin KB: Re-embedded successfully")
+    elif admin_success is None:
+        print("- Admin KB: Unchanged, skipped")
     else:
         print("✗ Admin KB: Not found or failed")
 
     print(f"✓ User KBs: {user_success_count} re-embedded successfully")
 
     if user_skip_count > 0:
-        print(f"- User KBs: {user_skip_count} skipped (no documents)")
+        print(f"- User KBs: {user_skip_count} skipped (no documents or unchanged)")
 
     if user_fail_count > 0:
         print(f"✗ User KBs: {user_fail_count} failed")
@@ -0,0 +1,246 @@
+"""
+User Knowledge Base Store
+Append-only JSONL storage for user documents with a filename index
+"""
+import logging
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+import ijson
+from json_store import dumps_line, loads, read_json, write_json_atomic
+from kb_fingerprint import kb_file_hash
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Compact the data file once more than half of its records are dead
+COMPACTION_RATIO = 0.5
+
+
+def kb_index_path(kb_path) -> Path:
+    """Path of the filename index stored next to a user's JSONL data file"""
+    kb_path = Path(kb_path)
+    return kb_path.with_name(kb_path.stem + ".index.json")
+
+
+class UserKBStore:
+    """
+    Documents are appended to `user_kb.jsonl` as compact JSON lines. A sidecar
+    `user_kb.index.json` maps filename -> {offset, length, title, tombstoned},
+    so lookups, replacements and removals never rewrite the whole knowledge base.
+    """
+
+    def __init__(self, kb_path: str):
+        self.kb_path = Path(kb_path)
+        self.index_path = kb_index_path(self.kb_path)
+        # New index written before compaction swaps the data file in
+        self.pending_index_path = self.index_path.with_suffix(".pending.json")
+        self.legacy_path = self.kb_path.with_suffix(".json")
+        self._migrate_legacy()
+        self._load_index()
+
+    def _migrate_legacy(self):
+        """Convert a pre-JSONL `user_kb.json` list into the append-only layout"""
+        if self.kb_path.exists() or not self.legacy_path.exists():
+            return
+
+        documents = read_json(self.legacy_path)
+
+        logger.info(f"Migrating {self.legacy_path} to {self.kb_path} ({len(documents)} documents)")
+        self.kb_path.touch()
+        self.records = {}
+        self.dead_records = 0
+        self.titles = {}
+        for doc in documents:
+            self.put(doc)
+        self.legacy_path.unlink()
+
+    def _finish_compaction(self):
+        """
+        Recover from a compaction interrupted between its two file swaps: the
+        pending index names the hash of the compacted data file, so it is
+        installed only if that file made it into place
+        """
+        if not self.pending_index_path.exists():
+            return
+
+        pending = read_json(self.pending_index_path)
+        if self.kb_path.exists() and kb_file_hash(self.kb_path) == pending["data_hash"]:
+            logger.info(f"Completing interrupted compaction of {self.kb_path}")
+            self.pending_index_path.replace(self.index_path)
+        else:
+            self.pending_index_path.unlink()
+            self.kb_path.with_suffix(".jsonl.tmp").unlink(missing_ok=True)
+
+    def _load_index(self):
+        self._finish_compaction()
+        if self.index_path.exists():
+            index = read_json(self.index_path)
+            self.records = index["records"]
+            self.dead_records = index["dead_records"]
+        elif self.kb_path.exists():
+            self._rebuild_index()
+        else:
+            self.records = {}
+            self.dead_records = 0
+        self._index_titles()
+
+    def _index_titles(self):
+        """title -> filenames of live records, for O(1) removal by title"""
+        self.titles = {}
+        for filename, entry in self.records.items():
+            if not entry["tombstoned"]:
+                self.titles.setdefault(entry["title"], set()).add(filename)
+
+    def _rebuild_index(self):
+        """Recover the index by scanning the data file (later records win)"""
+        self.records = {}
+        self.dead_records = 0
+        offset = 0
+        with open(self.kb_path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    doc = loads(line)
+                    filename = self._filename(doc)
+                    if filename in self.records:
+                        self.dead_records += 1
+                    self.records[filename] = {
+                        "offset": offset,
+                        "length": len(line),
+                        "title": doc.get('title'),
+                        "tombstoned": False
+                    }
+                offset += len(line)
+        self._save_index()
+
+    def _save_index(self):
+        write_json_atomic(self.index_path, {"records": self.records, "dead_records": self.dead_records})
+
+    @staticmethod
+    def _filename(doc: Dict) -> str:
+        return doc.get('metadata', {}).get('filename') or doc.get('title')
+
+    def _read(self, f, entry: Dict) -> Dict:
+        f.seek(entry["offset"])
+        return loads(f.read(entry["length"]))
+
+    def put(self, doc: Dict) -> str:
+        """Append a document, superseding any record with the same filename"""
+        filename = self._filename(doc)
+        line = dumps_line(doc)
+
+        self.kb_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.kb_path, 'ab') as f:
+            offset = f.tell()
+            f.write(line)
+
+        existing = self.records.get(filename)
+        action = "updated" if existing and not existing["tombstoned"] else "added"
+        if existing:
+            self.dead_records += 1
+            self.titles.get(existing["title"], set()).discard(filename)
+
+        self.records[filename] = {
+            "offset": offset,
+            "length": len(line),
+            "title": doc.get('title'),
+            "tombstoned": False
+        }
+        self.titles.setdefault(doc.get('title'), set()).add(filename)
+        self._save_index()
+        self._maybe_compact()
+        return action
+
+    def remove_by_title(self, title: str) -> bool:
+        """Tombstone every live document with this title"""
+        filenames = self.titles.pop(title, None)
+        if not filenames:
+            return False
+
+        for filename in filenames:
+            self.records[filename]["tombstoned"] = True
+
+        self._save_index()
+        self._maybe_compact()
+        return True
+
+    def get(self, filename: str) -> Optional[Dict]:
+        entry = self.records.get(filename)
+        if entry is None or entry["tombstoned"]:
+            return None
+        with open(self.kb_path, 'rb') as f:
+            return self._read(f, entry)
+
+    def iter_documents(self) -> Iterator[Dict]:
+        """Yield live documents one at a time, seeking only to their offsets"""
+        live = [entry for entry in self.records.values() if not entry["tombstoned"]]
+        if not live:
+            return
+
+        live.sort(key=lambda entry: entry["offset"])
+        with open(self.kb_path, 'rb') as f:
+            for entry in live:
+                yield self._read(f, entry)
+
+    def documents(self) -> List[Dict]:
+        """Load all live documents"""
+        return list(self.iter_documents())
+
+    def count(self) -> int:
+        """Number of live documents (index only, no data file read)"""
+        return sum(1 for entry in self.records.values() if not entry["tombstoned"])
+
+    def _maybe_compact(self):
+        tombstoned = sum(1 for entry in self.records.values() if entry["tombstoned"])
+        total = len(self.records) + self.dead_records
+        if total and (tombstoned + self.dead_records) / total > COMPACTION_RATIO:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the data file with only live records"""
+        documents = self.documents()
+        tmp_path = self.kb_path.with_suffix(".jsonl.tmp")
+
+        records = {}
+        offset = 0
+        with open(tmp_path, 'wb') as f:
+            for doc in documents:
+                line = dumps_line(doc)
+                f.write(line)
+                records[self._filename(doc)] = {
+                    "offset": offset,
+                    "length": len(line),
+                    "title": doc.get('title'),
+                    "tombstoned": False
+                }
+                offset += len(line)
+
+        # Index first (as pending, stamped with the new data's hash), then the
+        # data file, then the index: _finish_compaction can tell which swaps ran
+        write_json_atomic(self.pending_index_path, {
+            "records": records, "dead_records": 0, "data_hash": kb_file_hash(tmp_path)
+        })
+        tmp_path.replace(self.kb_path)
+        self.pending_index_path.replace(self.index_path)
+
+        self.records = records
+        self.dead_records = 0
+        self._index_titles()
+        logger.info(f"Compacted {self.kb_path} to {len(records)} documents")
+
+
+def load_kb_documents(kb_path: str) -> List[Dict]:
+    """Load documents from a JSONL user KB or a plain JSON list"""
+    if Path(kb_path).suffix == ".jsonl":
+        return UserKBStore(kb_path).documents()
+
+    return read_json(kb_path)
+
+
+def iter_kb_documents(kb_path: str) -> Iterator[Dict]:
+    """Stream documents from a JSONL user KB or a plain JSON list, one at a time"""
+    if Path(kb_path).suffix == ".jsonl":
+        yield from UserKBStore(kb_path).iter_documents()
+        return
+
+    with open(kb_path, 'rb') as f:
+        yield from ijson.items(f, 'item', use_float=True)
@@ -4,124 +4,218 @@ Handles user authentication, sessions, and user-specific knowledge bases
 """
 import json
 import hashlib
+import hmac
 import os
+import sqlite3
+import logging
+import threading
+import functools
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, Optional, List
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from user_kb_store import UserKBStore
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+USERS_DB_PATH = "users.db"
+# Pre-SQLite user store, imported on first start and then removed
+LEGACY_USERS_FILE = "users.json"
+
+# Argon2id with OWASP's minimum recommended cost (19 MiB, 2 passes)
+PASSWORD_HASHER = PasswordHasher(time_cost=2, memory_cost=19 * 1024, parallelism=1)
+# Successful logins remembered so repeats (Streamlit reruns) skip the slow verify
+VERIFY_CACHE_SIZE = 1024
+
+
+@functools.cache
+def _dummy_password_hash() -> str:
+    """Verified against for unknown usernames, so they cost as much as real ones"""
+    return PASSWORD_HASHER.hash(os.urandom(16).hex())
 
 
 class UserManager:
     """Manages users, authentication, and user-specific data"""
 
-    def __init__(self, users_file: str = "users.json"):
-        self.users_file = users_file
+    def __init__(self, users_db: str = USERS_DB_PATH, legacy_users_file: str = LEGACY_USERS_FILE):
+        self.users_db = users_db
+        self.legacy_users_file = legacy_users_file
         self.users_dir = Path("user_data")
         self.users_dir.mkdir(exist_ok=True)
+        self._doc_counts = {}
+        self._users_snapshot = None
+        # (stored hash, HMAC of password) for recent successful verifies; keyed
+        # on the stored hash, so a password change invalidates it. The HMAC key
+        # lives only in this process, so the entries are not crackable offline
+        self._verified = OrderedDict()
+        self._verify_key = os.urandom(32)
+
+        # One autocommit connection shared by Streamlit's script threads
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(users_db, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "username TEXT PRIMARY KEY, password_hash TEXT NOT NULL, role TEXT NOT NULL, "
+            "created_at TEXT NOT NULL, full_name TEXT)"
+        )
         self._load_users()
 
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self.conn.execute(sql, params)
+
     def _load_users(self):
-        """Load users from file"""
-        if Path(self.users_file).exists():
-            with open(self.users_file, 'r', encoding='utf-8') as f:
-                self.users = json.load(f)
+        """Import the legacy users.json, or seed the default admin on first start"""
+        if self._execute("SELECT 1 FROM users LIMIT 1").fetchone():
+            return
+
+        if Path(self.legacy_users_file).exists():
+            with open(self.legacy_users_file, 'r', encoding='utf-8') as f:
+                users = json.load(f)
+
+            logger.info(f"Migrating {len(users)} users from {self.legacy_users_file} to {self.users_db}")
+            with self._lock:
+                with self.conn:
+                    self.conn.execute("BEGIN")
+                    self.conn.executemany(
+                        "INSERT OR IGNORE INTO users VALUES (?, ?, ?, ?, ?)",
+                        [(username, data["password_hash"], data.get("role", "user"),
+                          data.get("created_at", datetime.now().isoformat()), data.get("full_name"))
+                         for username, data in users.items()]
+                    )
+            Path(self.legacy_users_file).unlink()
         else:
             # Create default admin user
-            self.users = {
-                "admin": {
-                    "password_hash": self._hash_password("admin123"),
-                    "role": "admin",
-                    "created_at": datetime.now().isoformat(),
-                    "full_name": "Administrator"
-                }
-            }
-            self._save_users()
-
-    def _save_users(self):
-        """Save users to file"""
-        with open(self.users_file, 'w', encoding='utf-8') as f:
-            json.dump(self.users, f, indent=2)
+            self._insert_user("admin", "admin123", "Administrator", "admin")
+
+    def _insert_user(self, username: str, password: str, full_name: str, role: str) -> bool:
+        """Insert a user row; False if the username is taken"""
+        cursor = self._execute(
+            "INSERT OR IGNORE INTO users VALUES (?, ?, ?, ?, ?)",
+            (username, self._hash_password(password), role, datetime.now().isoformat(), full_name)
+        )
+        self._users_snapshot = None
+        return cursor.rowcount == 1
+
+    def _set_password_hash(self, username: str, password_hash: str) -> bool:
+        cursor = self._execute("UPDATE users SET password_hash = ? WHERE username = ?",
+                               (password_hash, username))
+        return cursor.rowcount == 1
 
     def _hash_password(self, password: str) -> str:
-        """Hash password using SHA-256"""
-        return hashlib.sha256(password.encode()).hexdigest()
+        """Hash password using Argon2id (salted, memory-hard)"""
+        return PASSWORD_HASHER.hash(password)
+
+    def _verify_password(self, password_hash: str, password: str) -> bool:
+        """Check a password against a stored Argon2 or legacy SHA-256 hash"""
+        if not password_hash.startswith("$argon2"):
+            # Pre-Argon2 accounts store an unsalted SHA-256 hex digest
+            legacy_hash = hashlib.sha256(password.encode('utf-8')).hexdigest()
+            return hmac.compare_digest(password_hash, legacy_hash)
+
+        try:
+            return PASSWORD_HASHER.verify(password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
 
     def authenticate(self, username: str, password: str) -> bool:
-        """Authenticate user"""
-        if username not in self.users:
+        """Authenticate user, upgrading legacy or outdated hashes on success"""
+        row = self._execute("SELECT password_hash FROM users WHERE username = ?", (username,)).fetchone()
+        if row is None:
+            self._verify_password(_dummy_password_hash(), password)
             return False
 
-        password_hash = self._hash_password(password)
-        return self.users[username]["password_hash"] == password_hash
+        password_hash = row["password_hash"]
+        password_mac = hmac.new(self._verify_key, password.encode('utf-8'), hashlib.sha256).digest()
+        key = (password_hash, password_mac)
+        with self._lock:
+            if key in self._verified:
+                self._verified.move_to_end(key)
+                return True
+
+        if not self._verify_password(password_hash, password):
+            return False
+
+        if not password_hash.startswith("$argon2") or PASSWORD_HASHER.check_needs_rehash(password_hash):
+            password_hash = self._hash_password(password)
+            self._set_password_hash(username, password_hash)
+            key = (password_hash, password_mac)
+
+        with self._lock:
+            self._verified[key] = True
+            while len(self._verified) > VERIFY_CACHE_SIZE:
+                self._verified.popitem(last=False)
+        return True
 
     def create_user(self, username: str, password: str, full_name: str, role: str = "user") -> bool:
         """Create a new user"""
-        if username in self.users:
+        if not self._insert_user(username, password, full_name, role):
             return False
 
-        self.users[username] = {
-            "password_hash": self._hash_password(password),
-            "role": role,
-            "created_at": datetime.now().isoformat(),
-            "full_name": full_name
-        }
-
         # Create user-specific directory
         user_dir = self.users_dir / username
         user_dir.mkdir(exist_ok=True)
 
-        # Initialize user KB with empty list
-        user_kb_path = user_dir / "user_kb.json"
-        with open(user_kb_path, 'w', encoding='utf-8') as f:
-            json.dump([], f)
+        # Initialize empty user KB (append-only JSONL)
+        user_kb_path = user_dir / "user_kb.jsonl"
+        user_kb_path.touch()
 
-        self._save_users()
         return True
 
     def delete_user(self, username: str) -> bool:
         """Delete a user"""
-        if username not in self.users or username == "admin":
+        if username == "admin":
             return False
 
-        del self.users[username]
-        self._save_users()
+        if self._execute("DELETE FROM users WHERE username = ?", (username,)).rowcount != 1:
+            return False
+
+        self._doc_counts.pop(username, None)
+        self._users_snapshot = None
         return True
 
     def change_password(self, username: str, new_password: str) -> bool:
         """Change user password"""
-        if username not in self.users:
-            return False
-
-        self.users[username]["password_hash"] = self._hash_password(new_password)
-        self._save_users()
-        return True
+        return self._set_password_hash(username, self._hash_password(new_password))
 
     def get_user_info(self, username: str) -> Optional[Dict]:
-        """Get user information"""
-        if username not in self.users:
-            return None
-
-        user_data = self.users[username].copy()
-        user_data.pop("password_hash", None)  # Don't expose password hash
-        user_data["username"] = username
-        return user_data
+        """Get user information (never the password hash)"""
+        row = self._execute("SELECT username, role, created_at, full_name FROM users WHERE username = ?",
+                            (username,)).fetchone()
+        return dict(row) if row else None
 
     def list_users(self) -> List[Dict]:
-        """List all users (admin only)"""
-        users_list = []
-        for username, data in self.users.items():
-            user_info = data.copy()
-            user_info.pop("password_hash", None)
-            user_info["username"] = username
-            users_list.append(user_info)
-        return users_list
+        """List all users (admin only); re-queried only after a user is added or removed"""
+        if self._users_snapshot is None:
+            rows = self._execute("SELECT username, role, created_at, full_name FROM users "
+                                 "ORDER BY rowid").fetchall()
+            self._users_snapshot = [dict(row) for row in rows]
+        return self._users_snapshot
 
     def is_admin(self, username: str) -> bool:
         """Check if user is admin"""
-        return username in self.users and self.users[username].get("role") == "admin"
+        row = self._execute("SELECT role FROM users WHERE username = ?", (username,)).fetchone()
+        return row is not None and row["role"] == "admin"
 
     def get_user_kb_path(self, username: str) -> str:
         """Get path to user's knowledge base"""
-        return str(self.users_dir / username / "user_kb.json")
+        return str(self.users_dir / username / "user_kb.jsonl")
+
+    def get_doc_count(self, username: str) -> int:
+        """Get number of documents in a user's knowledge base (cached)"""
+        if username not in self._doc_counts:
+            self._doc_counts[username] = UserKBStore(self.get_user_kb_path(username)).count()
+        return self._doc_counts[username]
+
+    def set_doc_count(self, username: str, count: int):
+        """Update the cached document count after a KB change"""
+        self._doc_counts[username] = count
 
     def get_user_vector_db_path(self, username: str) -> str:
         """Get path to user's vector database"""
@@ -130,10 +224,17 @@ class UserManager:
 
 # Singleton instance
 _user_manager = None
+_user_manager_lock = threading.Lock()
 
 def get_user_manager() -> UserManager:
-    """Get or create UserManager singleton"""
+    """
+    Get or create UserManager singleton
+    Double-checked locking: Streamlit sessions run on separate threads, and
+    two first calls must not each open the users database
+    """
     global _user_manager
     if _user_manager is None:
-        _user_manager = UserManager()
+        with _user_manager_lock:
+            if _user_manager is None:
+                _user_manager = UserManager()
     return _user_manager
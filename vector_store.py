@@ -2,18 +2,119 @@
 Vector Database and Embedding System
 Handles chunking, embedding, and storage of knowledge documents
 """
-import json
+import re
+import asyncio
+import time
 import logging
-from typing import List, Dict, Tuple
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Tuple
+import ijson
 import chromadb
 from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+from tokenizers import Tokenizer
+from chroma_utils import copy_collection, open_ip_collection
+from faiss_store import FaissChunkIndex
+from multi_user_vector_store import ChunkEmbedder
 import config
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+COLLECTION_NAME = "onestream_kb"
+COLLECTION_METADATA = {
+    "description": "OneStream Knowledge Base",
+    "hnsw:M": config.HNSW_M,
+    "hnsw:construction_ef": config.HNSW_CONSTRUCTION_EF,
+    "hnsw:search_ef": config.HNSW_SEARCH_EF
+}
+# Chunks encoded and added to ChromaDB per step while indexing
+INDEX_BATCH_SIZE = 256
+# Threads running collection.add while the next batch is chunked and encoded,
+# and how many encoded batches may wait for them
+INDEX_WRITE_WORKERS = 4
+MAX_PENDING_WRITES = 8
+
+# One-sentence chunk summaries: a small model is plenty
+SUMMARY_MODEL = "gpt-4o-mini"
+# Summary requests in flight at once; the SDK retries 429/5xx with exponential backoff
+SUMMARY_CONCURRENCY = 20
+SUMMARY_MAX_RETRIES = 5
+
+# Recent search results, keyed by (query, top_k): repeated questions (reruns,
+# page reloads) skip the encoder and the index. Cleared whenever the index changes
+SEARCH_CACHE_SIZE = 2048
+SEARCH_CACHE_TTL_SECONDS = 300
+
+# Split points tried in order, coarsest first; all zero-width, so joining the
+# pieces back together reproduces the text exactly
+SEPARATORS = [
+    r"(?=\n## )",       # Markdown headings
+    r"(?=\n### )",
+    r"(?<=\n\n)",       # Paragraphs
+    r"(?<=\n)",         # Lines
+    r"(?<=[.!?] )",     # Sentences
+    r"(?<= )"           # Words
+]
+# Documents shorter than this produce no chunk
+MIN_CHUNK_TOKENS = 64
+
+
+def _split_pieces(text: str, tokenizer: Tokenizer, max_tokens: int,
+                  separators: List[str]) -> List[Tuple[str, int]]:
+    """
+    Recursively split text at the coarsest separator until every piece fits
+    max_tokens; returns (piece, token count) in text order
+    """
+    if not separators:
+        # No separator left (e.g. one enormous token run): cut on token offsets
+        offsets = tokenizer.encode(text, add_special_tokens=False).offsets
+        return [(text[offsets[i][0]:offsets[min(i + max_tokens, len(offsets)) - 1][1]],
+                 min(max_tokens, len(offsets) - i))
+                for i in range(0, len(offsets), max_tokens)]
+
+    parts = [part for part in re.split(separators[0], text) if part]
+    # One Rust call sizes every part at this level
+    counts = [len(encoding.ids) for encoding in tokenizer.encode_batch(parts, add_special_tokens=False)]
+
+    pieces = []
+    for part, count in zip(parts, counts):
+        if count <= max_tokens:
+            pieces.append((part, count))
+        else:
+            pieces.extend(_split_pieces(part, tokenizer, max_tokens, separators[1:]))
+    return pieces
+
+
+def split_text(text: str, tokenizer: Tokenizer, max_tokens: int, overlap_tokens: int) -> List[str]:
+    """
+    Heading/paragraph/sentence-aware chunks of at most max_tokens tokens,
+    each starting with up to overlap_tokens tokens from the end of the previous one
+    """
+    chunks = []
+    window: List[Tuple[str, int]] = []
+    window_tokens = 0
+
+    def emit():
+        chunk = ''.join(piece for piece, _ in window).strip()
+        if chunk:
+            chunks.append(chunk)
+
+    for piece, count in _split_pieces(text, tokenizer, max_tokens, SEPARATORS):
+        if window and window_tokens + count > max_tokens:
+            emit()
+            # Carry the tail of this chunk into the next as overlap
+            while window and (window_tokens > overlap_tokens or window_tokens + count > max_tokens):
+                window_tokens -= window.pop(0)[1]
+        window.append((piece, count))
+        window_tokens += count
+
+    if window and (chunks or window_tokens >= MIN_CHUNK_TOKENS):
+        emit()
+    return chunks
+
 
 class VectorStore:
     """Manages embeddings and vector database"""
@@ -27,141 +128,292 @@ class VectorStore:
             settings=Settings(anonymized_telemetry=False)
         )
 
+        # Same process-wide embedding model as the multi-user store: INT8 ONNX
+        # Runtime on CPU, FP16 autocast on CUDA
+        self.embedder = ChunkEmbedder()
+        self.embedding_model = self.embedder.embedding_model
+
         # Create or get collection
-        self.collection = self.client.get_or_create_collection(
-            name="onestream_kb",
-            metadata={"description": "OneStream Knowledge Base"}
-        )
+        self.collection = self._open_collection()
+
+        self._search_cache: "OrderedDict[Tuple[str, int], Tuple[float, List[Dict]]]" = OrderedDict()
+        self._search_cache_lock = threading.Lock()
 
-        # Initialize embedding model
-        logger.info("Loading embedding model...")
-        self.embedding_model = SentenceTransformer(config.EMBEDDING_MODEL)
+        # Standalone copy of the model's Rust tokenizer for sizing chunks
+        # (the model's own instance keeps its encode-time truncation settings)
+        self.tokenizer = Tokenizer.from_str(self.embedding_model.tokenizer.backend_tokenizer.to_str())
+        self.tokenizer.no_truncation()
+        self.tokenizer.no_padding()
+        # [CLS]/[SEP] take two positions of the model's sequence length
+        self.max_chunk_tokens = min(config.CHUNK_TOKENS, self.embedding_model.max_seq_length - 2)
 
         # OpenAI client for summarization
-        self.openai_client = OpenAI(api_key=config.OPENAI_API_KEY)
+        self.openai_client = OpenAI(api_key=config.OPENAI_API_KEY, max_retries=SUMMARY_MAX_RETRIES)
 
         logger.info("Vector store initialized")
 
-    def chunk_text(self, text: str, chunk_size: int = config.CHUNK_SIZE,
-                   overlap: int = config.CHUNK_OVERLAP) -> List[str]:
+    def _open_collection(self):
+        """Chroma collection or FaissChunkIndex (same add/query/count API), per config"""
+        if config.VECTOR_STORE_BACKEND != "faiss":
+            return open_ip_collection(self.client, COLLECTION_NAME, COLLECTION_METADATA)
+
+        index = FaissChunkIndex(self.persist_directory, COLLECTION_NAME,
+                                self.embedding_model.get_sentence_embedding_dimension(),
+                                COLLECTION_METADATA)
+
+        # Carry over a KB previously indexed in Chroma (its embeddings are stored,
+        # so nothing is re-encoded), then drop it so a later clear() can't resurrect it
+        existing = {getattr(c, "name", c) for c in self.client.list_collections()}
+        if index.count() == 0 and COLLECTION_NAME in existing:
+            logger.info("Migrating %s from Chroma to FAISS...", COLLECTION_NAME)
+            copied = copy_collection(self.client.get_collection(COLLECTION_NAME), index)
+            index.persist()
+            self.client.delete_collection(COLLECTION_NAME)
+            logger.info("Migrated %s chunks to FAISS", copied)
+
+        return index
+
+    def clear(self):
+        """Drop every indexed chunk (recreates the collection)"""
+        if isinstance(self.collection, FaissChunkIndex):
+            self.collection.reset()
+        else:
+            self.client.delete_collection(COLLECTION_NAME)
+            self.collection = self._open_collection()
+        self.clear_search_cache()
+
+    def clear_search_cache(self):
+        """Forget cached search results (after any change to the index)"""
+        with self._search_cache_lock:
+            self._search_cache.clear()
+
+    def chunk_text(self, text: str, max_tokens: int = None,
+                   overlap_tokens: int = config.CHUNK_OVERLAP_TOKENS) -> List[str]:
         """
-        Split text into overlapping chunks
-        Uses sentence-aware chunking for better context preservation
+        Split text into overlapping chunks that fit the embedding model
+        Splits on headings, then paragraphs, lines, sentences and words, so
+        no chunk is silently truncated by the encoder
         """
-        words = text.split()
-        chunks = []
+        return split_text(text, self.tokenizer, max_tokens or self.max_chunk_tokens, overlap_tokens)
 
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk = ' '.join(words[i:i + chunk_size])
-            if len(chunk.split()) > 50:  # Minimum chunk size
-                chunks.append(chunk)
+    def document_chunks(self, doc: Dict) -> List[str]:
+        """
+        A document's chunks - content is either raw text or already chunked at
+        load time. Pre-chunked pieces (word windows, e.g. from
+        load_regulations_dataset) are split again to fit the model
+        """
+        content = doc['content']
+        if not isinstance(content, list):
+            return self.chunk_text(content)
+        return [chunk for piece in content for chunk in self.chunk_text(piece)]
 
-        return chunks
+    @staticmethod
+    def _summary_request(chunk: str) -> Dict:
+        return {
+            "model": SUMMARY_MODEL,
+            "messages": [{
+                "role": "user",
+                "content": f"Summarize this OneStream content in one sentence:\n\n{chunk[:500]}"
+            }],
+            "max_tokens": 50,
+            "temperature": 0.3
+        }
 
     def generate_chunk_summary(self, chunk: str) -> str:
-        """Generate a concise summary for a chunk using GPT-4o"""
+        """Generate a concise summary for a chunk"""
         try:
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{
-                    "role": "user",
-                    "content": f"Summarize this OneStream content in one sentence:\n\n{chunk[:500]}"
-                }],
-                max_tokens=50,
-                temperature=0.3
-            )
+            response = self.openai_client.chat.completions.create(**self._summary_request(chunk))
             return response.choices[0].message.content.strip()
         except Exception as e:
-            logger.error(f"Error generating summary: {e}")
+            logger.error("Error generating summary: %s", e)
             return chunk[:100]
 
-    def embed_documents(self, kb_path: str):
+    def generate_chunk_summaries(self, chunks: List[str]) -> List[str]:
         """
-        Load knowledge base, chunk, embed, and store in vector DB
+        Summarize many chunks concurrently (SUMMARY_CONCURRENCY requests in
+        flight), in input order; a chunk whose request fails falls back to
+        its first 100 characters, as in generate_chunk_summary
         """
-        logger.info(f"Loading knowledge base from {kb_path}...")
-
-        with open(kb_path, 'r', encoding='utf-8') as f:
-            documents = json.load(f)
-
-        logger.info(f"Processing {len(documents)} documents...")
+        async def summarize_all() -> List[str]:
+            semaphore = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+            async with AsyncOpenAI(api_key=config.OPENAI_API_KEY, max_retries=SUMMARY_MAX_RETRIES) as client:
 
-        all_chunks = []
-        all_metadata = []
-        all_ids = []
+                async def summarize(chunk: str) -> str:
+                    async with semaphore:
+                        try:
+                            response = await client.chat.completions.create(**self._summary_request(chunk))
+                            return response.choices[0].message.content.strip()
+                        except Exception as e:
+                            logger.error("Error generating summary: %s", e)
+                            return chunk[:100]
 
-        chunk_id = 0
-
-        for doc_idx, doc in enumerate(documents):
-            # Chunk the content
-            chunks = self.chunk_text(doc['content'])
-
-            logger.info(f"Document {doc_idx + 1}/{len(documents)}: "
-                       f"{doc['title']} -> {len(chunks)} chunks")
-
-            for chunk_idx, chunk in enumerate(chunks):
-                # Create metadata for this chunk
-                metadata = {
-                    "document_title": doc['title'],
-                    "url": doc['url'],
-                    "source_type": doc['source_type'],
-                    "chunk_index": chunk_idx,
-                    "total_chunks": len(chunks),
-                    "doc_summary": doc['summary']
-                }
-
-                all_chunks.append(chunk)
-                all_metadata.append(metadata)
-                all_ids.append(f"chunk_{chunk_id}")
-                chunk_id += 1
-
-        logger.info(f"Generating embeddings for {len(all_chunks)} chunks...")
-
-        # Generate embeddings
-        embeddings = self.embedding_model.encode(
-            all_chunks,
-            show_progress_bar=True,
-            batch_size=32
-        )
+                return await asyncio.gather(*(summarize(chunk) for chunk in chunks))
 
-        logger.info("Storing in vector database...")
+        return asyncio.run(summarize_all()) if chunks else []
 
-        # Add to ChromaDB in batches
-        batch_size = 100
-        for i in range(0, len(all_chunks), batch_size):
-            batch_end = min(i + batch_size, len(all_chunks))
+    def embed_documents(self, kb_path: str) -> int:
+        """
+        Stream the knowledge base one document at a time into index_documents,
+        so peak memory doesn't grow with the size of the KB file
+        Returns the number of chunks indexed
+        """
+        logger.info("Streaming knowledge base from %s...", kb_path)
 
-            self.collection.add(
-                ids=all_ids[i:batch_end],
-                embeddings=embeddings[i:batch_end].tolist(),
-                documents=all_chunks[i:batch_end],
-                metadatas=all_metadata[i:batch_end]
-            )
+        with open(kb_path, 'rb') as f:
+            return self.index_documents(ijson.items(f, 'item', use_float=True))
 
-        logger.info(f"✓ Successfully indexed {len(all_chunks)} chunks")
+    def index_documents(self, documents: Iterable[Dict]) -> int:
+        """
+        Chunk, embed and store documents as they arrive
+        Works on any iterable (including a generator fed by a producer thread):
+        chunks are encoded every INDEX_BATCH_SIZE and handed to writer threads,
+        so at most MAX_PENDING_WRITES batches of embeddings are held in memory.
+        Returns the number of chunks indexed
+        """
+        total_docs = len(documents) if hasattr(documents, "__len__") else "?"
 
-    def search(self, query: str, top_k: int = config.TOP_K_RESULTS) -> List[Dict]:
+        batch_chunks = []
+        batch_metadata = []
+        batch_ids = []
+        chunk_id = 0
+        pending = deque()
+
+        def flush(executor: ThreadPoolExecutor):
+            embeddings = self.embedder.encode_chunks(batch_chunks)
+
+            # Chroma persists the batch (SQLite + HNSW insert, releasing the GIL)
+            # while this thread moves on to the next batch
+            pending.append(executor.submit(
+                self.collection.add,
+                ids=batch_ids,
+                embeddings=embeddings,
+                documents=batch_chunks,
+                metadatas=batch_metadata
+            ))
+            while len(pending) > MAX_PENDING_WRITES:
+                pending.popleft().result()
+
+            logger.info("Indexed %s chunks", chunk_id)
+
+        with ThreadPoolExecutor(max_workers=INDEX_WRITE_WORKERS) as executor:
+            for doc_idx, doc in enumerate(documents):
+                # Chunk the content
+                chunks = self.document_chunks(doc)
+
+                logger.info("Document %s/%s: %s -> %d chunks",
+                            doc_idx + 1, total_docs, doc['title'], len(chunks))
+
+                for chunk_idx, chunk in enumerate(chunks):
+                    # Create metadata for this chunk
+                    metadata = {
+                        "document_title": doc['title'],
+                        "url": doc['url'],
+                        "source_type": doc['source_type'],
+                        "chunk_index": chunk_idx,
+                        "total_chunks": len(chunks),
+                        "doc_summary": doc['summary']
+                    }
+
+                    batch_chunks.append(chunk)
+                    batch_metadata.append(metadata)
+                    batch_ids.append(f"chunk_{chunk_id}")
+                    chunk_id += 1
+
+                    if len(batch_chunks) == INDEX_BATCH_SIZE:
+                        flush(executor)
+                        # Fresh lists: the submitted batch is still being written
+                        batch_chunks = []
+                        batch_metadata = []
+                        batch_ids = []
+
+            if batch_chunks:
+                flush(executor)
+
+            # Surface any failed write
+            for future in pending:
+                future.result()
+
+        if isinstance(self.collection, FaissChunkIndex):
+            self.collection.persist()
+        self.clear_search_cache()
+
+        logger.info("✓ Successfully indexed %s chunks", chunk_id)
+        return chunk_id
+
+    def set_search_ef(self, ef: int):
+        """Set the HNSW query-time candidate list size (recall vs speed)"""
+        metadata = dict(self.collection.metadata or {})
+        if metadata.get("hnsw:search_ef") == ef:
+            return
+        metadata["hnsw:search_ef"] = ef
+        # hnsw:space is fixed at creation and may not be passed to modify()
+        metadata.pop("hnsw:space", None)
+        self.collection.modify(metadata=metadata)
+        # Cached results were ranked with the old search breadth
+        self.clear_search_cache()
+
+    def search(self, query: str, top_k: int = config.TOP_K_RESULTS,
+               ef: int = None) -> List[Dict]:
         """
         Search vector database for relevant chunks
+        ef optionally overrides the HNSW search breadth
         Returns list of {content, metadata, distance}
         """
-        # Generate query embedding
-        query_embedding = self.embedding_model.encode([query])[0]
-
-        # Search ChromaDB
-        results = self.collection.query(
-            query_embeddings=[query_embedding.tolist()],
-            n_results=top_k,
-            include=["documents", "metadatas", "distances"]
-        )
+        return self.search_batch([query], top_k, ef)[0]
+
+    def search_batch(self, queries: List[str], top_k: int = config.TOP_K_RESULTS,
+                     ef: int = None) -> List[List[Dict]]:
+        """
+        Search for several queries at once: recent results come from an
+        in-process TTL/LRU cache, and the rest take one encode call and one
+        ChromaDB query. Returns one result list per query, in input order
+        """
+        if not queries:
+            return []
+
+        if ef is not None:
+            self.set_search_ef(ef)
+
+        found = {}
+        now = time.monotonic()
+        with self._search_cache_lock:
+            for query in queries:
+                key = (query, top_k)
+                cached = self._search_cache.get(key)
+                if cached is not None and now - cached[0] < SEARCH_CACHE_TTL_SECONDS:
+                    self._search_cache.move_to_end(key)
+                    found[query] = cached[1]
+
+        misses = [query for query in dict.fromkeys(queries) if query not in found]
+        if misses:
+            query_embeddings = self.embedder.encode(misses, batch_size=64)
+
+            results = self.collection.query(
+                query_embeddings=query_embeddings,
+                n_results=top_k,
+                include=["documents", "metadatas", "distances"]
+            )
+
+            now = time.monotonic()
+            with self._search_cache_lock:
+                for q, query in enumerate(misses):
+                    found[query] = self._format_results(results, q)
+                    self._search_cache[(query, top_k)] = (now, found[query])
+                    self._search_cache.move_to_end((query, top_k))
+                while len(self._search_cache) > SEARCH_CACHE_SIZE:
+                    self._search_cache.popitem(last=False)
+
+        # Copies, so callers can't alter cached lists
+        return [list(found[query]) for query in queries]
 
-        # Format results
+    def _format_results(self, results: Dict, q: int) -> List[Dict]:
+        """Format ChromaDB results for the q-th query as {content, metadata, distance}"""
         formatted_results = []
-        for i in range(len(results['ids'][0])):
+        for i in range(len(results['ids'][q])):
             formatted_results.append({
-                "content": results['documents'][0][i],
-                "metadata": results['metadatas'][0][i],
-                "distance": results['distances'][0][i]
+                "content": results['documents'][q][i],
+                "metadata": results['metadatas'][q][i],
+                "distance": results['distances'][q][i]
             })
 
         return formatted_results